@@ -7,10 +7,24 @@ import sys
 import socket
 import shutil
 import math
-from collections import defaultdict
-import codecs
+from collections import defaultdict, OrderedDict
+import io
 from random import randint
 import hashlib
+import heapq
+import re
+import datetime
+import struct
+import tempfile
+import time
+import json
+import numpy as np
+import multiprocessing
+import traceback
+import keyword
+import operator
+import csv
+from timeit import default_timer as timer
 
 """
 Description: 
@@ -19,7 +33,7 @@ For details see README.md
 
 Dependencies: 
 - logs.py logging class. 
-- arcpy version 10.2 or later
+- arcpy version 10.2 or later (and the numpy package installed with it)
 - Python 2.7.x (Python 3.x not supported)
 """
 
@@ -145,6 +159,7 @@ class ArcTools(object):
         try:
             print("Backing up %s to %s..." % (fcName, backupName))
             arcpy.FeatureClassToFeatureClass_conversion(fc,workGDB,backupName)
+            metadata_cache.invalidate(backup)
         except:
             logger.p2("Unable to backup %s to %s." % (fcName, backupName))
             return False
@@ -152,43 +167,96 @@ class ArcTools(object):
 
     def calcFeatureComplexity(self, fc):
         # Calculates feature complexity using arcpy.da.SearchCursor
-        # to retrieve geometries one at a time
+        # to retrieve geometries one at a time. Statistics are collected
+        # by a GeometryStats object (see getGeometryStats).
         print("Calculating complexity of feature geometries...")
-        fCount = 0
-        totalCount = self.getCount(fc)
-        maxCpx = 0
-        minCpx = 0
-        multipartCount = 0
-        vSum = 0
-        with arcpy.da.SearchCursor(fc,['SHAPE@']) as c:
-            for row in c:
-                v = row[0].pointCount - row[0].partCount
-                if row[0].partCount > 1:
-                    multipartCount += 1
-                vSum += v
-                fCount += 1
-                sys.stdout.write('\r')
-                print "Processing geometry %s of %s (%s%s complete)..." % (
-                    fCount,totalCount,round(((fCount/totalCount)*100),1),'%'),
-                if v > maxCpx:
-                    maxCpx = v
-                if minCpx == 0 and v > 0:
-                    # initialize the minimum vertex count by setting it to the vertex count of the
-                    # first feature having non-null geom, i.e. at least one vertex
-                    minCpx = v
-                elif v < minCpx and v > 0:
-                    minCpx = v
+        # Complexity of a feature is its vertex count less its part count; the
+        # minimum leaves out features without any (empty shapes).
+        stats = self.getGeometryStats(fc)
+        complexity = stats.sketches['complexity']
+        fCount = stats.count
+        multipartCount = stats.multipart_count
         msg = "\nSummary Statistics:"
         msg += "Total of %s features." % fCount
-        msg += "Average feature complexity: %s vertices." % round((vSum / fCount),2)
-        msg += "Maximum complexity: %s vertices." % maxCpx
-        msg += "Minimum complexity: %s vertices." % minCpx
+        if complexity.count:
+            msg += "Average feature complexity: %s vertices." % round(complexity.mean(),2)
+            msg += "Maximum complexity: %s vertices." % complexity.max
+            msg += "Minimum complexity: %s vertices." % (stats.min_complexity or 0)
+            msg += "Median / 90th / 99th percentile: %s / %s / %s vertices." % (
+                complexity.quantile(0.5), complexity.quantile(0.9), complexity.quantile(0.99))
         msg += "Multipart features: %s found." % multipartCount
         print(msg)
         if multipartCount > 0:
             print("Please run Multipart to Singlepart before continuing!")
         return msg
 
+    def getGeometryStats(self, fc, where_clause=None, workers=1):
+        # Collects vertex, part, ring, area and length statistics in one pass.
+        # Returns a GeometryStats object, which can be merged with others.
+        # With workers > 1 the table is split into OID ranges read by a pool
+        # of processes, and their statistics are merged.
+        if workers > 1 and where_clause is None:
+            clauses = self.getOIDRangeClauses(fc, workers * 4)
+            pool = _process_pool(workers)
+            try:
+                stats = GeometryStats()
+                for part in pool.imap_unordered(_geometry_stats_worker, [(fc, c) for c in clauses]):
+                    stats.merge(part)
+                return stats
+            finally:
+                pool.close()
+                pool.join()
+        stats = GeometryStats()
+        with arcpy.da.SearchCursor(fc, ['SHAPE@', 'SHAPE@WKB'], where_clause) as c:
+            for row in c:
+                stats.add(row[0], row[1])
+        return stats
+
+    def getOIDRange(self, fc):
+        # Returns (lowest OID, highest OID) of fc, or (None, None) if it is empty
+        oidField = arcpy.Describe(fc).OIDFieldName
+        ends = []
+        try:
+            for order in ['ASC', 'DESC']:
+                sql = (None, 'ORDER BY %s %s' % (oidField, order))
+                with arcpy.da.SearchCursor(fc, ['OID@'], sql_clause=sql) as c:
+                    for row in c:
+                        ends.append(row[0])
+                        break
+        except RuntimeError:
+            ends = []
+        if not ends and self.getCount(fc) == 0:
+            return (None, None)
+        if len(ends) == 2 and (ends[0] < ends[1] or self.getCount(fc) == 1):
+            return (ends[0], ends[1])
+        # ORDER BY is not supported (or ignored) by this data source, read all OIDs
+        low = high = None
+        with arcpy.da.SearchCursor(fc, ['OID@']) as c:
+            for row in c:
+                if low is None or row[0] < low:
+                    low = row[0]
+                if high is None or row[0] > high:
+                    high = row[0]
+        return (low, high)
+
+    def getOIDRangeClauses(self, fc, parts):
+        # Splits the OID range of fc into (at most) 'parts' equal ranges.
+        # Returns a list of where clauses, in OID order, covering every row.
+        (low, high) = self.getOIDRange(fc)
+        if low is None:
+            return []
+        oidField = arcpy.AddFieldDelimiters(fc, arcpy.Describe(fc).OIDFieldName)
+        parts = max(1, min(parts, high - low + 1))
+        width = (high - low + 1) / parts
+        clauses = []
+        for k in range(parts):
+            start = low + int(round(k * width))
+            stop = low + int(round((k + 1) * width))
+            if k == parts - 1:
+                stop = high + 1
+            clauses.append('%s >= %s AND %s < %s' % (oidField, start, oidField, stop))
+        return clauses
+
     def restoreFC(self, fc):
         # Copies FROM a backup TO an original feature class.
         # Get the base name of the feature class
@@ -206,6 +274,7 @@ class ArcTools(object):
             #do the fc to fc. FROM backup TO fc
             print("Restoring from %s..." % os.path.basename(backup))
             arcpy.FeatureClassToFeatureClass_conversion(backup,workGDB,fcName)
+            metadata_cache.invalidate(fc)
         else:
             print("Feature class is locked. Can't restore from backup.")
         pass
@@ -213,17 +282,17 @@ class ArcTools(object):
     def getSmartRow(self, fields, row):
         # returns a "smart" row object as a dict with reasonable names and
         # the row values added.
-        rowDict = {}
-        for i in range(0,len(row)):
-            rowDict[fields[i]] = row[i]
-        return rowDict
+        # In loops, RecordSchema(fields).record(row) is much cheaper.
+        return dict(zip(fields, row))
 
     def setRowValues(self, c, row, fields, srows):
         """
         c is an arcpy.da update cursor object
         Row is a complete arcpy.da row object
         fields must be the FULL LIST of fields, in the
-        same order and with the same size as the row object
+        same order and with the same size as the row object.
+        fields may also be a RecordSchema of the cursor fields, which
+        saves looking up the field positions for every row.
         srows is a list of smartRow DICTIONARY objects
         (field name-value pairs). Should look like this:
         [{'field1':'newVal'},{'field2':123}]
@@ -231,9 +300,8 @@ class ArcTools(object):
         complete (one srow object for each field). """
         for srow in srows:
             logger.p5(' %s' % srow)
-            fieldName = list(srow.keys())[0]
-            findex = fields.index(fieldName)
-            row[findex] = srow[fieldName]
+            for (fieldName, value) in srow.items():
+                row[fields.index(fieldName)] = value
         c.updateRow(row)
 
     def setSmartRow(self, fields, smartRow):
@@ -247,25 +315,16 @@ class ArcTools(object):
          THE SMART ROW OBJECT DOES NOT NECESSARILY HAVE TO HAVE A 1:1 CORRESPONDENCE
          WITH THE FIELD LIST. All of the expected items in fields must be present.
         """
-        rowList = []
-        positionList = {}
         for fieldName in smartRow:
-            #Get the index of this fieldName in the fields
-            findex = fields.index(fieldName)
-            value = smartRow[fieldName]
-            positionList[findex] = value
-        # sort the positionList, and use it to make a row list
-        for key in sorted(positionList.keys()):
-            rowList.append(positionList[key])
-        # cast row list as a tuple for stupid arc cursor
-        row = tuple(rowList)
-        return row
-        pass
+            if fieldName not in fields:
+                raise ValueError('Field %s is not in %s' % (fieldName, fields))
+        # Values in the order of fields, as a tuple for stupid arc cursor
+        return tuple([smartRow[fieldName] for fieldName in fields if fieldName in smartRow])
 
     def getFieldNames(self, fc):
         # Gets all the field names for a feature class
         fieldList = []
-        for f in arcpy.ListFields(fc):
+        for f in metadata_cache.fields(fc):
             fieldList.append(str(f.name))
         return fieldList
 
@@ -294,15 +353,23 @@ class ArcTools(object):
         return ['OID@'] + fieldList
 
     def getCount(self, fc):
-        # Get the count of features in a feature class
-        r = arcpy.GetCount_management(fc)
-        return int(r.getOutput(0))
+        # Get the count of features in a feature class (cached while the data is unchanged)
+        return metadata_cache.count(fc)
+
+    def getDescription(self, fc):
+        # Returns a dict of cached Describe properties of fc, see MetadataCache
+        return metadata_cache.describe(fc)
+
+    def refreshMetadata(self, fc=None):
+        # Forgets cached schema and Describe metadata of fc (all datasets if fc is None).
+        # Needed after changing a schema other than through ArcTools.
+        metadata_cache.invalidate(fc)
 
     def getFieldNamesRequired(self, fc, req):
         # Gets a list of either required fields (req=True)
         # or non-required fields (req = False)
         fieldList = []
-        fieldObjList = arcpy.ListFields(fc)
+        fieldObjList = metadata_cache.fields(fc)
         for f in fieldObjList:
             if f.required == req:
                 #Flag for getting required fields (req=True)
@@ -368,6 +435,8 @@ class ArcTools(object):
         except:
             logger.p2("Couldn't delete fields!")
             return False
+        finally:
+            metadata_cache.invalidate(fc)
 
     def renameField(self, fc, oldName, newName):
         # Likely reasons for this tool to fail:
@@ -412,6 +481,8 @@ class ArcTools(object):
         except:
             logger.p2("Unable to rename field %s." % oldName)
             return False
+        finally:
+            metadata_cache.invalidate(fc)
 
     def renameFieldsToMatchAlias(self, fc):
         """
@@ -445,6 +516,7 @@ class ArcTools(object):
         if colType == 'LONG':
             tmpColName = colName + '_long'
             arcpy.AddField_management(fc, tmpColName, colType)
+            metadata_cache.invalidate(fc)
             # Try to calculate the old field into the new one
             calc = "int(!%s!)" % colName
             try:
@@ -528,6 +600,7 @@ class ArcTools(object):
             try:
                 print('%s' % os.path.basename(fc))
                 arcpy.Delete_management(fc)
+                metadata_cache.invalidate(fc)
             except:
                 print("Unable to delete %s." % os.path.basename(fc))
 
@@ -593,6 +666,7 @@ class ArcTools(object):
     def createSRObject(self, srType, obj, verbose=False):
         # Creates spatial reference objects in 3 ways:
         # 3 ways to set spatial reference.
+        # Objects made by NAME or WKID are cached and shared, see spatial_reference.
         srTypeList = ['FC','NAME','WKID']
         if srType.upper() not in srTypeList:
             print(("Spatial reference type must be one of %s" % srTypeList))
@@ -617,7 +691,7 @@ class ArcTools(object):
             obj = obj.replace('_',' ')
             try:
                 # Try to create a spatial reference object by name
-                sr = arcpy.SpatialReference(obj)
+                sr = spatial_reference(obj)
 
             except:
                 print("Unable to set projection to %s. Check spelling." % obj)
@@ -630,7 +704,7 @@ class ArcTools(object):
         if srType == 'WKID' and type(obj) is int:
             try:
                 # Try to create a spatial reference object by WKID (factory code)
-                sr = arcpy.SpatialReference(obj)
+                sr = spatial_reference(obj)
 
             except:
                 print("%d does not seem to be a valid factory code (WKID/ESPG ID)." % obj)
@@ -683,6 +757,7 @@ class ArcTools(object):
             print("Found exactly one feature with region name %s" % region)
             boundary = os.path.join(workGDB,'%s_boundary' % region)
             arcpy.CopyFeatures_management(region_lyr,boundary)
+            metadata_cache.invalidate(boundary)
             return boundary
 
     def validateField(self, fc, colName, valueList):
@@ -700,17 +775,19 @@ class ArcTools(object):
         badRowList = []
         badValueList = []
         badValueIndex = {}
+        # Set lookup instead of scanning the list for every row
+        allowed = set(valueList)
         OIDField = arcpy.Describe(fc).OIDFieldName
         with arcpy.da.SearchCursor(fc, [colName,OIDField]) as c:
             for row in c:
                 processedCount += 1
                 badVal = row[0]
                 badRowOID = row[1]
-                if not badVal in valueList:
+                if not badVal in allowed:
                     badRows += 1
                     badRowList.append(badRowOID)
                     badValueList.append(badVal)
-                    if badVal in list(badValueIndex.keys()):
+                    if badVal in badValueIndex:
                         badValueIndex[badVal].append(badRowOID)
                     else:
                         badValueIndex[badVal] = [badRowOID]
@@ -724,6 +801,58 @@ class ArcTools(object):
         else:
             return (None,None,None)
 
+    def validateRules(self, fc, rules, where_clause=None, silent=False):
+        # Checks any number of attribute rules in a single cursor pass.
+        # rules: list of ValidationRule objects (AllowedValues, MatchesPattern, InRange,
+        # NotNull, CrossField) or their dict form, see make_rule. For example:
+        #   [{'rule': 'not_null', 'column': 'NAME'},
+        #    {'rule': 'allowed', 'column': 'STATUS', 'values': ['ACTIVE', 'RETIRED']},
+        #    {'rule': 'pattern', 'column': 'CODE', 'pattern': '[A-Z]{2}[0-9]{3}'},
+        #    CrossField(['START_DATE', 'END_DATE'], lambda start, end: start <= end)]
+        # Returns a dict of rule name -> list of OIDs of the rows that break the rule.
+        rules = [make_rule(rule) for rule in rules]
+        # Rule names are the keys of the result, made unique here without
+        # renaming the caller's rule objects
+        keys = []
+        for rule in rules:
+            key = rule.name
+            k = 2
+            while key in keys:
+                key = '%s (%s)' % (rule.name, k)
+                k += 1
+            keys.append(key)
+        fieldNames = self.getFieldNames(fc)
+        cursorFields = ['OID@']
+        for rule in rules:
+            for column in rule.columns:
+                if column not in fieldNames:
+                    raise ValueError('Column %s of rule %s not found in %s' % (column, rule.name, fc))
+                if column not in cursorFields:
+                    cursorFields.append(column)
+        violations = dict((key, []) for key in keys)
+        # Single-column rules take the value, others the values of their columns
+        single = [(cursorFields.index(rule.columns[0]), rule.test, violations[key])
+                  for (rule, key) in zip(rules, keys) if len(rule.columns) == 1]
+        multi = [([cursorFields.index(column) for column in rule.columns], rule.test, violations[key])
+                 for (rule, key) in zip(rules, keys) if len(rule.columns) > 1]
+        rowCount = 0
+        with arcpy.da.SearchCursor(fc, cursorFields, where_clause) as c:
+            for row in c:
+                rowCount += 1
+                for (i, test, bad) in single:
+                    if not test(row[i]):
+                        bad.append(row[0])
+                for (indexes, test, bad) in multi:
+                    if not test(*[row[i] for i in indexes]):
+                        bad.append(row[0])
+        if not silent:
+            logger.info('Checked %s rules on %s rows of %s' % (len(rules), rowCount, fc))
+            for key in keys:
+                oids = violations[key]
+                if oids:
+                    logger.warning('%s: %s rows invalid, e.g. OIDs %s' % (key, len(oids), oids[:10]))
+        return violations
+
     def notNullOrEmpty(self, fc, colName):
         # Validates a TEXT column 'colName' for the following:
         # - Not a zero-length (empty) string
@@ -758,9 +887,11 @@ class ArcTools(object):
                     continue
                 else:
                     # Valid, non-null, non-empty, non-whitespace string
-                    # Trim trailing and leading whitespaces
-                    row[0] = testVal.strip()
-                    c.updateRow(row)
+                    # Trim trailing and leading whitespaces, writing only rows that change
+                    trimmed = testVal.strip()
+                    if trimmed != testVal:
+                        row[0] = trimmed
+                        c.updateRow(row)
             # Display progress
             sys.stdout.write('\r')
             print("OK rows: %s. Bad rows: %s. (%s%s)" % (
@@ -779,21 +910,139 @@ class ArcTools(object):
         if not colName in self.getFieldNames(fc):
             print("Column %s not found!" % colName)
             return False
-        expression = "wsToNull(!%s!)" % colName
-        codeblock = """def wsToNull(colName):
-            if colName.strip() == '' or colName.strip() == 'None':
-                return None
-            else:
-                return colName"""
         try:
-            # Execute CalculateField
-            arcpy.CalculateField_management(fc, colName, expression, "PYTHON_9.3", codeblock)
+            self.cleanFields(fc, {colName: ['whitespace_to_null']}, silent=True)
             print("Complete!")
             return True
-        except:
+        except RuntimeError:
             print("\nProblem calculating field. Check that %s is a NULLABLE TEXT field." % colName)
             return False
 
+    def cleanFields(self, fc, transforms, where_clause=None, silent=False):
+        # Cleans any number of columns in a single UpdateCursor pass.
+        # transforms: dict of column name -> list of transforms applied in order. A transform
+        # is a function of one value or its declarative form (see make_transform):
+        #   'trim', 'whitespace_to_null', 'upper', 'lower', 'title', 'to_number',
+        #   ('values_to_null', [0, -9999]), ('case', 'upper'), ('to_number', 'int')
+        # e.g. {'NAME': ['trim', 'whitespace_to_null', 'title'], 'DEPTH': [('values_to_null', [-9999])]}
+        # Only rows where a value actually changed are written.
+        # Returns a dict of column name -> number of values changed.
+        columns = list(transforms.keys())
+        fieldNames = self.getFieldNames(fc)
+        for column in columns:
+            if column not in fieldNames:
+                raise ValueError('Column %s not found in %s' % (column, fc))
+        chains = [[make_transform(spec) for spec in transforms[column]] for column in columns]
+        changes = [0] * len(columns)
+        rowCount = 0
+        written = 0
+        with arcpy.da.UpdateCursor(fc, columns, where_clause) as c:
+            for row in c:
+                rowCount += 1
+                changed = False
+                for (i, chain) in enumerate(chains):
+                    old = row[i]
+                    val = old
+                    for transform in chain:
+                        val = transform(val)
+                    # Compared by value: '1' to 1 is a change, 1 to 1.0 or
+                    # 'a' to u'a' is not
+                    if val != old:
+                        row[i] = val
+                        changes[i] += 1
+                        changed = True
+                if changed:
+                    c.updateRow(row)
+                    written += 1
+        counts = dict(zip(columns, changes))
+        if not silent:
+            logger.info('Cleaned %s: %s of %s rows changed' % (fc, written, rowCount))
+            for column in columns:
+                logger.info('  %s: %s values changed' % (column, counts[column]))
+        return counts
+
+    def bulkUpdate(self, fc, updates, keyField='OID@', where_clause=None, silent=False):
+        # Applies a batch of changes in a single UpdateCursor pass.
+        # updates: dict of key -> dict of column name -> new value, where key is the
+        # value of keyField (the OID by default, or any field with unique values), e.g.
+        # {12: {'NAME': 'Fraser River'}, 40: {'NAME': None, 'DEPTH': 3.5}}
+        # Rows are looked up by key as the cursor passes them, so the batch does not
+        # need to be sorted. Small batches only read their own rows (IN clause);
+        # larger batches keyed on the OID only read the OID range they cover.
+        # Only rows where a value actually changed are written.
+        # Returns a dict with the number of keys 'applied' (row written), 'unchanged'
+        # (row found, values already equal) and 'missing' (no row with that key), which
+        # add up to len(updates). A key held by several rows counts as applied if any
+        # of them was written.
+        if not updates:
+            return {'applied': 0, 'unchanged': 0, 'missing': 0}
+        columns = set()
+        for change in updates.values():
+            columns.update(change)
+        columns = sorted(columns)
+        fieldNames = self.getFieldNames(fc)
+        for column in [keyField] + columns:
+            if column != 'OID@' and column not in fieldNames:
+                raise ValueError('Column %s not found in %s' % (column, fc))
+        clause = self.keyClause(fc, keyField, list(updates.keys()))
+        if where_clause and clause:
+            clause = '(%s) AND (%s)' % (where_clause, clause)
+        elif where_clause:
+            clause = where_clause
+        positions = dict((column, i + 1) for (i, column) in enumerate(columns))
+        seen = set()
+        applied = set()
+        written = 0
+        with arcpy.da.UpdateCursor(fc, [keyField] + columns, clause) as c:
+            for row in c:
+                key = row[0]
+                change = updates.get(key)
+                if change is None:
+                    continue
+                if key in seen:
+                    logger.warning('Key %s is not unique in %s, updating every row with it' % (key, fc))
+                seen.add(key)
+                changed = False
+                for (column, val) in change.items():
+                    i = positions[column]
+                    if row[i] != val:
+                        row[i] = val
+                        changed = True
+                if changed:
+                    c.updateRow(row)
+                    applied.add(key)
+                    written += 1
+        missing = [key for key in updates if key not in seen] if len(seen) < len(updates) else []
+        counts = {'applied': len(applied), 'unchanged': len(seen) - len(applied), 'missing': len(missing)}
+        if not silent:
+            logger.info('Updated %s: %s rows changed (%s keys), %s keys already up to date, %s keys not found' % (
+                fc, written, counts['applied'], counts['unchanged'], len(missing)))
+            if missing:
+                logger.info('  Keys not found: %s%s' % (
+                    ', '.join(str(key) for key in missing[:10]), ' ...' if len(missing) > 10 else ''))
+        return counts
+
+    def keyClause(self, fc, keyField, keys, maxInKeys=1000):
+        # Where clause selecting the rows with the given key values, or None if the
+        # whole table has to be read
+        if keyField == 'OID@':
+            keyField = metadata_cache.describe(fc)['OIDFieldName']
+        column = arcpy.AddFieldDelimiters(fc, keyField)
+        keys = [key for key in keys if key is not None]
+        if not keys:
+            return None
+        if len(keys) <= maxInKeys:
+            if all(isinstance(key, basestring) for key in keys):
+                values = ["'%s'" % key.replace("'", "''") for key in keys]
+            elif all(isinstance(key, (int, long)) for key in keys):
+                values = [str(key) for key in keys]
+            else:
+                return None
+            return '%s IN (%s)' % (column, ','.join(values))
+        if keyField == metadata_cache.describe(fc)['OIDFieldName']:
+            return '%s >= %s AND %s <= %s' % (column, min(keys), column, max(keys))
+        return None
+
     def appendAndCreate(self, fcList, fc):
         # Appends all feature classes in fcList to output fc
         # If fc does not exist, it will be created.
@@ -802,11 +1051,13 @@ class ArcTools(object):
             baseFC = fcList[0]
             logger.p4("Creating output feature class %s" % os.path.basename(fc))
             arcpy.CopyFeatures_management(baseFC,fc)
+            metadata_cache.invalidate(fc)
             # Remove the item that has been copied from the list of feature classes
             fcList.remove(fcList[0])
         # Append all remaining feature classes in the list to fc
         logger.p4("Appending %s items to %s" % (len(fcList), os.path.basename(fc)))
         arcpy.Append_management(fcList,fc,"NO_TEST")
+        metadata_cache.invalidate(fc)
 
     def valuesToNulls(self, fc, colName, values):
         # Converts all 'values' found in NUMERIC field to <Null> (Python None)
@@ -830,30 +1081,20 @@ class ArcTools(object):
         if not colName in self.getFieldNames(fc):
             logger.p2("Column %s not found!" % colName)
             return False
-        expression = "valsToNull(!%s!,%s)" % (colName,values)
-        # return None in the below code block returns a python None type
-        # to the python field calculator, and inserts it into colName
-        # (colName contains the value at a specific row for that column)
-        codeblock = """def valsToNull(colName,values):
-            if colName in values:
-                return None
-            else:
-                return colName"""
         try:
-            # Execute CalculateField
-            arcpy.CalculateField_management(fc, colName, expression, "PYTHON_9.3", codeblock)
+            self.cleanFields(fc, {colName: [('values_to_null', values)]}, silent=True)
             logger.p4("Complete!")
             return True
-        except:
+        except RuntimeError:
             logger.p2("Problem calculating field. Check that %s is a NULLABLE NUMERIC field." % colName)
             return False
 
     def isTable(self, fc):
-        return arcpy.Describe(fc).dataType == 'Table'
+        return metadata_cache.describe(fc)['dataType'] == 'Table'
 
     def isFeatureClass(self, fc):
         try:
-            data_type = arcpy.Describe(fc).dataType
+            data_type = metadata_cache.describe(fc)['dataType']
             if data_type in ['FeatureClass', 'ShapeFile']:
                 return True
             return False
@@ -871,8 +1112,9 @@ class ArcTools(object):
                 fieldList = ['SHAPE@'] + fieldList
         else:
             # Assume the user has already supplied a field list. Make sure that the fields exist.
+            fieldNames = set(self.getFieldNames(fc))
             for f in fieldList:
-                if f not in self.getFieldNames(fc):
+                if f not in fieldNames:
                     print("Field %s does not exist in feature class %s!" % (f, os.path.basename(fc)))
                     return False
             # If we passed to here, all the field names are OK.
@@ -913,6 +1155,16 @@ class ArcTools(object):
         uc = arcpy.da.UpdateCursor(fc, fieldList)
         return uc
 
+    def getBulkWriter(self, fc, fieldList, commitRows=50000, commitSeconds=60.0, editSession=None):
+        # Returns a BulkWriter for loading many rows into fc: use it in a with block and
+        # feed it rows with write() or write_rows(). It commits every commitRows rows or
+        # commitSeconds seconds, in an edit session if the workspace needs one.
+        if not 'SHAPE@' in fieldList:
+            fieldList = self.getValidFieldList(fc, fieldList)
+        if not fieldList:
+            return False
+        return BulkWriter(fc, fieldList, commitRows, commitSeconds, editSession)
+
     def startEditing(self, workGDB):
         # Start edit session so we can delete and add rows to multiple tables
         arcpy.AddMessage("\rStarting to edit output table..."),
@@ -954,6 +1206,7 @@ class ArcTools(object):
             sr = self.createSRObject('FC', templateFC)
         fc = arcpy.CreateFeatureclass_management(
             workGDB, fcName, geomType, templateFC, 'DISABLED','DISABLED',sr)
+        metadata_cache.invalidate(newFC)
         return fc
 
     def exportTableToCSV(self, fc, outCSV, userFieldList=[],
@@ -961,109 +1214,344 @@ class ArcTools(object):
                          exportOID=True,
                          nullFormat=None,
                          exportGeom=False,
-                         quoteStrings=True):
-        #This always exports a table with strings quoted. It will also check to see if any of your strings contain a delimiter character or a newline, and if so it will stop and ask what to do.
-        #First, get all the fields. We'll use the arcpy method since it gives all field details.
+                         quoteStrings=True,
+                         compress=None,
+                         progress=None,
+                         progressRows=100000,
+                         workers=1,
+                         manifest=False):
+        # Exports a table or feature class to CSV, appending to outCSV if it exists.
+        # Text values are quoted (quoteStrings) or only when they contain the delimiter,
+        # a quote or a line break; quotes inside text are doubled, as in standard CSV.
+        # nullFormat is the text written for nulls (default: None).
+        # compress: write gzip. Default is to compress if outCSV ends with .gz
+        # progress: optional function called as progress(rows, bytes) every progressRows
+        # rows and at the end. By default progress is logged.
+        # workers: with more than 1 (0 for one per CPU core), OID ranges of the table are
+        # exported to part files by a pool of processes, see writeCSVParts.
+        # manifest: with workers, keep the part files and describe them in
+        # outCSV + '.manifest.json' instead of joining them into outCSV.
+        # Returns the number of rows exported, or False if the output can't be opened.
         arcpy.AddMessage("\nOptions selected: \nFields: %s \nDelimiter: '%s' Export OID: %s Export Geom: %s" % (userFieldList,delimiter, exportOID, exportGeom))
+        if compress is None:
+            compress = outCSV.lower().endswith('.gz')
         try:
-            f = open(outCSV, 'a+')
-            f.close()
-        except:
+            if workers == 1:
+                f = self.openCSV(outCSV, compress)
+            elif not manifest:
+                # Parts are copied in as they are, already compressed
+                f = self.openCSV(outCSV)
+        except IOError:
             arcpy.AddMessage("Cannot open output file!\n%s" % outCSV)
             return False
 
-        # Get all fields at first
-        fieldList = arcpy.ListFields(fc)
-        textFieldsIndex = []
-        # Sanitize the field list by removing OID and shape, if requested
-        fieldList2 = []
+        fieldList = self.getCSVFields(fc, userFieldList, exportOID, exportGeom)
+        fieldNames = [field.name for field in fieldList]
+        formatters = self.getCSVFormatters(fieldList, delimiter, quoteStrings, nullFormat)
+        header = self.getCSVHeader(fieldNames, delimiter, quoteStrings)
+        arcpy.AddMessage("Writing header: %s" % header)
+        arcpy.AddMessage("Fields to export: %s" % fieldNames)
+        totalRows = self.getCount(fc)
+        if progress is None:
+            def progress(rows, size):
+                arcpy.AddMessage("Exported row %s of %s (%.1f MB)..." % (rows, totalRows, size / 1048576.0))
+        arcpy.AddMessage("Starting export...")
+        if workers != 1:
+            options = (userFieldList, delimiter, exportOID, nullFormat, exportGeom, quoteStrings, compress)
+            try:
+                rowCount = self.writeCSVParts(fc, outCSV, header, options, workers, manifest, progress,
+                                              None if manifest else f)
+            finally:
+                if not manifest:
+                    f.close()
+            arcpy.AddMessage("\nAll done. %s rows exported." % rowCount)
+            return rowCount
+        try:
+            f.write((header + u'\n').encode('utf-8'))
+            (rowCount, size) = self.writeCSVRows(fc, fieldNames, formatters, f, delimiter,
+                                                 progress=progress, progressRows=progressRows)
+        finally:
+            f.close()
+        arcpy.AddMessage("\nAll done. %s rows exported." % rowCount)
+        return rowCount
+
+    def writeCSVParts(self, fc, outCSV, header, options, workers=0, manifest=False, progress=None,
+                      out=None):
+        # Exports fc in OID ranges, each written by a worker process to its own part file
+        # (outCSV.part0000, ...) with the same options as exportTableToCSV.
+        # The parts are appended to outCSV in OID order as they finish, which gives the same
+        # bytes as a serial export when the table is read in OID order (as file geodatabases
+        # are). Gzip parts are separate gzip members, so they decompress to the same text.
+        # With manifest=True the parts are kept and outCSV.manifest.json lists them, with
+        # the header, instead. out is outCSV opened with openCSV (uncompressed), or None
+        # with manifest=True. Returns the number of rows exported.
+        if not workers or workers < 1:
+            workers = multiprocessing.cpu_count()
+        compress = options[-1]
+        # Several ranges per worker, so a slow range does not hold up the others
+        clauses = self.getOIDRangeClauses(fc, workers * 4)
+        tasks = [(fc, '%s.part%04d' % (outCSV, k), clause, options) for (k, clause) in enumerate(clauses)]
+        shards = []
+        rowCount = 0
+        size = 0
+        if not manifest:
+            data = (header + u'\n').encode('utf-8')
+            if compress:
+                import gzip
+                # Header as its own gzip member, like the parts
+                member = gzip.GzipFile(fileobj=out, mode='wb')
+                member.write(data)
+                member.close()
+            else:
+                out.write(data)
+        pool = _process_pool(workers)
+        try:
+            # imap returns the parts in order, while later parts are still being exported
+            for (partPath, clause, rows, partSize) in pool.imap(_csv_export_worker, tasks):
+                rowCount += rows
+                size += partSize
+                if manifest:
+                    shards.append({'path': os.path.basename(partPath), 'where': clause,
+                                   'rows': rows, 'bytes': partSize})
+                else:
+                    with open(partPath, 'rb') as part:
+                        shutil.copyfileobj(part, out, 1024 * 1024)
+                    os.remove(partPath)
+                if progress:
+                    progress(rowCount, size)
+        finally:
+            pool.close()
+            pool.join()
+        if manifest:
+            with open(outCSV + '.manifest.json', 'wb') as m:
+                json.dump({'source': fc, 'header': header, 'compressed': bool(compress),
+                           'rows': rowCount, 'shards': shards}, m, indent=2)
+            arcpy.AddMessage("Wrote %s part files, listed in %s.manifest.json" % (len(shards), outCSV))
+        return rowCount
+
+    def exportCSVPart(self, fc, partPath, whereClause, userFieldList=[], delimiter=",", exportOID=True,
+                      nullFormat=None, exportGeom=False, quoteStrings=True, compress=False):
+        # Writes the rows of fc selected by whereClause to a new CSV file without header.
+        # Returns (rows, bytes of CSV text).
+        fieldList = self.getCSVFields(fc, userFieldList, exportOID, exportGeom)
+        formatters = self.getCSVFormatters(fieldList, delimiter, quoteStrings, nullFormat)
+        if os.path.exists(partPath):
+            os.remove(partPath)
+        f = self.openCSV(partPath, compress)
+        try:
+            return self.writeCSVRows(fc, [field.name for field in fieldList], formatters, f,
+                                     delimiter, whereClause)
+        finally:
+            f.close()
+
+    def openCSV(self, outCSV, compress=False):
+        # Opens outCSV for appending bytes through a large write buffer, gzipped if requested.
+        # Appending to a gzip file adds a new gzip member, which readers treat as one stream.
+        if compress:
+            import gzip
+            return io.BufferedWriter(gzip.open(outCSV, 'ab'), 1024 * 1024)
+        return io.open(outCSV, 'ab', buffering=1024 * 1024)
+
+    def getCSVFields(self, fc, userFieldList=[], exportOID=True, exportGeom=False):
+        # Returns the fields of fc to export, in table order.
+        # OID and shape are included if requested. userFieldList limits the other fields.
+        fieldList = []
         arcpy.AddMessage("\nFields found in feature class:")
-        for field in fieldList:
+        for field in arcpy.ListFields(fc):
             arcpy.AddMessage("%s (%s)" % (field.name,field.type))
             if field.type == 'OID':
                 if exportOID:
-                    fieldList2.append(field)
-                else:
-                    continue
+                    fieldList.append(field)
             elif field.type == 'Geometry':
                 if exportGeom:
-                    fieldList2.append(field)
-                else:
-                    continue
-            else:
-                if len(userFieldList) > 0:
-                    # The user has supplied a field list, so we must limit all fields accordingly
-                    if field.name in userFieldList:
-                        fieldList2.append(field)
-                elif len(userFieldList) == 0:
-                    # No user fields supplied. Simply append all other fields
-                    fieldList2.append(field)
+                    fieldList.append(field)
+            elif not userFieldList or field.name in userFieldList:
+                fieldList.append(field)
         arcpy.AddMessage("\n")
-        # Find the indexes of all text fields.
-        index = 0
-        for field in fieldList2:
+        return fieldList
+
+    def getCSVHeader(self, fieldNames, delimiter=",", quoteStrings=True):
+        # Header line, with names quoted like text values
+        quote = self.getCSVQuoter(delimiter, quoteStrings)
+        return delimiter.join([quote(name) for name in fieldNames])
+
+    def getCSVQuoter(self, delimiter=",", quoteStrings=True):
+        # Returns a function that quotes a unicode string for CSV: always, or only if needed.
+        if quoteStrings:
+            def quote(text):
+                return u'"%s"' % text.replace(u'"', u'""')
+        else:
+            special = re.compile(u'[%s"\r\n]' % re.escape(delimiter))
+
+            def quote(text):
+                if special.search(text):
+                    return u'"%s"' % text.replace(u'"', u'""')
+                return text
+        return quote
+
+    def getCSVFormatters(self, fieldList, delimiter=",", quoteStrings=True, nullFormat=None):
+        # Builds one function per field that turns a cursor value into CSV text.
+        # Values are written with '%s'; nulls as nullFormat, or None if not given.
+        nullText = u'None' if nullFormat is None else u'%s' % nullFormat
+        quote = self.getCSVQuoter(delimiter, quoteStrings)
+        # Shapes may be written as coordinate tuples, which can contain the delimiter
+        quoteIfNeeded = self.getCSVQuoter(delimiter, False)
+
+        def formatText(val):
+            if val is None:
+                return nullText
+            return quote(val)
+
+        def formatShape(val):
+            if val is None:
+                return nullText
+            return quoteIfNeeded(u'%s' % (val,))
+
+        def formatValue(val):
+            if val is None:
+                return nullText
+            return u'%s' % val
+
+        formatters = []
+        for field in fieldList:
             if field.type == 'String':
-                textFieldsIndex.append(index)
-            index += 1
-        # Write a header, and make a list of field names for the search cursor
-        header = ""
-        fieldList3 = []
-        for field in fieldList2:
-            fieldName = field.name
-            fieldList3.append(fieldName)
-            if quoteStrings:
-                header += '"%s"%s' % (fieldName, delimiter)
+                formatters.append(formatText)
+            elif field.type == 'Geometry':
+                formatters.append(formatShape)
             else:
-                header += '%s%s' % (fieldName, delimiter)
-        # We'll have an extra delimiter at the end, so trim the last char
-        header = header[:-1]
-        arcpy.AddMessage("Writing header: %s" % header)
-        f = codecs.open(outCSV, encoding='utf-8', mode='a+')
-        f.write(header+"\n")
-        f.close()
-
-        arcpy.AddMessage("CSV out: Checking contents of text fields for trouble:")
-        arcpy.AddMessage("Fields to export: %s" % fieldList3)
-        arcpy.AddMessage("Text Fields: %s" % textFieldsIndex)
-        numFields = len(fieldList3)
+                formatters.append(formatValue)
+        return formatters
+
+    def writeCSVRows(self, fc, fieldNames, formatters, f, delimiter=",", whereClause=None,
+                     progress=None, progressRows=100000):
+        # Writes the rows of fc (selected by whereClause) to the open binary file f as CSV.
+        # Lines are joined and encoded in batches to keep the per-row work small.
+        # Returns (rows, bytes) written.
         rowCount = 0
-        totalRows = self.getCount(fc)
-        arcpy.AddMessage("Starting export...")
-        import io
-        f = io.open(outCSV, encoding='utf-8', mode='a+')
-        with arcpy.da.SearchCursor(fc, fieldList3) as c:
+        size = 0
+        batch = []
+        nextProgress = progressRows
+        with arcpy.da.SearchCursor(fc, fieldNames, whereClause) as c:
             for row in c:
-                rowCount += 1
-                if rowCount > sys.maxsize:
-                    return True
-                line = ""
-                for i in range(numFields):
-                    contents = row[i]
-                    if i in textFieldsIndex:
-                        # This is a text field. Must quote it!
-                        if contents is not None:
-                            contents = contents.replace(delimiter, "")
-                            if quoteStrings:
-                                line += '"%s"%s' % (contents, delimiter)
-                            else:
-                                line += '%s%s' % (contents, delimiter)
-                        else:
-                            # Should be of type None, which we don't want quoted
-                            line += '%s%s' % (contents, delimiter)
-                    else:
-                        # Not a text field. Write it as-is
-                        line += '%s%s' % (contents, delimiter)
-                # Done with this row now. Trim the dangling delimiter.
-                line = line[:-1]
-                f.write(line+'\n')
-                if rowCount % 1000 == 0:
-                    # Save every once in a while, if you save with every row it is way too slow.
-                    f.close()
-                    f = codecs.open(outCSV, encoding='utf-8', mode='a+')
-                    arcpy.AddMessage("\rExported row %s of %s..." % (rowCount, totalRows)),
-        # Close the file when done.
-        f.close()
-        arcpy.AddMessage("\nAll done. %s rows exported." % rowCount)
+                batch.append(delimiter.join([fmt(val) for (fmt, val) in zip(formatters, row)]))
+                if len(batch) == 1000:
+                    data = (u'\n'.join(batch) + u'\n').encode('utf-8')
+                    f.write(data)
+                    size += len(data)
+                    rowCount += len(batch)
+                    batch = []
+                    if progress and rowCount >= nextProgress:
+                        progress(rowCount, size)
+                        nextProgress += progressRows
+        if batch:
+            data = (u'\n'.join(batch) + u'\n').encode('utf-8')
+            f.write(data)
+            size += len(data)
+            rowCount += len(batch)
+        if progress:
+            progress(rowCount, size)
+        return (rowCount, size)
+
+    def exportTableToColumns(self, fc, outFolder, userFieldList=[], exportOID=True, exportGeom=True,
+                             whereClause=None, chunkRows=65536):
+        # Exports a table or feature class to a folder of NumPy .npy files, one per column,
+        # with a schema.json describing them. Read it back with ColumnarTable(outFolder),
+        # which memory-maps the arrays.
+        # Numbers and dates are typed arrays (nulls stored as 0, NaN or NaT, with a
+        # <name>.nulls.npy mask if there were any). Text is UTF-8 in <name>.npy with
+        # rows + 1 offsets in <name>.offsets.npy. Geometry is written as XY coordinates
+        # with ring, part and feature offset arrays (Z and M values are dropped).
+        # Fields of other types (blob, raster) are skipped.
+        # Returns the number of rows exported.
+        if not os.path.exists(outFolder):
+            os.makedirs(outFolder)
+        desc = arcpy.Describe(fc)
+        fieldList = self.getCSVFields(fc, userFieldList, exportOID, False)
+        columns = []
+        for field in fieldList:
+            column = {'name': field.name, 'type': field.type, 'file': field.name + '.npy'}
+            if field.type in self.columnTypes:
+                column['dtype'] = self.columnTypes[field.type]
+            elif field.type in ['String', 'GUID', 'GlobalID']:
+                column['dtype'] = 'u1'
+                column['offsets'] = field.name + '.offsets.npy'
+            else:
+                arcpy.AddMessage("Skipping field %s (%s)" % (field.name, field.type))
+                continue
+            column['writer'] = NpyAppender(os.path.join(outFolder, column['file']), column['dtype'])
+            if column.get('offsets'):
+                column['offsetWriter'] = NpyAppender(os.path.join(outFolder, column['offsets']), 'i8')
+                column['offsetWriter'].append([0])
+                column['size'] = 0
+            if field.isNullable:
+                column['nulls'] = field.name + '.nulls.npy'
+                column['nullWriter'] = NpyAppender(os.path.join(outFolder, column['nulls']), bool)
+                column['nullCount'] = 0
+            columns.append(column)
+        cursorFields = [column['name'] for column in columns]
+        geometry = None
+        if exportGeom and getattr(desc, 'shapeType', None):
+            cursorFields.append('SHAPE@WKB')
+            geometry = GeometryColumnWriter(outFolder)
+        rowCount = 0
+        batch = []
+        with arcpy.da.SearchCursor(fc, cursorFields, whereClause) as c:
+            for row in c:
+                batch.append(row)
+                if len(batch) == chunkRows:
+                    self.writeColumnChunk(batch, columns, geometry)
+                    rowCount += len(batch)
+                    batch = []
+        if batch:
+            self.writeColumnChunk(batch, columns, geometry)
+            rowCount += len(batch)
+        schema = {'version': 1, 'source': desc.catalogPath, 'rows': rowCount, 'columns': []}
+        for column in columns:
+            for key in ['writer', 'offsetWriter', 'nullWriter']:
+                if key in column:
+                    column.pop(key).close()
+            if column.pop('nullCount', 0) == 0 and column.get('nulls'):
+                # No nulls after all, drop the mask
+                os.remove(os.path.join(outFolder, column.pop('nulls')))
+            column.pop('size', None)
+            schema['columns'].append(column)
+        if geometry:
+            geometry.close()
+            sr = desc.spatialReference
+            schema['geometry'] = dict(geometry.files, shapeType=desc.shapeType,
+                                      spatialReference={'name': sr.name, 'factoryCode': sr.factoryCode})
+        with open(os.path.join(outFolder, 'schema.json'), 'wb') as f:
+            json.dump(schema, f, indent=2)
+        arcpy.AddMessage("Exported %s rows and %s columns to %s" % (rowCount, len(columns), outFolder))
+        return rowCount
+
+    # Array types of the numeric and date fields in exportTableToColumns
+    columnTypes = {'OID': 'i4', 'SmallInteger': 'i2', 'Integer': 'i4', 'Single': 'f4',
+                   'Double': 'f8', 'Date': 'M8[us]'}
+
+    def writeColumnChunk(self, rows, columns, geometry=None):
+        # Appends a chunk of cursor rows to the column writers of exportTableToColumns
+        values = zip(*rows)
+        for (i, column) in enumerate(columns):
+            col = values[i]
+            if 'nullWriter' in column:
+                nulls = np.array([val is None for val in col], dtype=bool)
+                column['nullWriter'].append(nulls)
+                column['nullCount'] += int(nulls.sum())
+            if 'offsetWriter' in column:
+                data = [val.encode('utf-8') if val is not None else '' for val in col]
+                lengths = np.fromiter((len(val) for val in data), 'i8', len(data))
+                column['offsetWriter'].append(np.cumsum(lengths) + column['size'])
+                column['size'] += int(lengths.sum())
+                column['writer'].append(np.frombuffer(''.join(data), 'u1'))
+            elif column['dtype'] in ['f4', 'f8', 'M8[us]'] or 'nullWriter' not in column:
+                # None converts to NaN / NaT
+                column['writer'].append(np.array(col, dtype=column['dtype']))
+            else:
+                column['writer'].append(np.array([0 if val is None else val for val in col],
+                                                 dtype=column['dtype']))
+        if geometry:
+            geometry.append(values[-1])
 
     def listUniqueValues(self, fc, col_names, silent=False, colType=None, limit=None):
         """
@@ -1075,17 +1563,28 @@ class ArcTools(object):
             colType (str): (optional) type of value, e.g. 'int'
 
         Returns:
-            A list of unique values in the column
+            A list of unique values in the column (nulls skipped), or a list of
+            unique tuples of values for several columns
         """
-        # unique_rows = set ()
-        unique_rows = []
+        unique_set = set()
         rowcount = 0
         if not type(col_names) is list:
             col_names = [col_names]
-        # Make a field type lookup
+        # Make a value conversion for each column from its field type
         field_types = {}
         for field in arcpy.ListFields(fc):
             field_types[field.name] = field.type
+        converters = []
+        for col_name in col_names:
+            if field_types.get(col_name) in ['Integer', 'SmallInteger']:
+                converters.append(int)
+            elif field_types.get(col_name) in ['Single', 'Double']:
+                converters.append(float)
+            elif field_types.get(col_name) == 'String':
+                converters.append(unicode)
+            else:
+                converters.append(None)
+        single = len(col_names) == 1
 
         if not silent:
             print('Getting a list of unique values in %s...' % col_names)
@@ -1094,43 +1593,67 @@ class ArcTools(object):
                 rowcount += 1
                 if limit and rowcount > limit:
                     break
-                # Iterate over all columns
-                row_list = []
-                val = None
-                for col_name in col_names:
-                    i = col_names.index(col_name)
-                    # Check column type
-                    val = row[i]
-                    # Skip type check on null values
-                    if val is None:
-                        row_list.append(val)
-                        continue
-                    if field_types.get(col_name) in ['Integer', 'SmallInteger']:
-                        val = int(val)
-                    elif field_types.get(col_name) in ['Single', 'Double']:
-                        val = float(val)
-                    elif field_types.get(col_name) == 'String':
-                        val = u''+val
-                    row_list.append(val)
-                if len(col_names) > 1:
-                    row_tuple = tuple(row_list)
-                    unique_rows.append(row_tuple)
-                else:
+                if single:
+                    val = row[0]
                     # Skip null rows
                     if val is None:
                         continue
-                    unique_rows.append(val)
+                    if converters[0]:
+                        val = converters[0](val)
+                    unique_set.add(val)
+                else:
+                    # Skip type conversion on null values
+                    unique_set.add(tuple([val if val is None or not convert else convert(val)
+                                          for (convert, val) in zip(converters, row)]))
                 if (rowcount % 10000 == 0) and not silent:
                     arcpy.AddMessage("\rGetting unique values for %s: row %s" % (col_names, rowcount)),
-        del c
-        if not silent:
-            print('Converting list of %s items to a unique set...' % len(unique_rows))
-        unique_set = set(unique_rows)
         if not silent:
             print('%s unique values in columns %s' % (len(unique_set), col_names))
         valueList = list(unique_set)
         return valueList
 
+    def profileColumns(self, fc, col_names=None, top=10, approximate=False, where_clause=None, limit=None):
+        """
+        Profiles one or more columns in a single pass: row, null and blank
+        counts, min / max, distinct values with their counts and the most
+        common values. Memory grows with the number of distinct values.
+
+        Args:
+            fc (str): full path and name of fc or table
+            col_names (str / list): column name(s), default all fields except OID and shape
+            top (int): number of most common values in each summary
+            approximate (bool / list): estimate distinct counts with HyperLogLog and keep
+                only approximate top values, in fixed memory. True for all columns,
+                or a list of the high-cardinality columns to treat this way
+            where_clause (str): optional selection of rows
+            limit (int): optional maximum number of rows to read
+
+        Returns:
+            A dict of column name -> ColumnProfile (see ColumnProfile.summary, values)
+        """
+        field_list = arcpy.ListFields(fc)
+        fields = dict((field.name, field) for field in field_list)
+        if col_names is None:
+            col_names = [field.name for field in field_list if field.type not in
+                         ['OID', 'Geometry', 'Blob', 'Raster']]
+        elif not type(col_names) is list:
+            col_names = [col_names]
+        profiles = []
+        for name in col_names:
+            field_type = fields[name].type if name in fields else None
+            approx = approximate is True or (type(approximate) is list and name in approximate)
+            profiles.append(ColumnProfile(name, field_type, top, approx))
+        adders = [profile.add for profile in profiles]
+        rowcount = 0
+        with arcpy.da.SearchCursor(fc, col_names, where_clause) as c:
+            for row in c:
+                rowcount += 1
+                if limit and rowcount > limit:
+                    break
+                for (add, val) in zip(adders, row):
+                    add(val)
+        return dict((profile.name, profile) for profile in profiles)
+
     def mem(self, data, nameOverride=None):
         """
         Copies an object 'data' into an in-memory fc named with a random integer to
@@ -1195,6 +1718,7 @@ class ArcTools(object):
                 # Feature class is empty, try to delete it.
                 try:
                     arcpy.Delete_management(fc)
+                    metadata_cache.invalidate(fc)
                     print("Cleaning up %s" % os.path.basename(fc))
                 except:
                     print("Unable to delete %s. May be locked (cursor or open in Arcmap)." % os.path.basename(fc))
@@ -1220,8 +1744,10 @@ class GeomTools(object):
         or ArcMap), to be sure that the latest version is re-loaded. """
         if not silent:
             arcpy.AddMessage("GeomTools class (update %s). Latest change:" % self.TS)
-        self.sr = self.arctools.createSRObject('WKID', 4326)
-        self.srAlbers = self.arctools.createSRObject('WKID', 3005)
+        # Rounding digits of spatialKey by grid size
+        self.roundFactors = {}
+        self.sr = spatial_reference(4326)
+        self.srAlbers = spatial_reference(3005)
         pass
 
     def remove_holes(self, geom):
@@ -1260,20 +1786,38 @@ class GeomTools(object):
         # Calculate the geodesic distance in Canada albers equal-area for
         # any pair of points or point geom objects
         # Source points assumed to be in Lat-Long WGS 1984
-        srAlbers = self.arctools.createSRObject('WKID', 102001)
-        srWGS_1984 = self.arctools.createSRObject('WKID', 4326)
         # Convert geometries to points if necessary
         if isinstance(pt1, arcpy.PointGeometry):
-            pt1 = arcpy.Point(pt1.getPart(0).X, pt1.getPart(0).Y)
+            pt1 = pt1.firstPoint
         if isinstance(pt2, arcpy.PointGeometry):
-            pt2 = arcpy.Point(pt2.getPart(0).X, pt2.getPart(0).Y)
-        # Construct a line segment
-        arr = arcpy.Array()
-        arr.add(pt1)
-        arr.add(pt2)
-        linegeom = arcpy.Polyline(arr, srWGS_1984)
-        lineAlbers = linegeom.projectAs(srAlbers)
-        return lineAlbers.length
+            pt2 = pt2.firstPoint
+        # Length of the straight segment between the projected points,
+        # as measured by projecting a two-point polyline
+        return float(projected_distance(pt1.X, pt1.Y, pt2.X, pt2.Y, 102001))
+
+    def calcDistancesLL(self, lon1, lat1, lon2, lat2, wkid=102001):
+        # Vectorized calcDistanceBetweenPointsLL: distances between pairs of points given
+        # as arrays (or sequences) of WGS 1984 longitudes and latitudes, measured in
+        # projection wkid (one of projections). Returns a numpy array of metres.
+        return projected_distance(lon1, lat1, lon2, lat2, wkid)
+
+    def calcDistancesLLBatch(self, lat1, long1, lat2, long2, method='haversine'):
+        # Vectorized calcDistanceLL: distances in meters between pairs of lat-long points
+        # given as numpy arrays. A single point against arrays gives one point to many.
+        # method: 'haversine', 'vincenty' (ellipsoidal) or 'albers' (same as
+        # calcDistanceBetweenPointsLL), see geo_distance
+        return geo_distance(lat1, long1, lat2, long2, method)
+
+    def calcDistanceMatrixLL(self, lat1, long1, lat2=None, long2=None, method='haversine',
+                             maxBytes=64 * 1024 ** 2, out=None):
+        # Matrix of distances in meters from every point of set 1 to every point of set 2
+        # (or of set 1 to itself), computed in blocks of at most maxBytes, see distance_matrix
+        return distance_matrix(lat1, long1, lat2, long2, method, maxBytes, out)
+
+    def projectCoordinates(self, x, y, fromWKID, toWKID):
+        # Projects arrays of coordinates between the systems in projections
+        # (4326, 4269, 3857, 3005, 102001) without arcpy. Returns (x, y) numpy arrays.
+        return project(x, y, fromWKID, toWKID)
 
     def isPolylineClosed(self, geom):
         # Tests a polyline geometry object for closure
@@ -1298,6 +1842,7 @@ class GeomTools(object):
         # Make the output feature class, as an exact copy of the input fc, erase will be performed
         # directly on the output, one feature at a time.
         arcpy.CopyFeatures_management(target, outFC)
+        metadata_cache.invalidate(outFC)
         # Get the OID field name
         oidFieldName = arcpy.Describe(outFC).OIDFieldName
         # Make feature layers on this in-memory target fc, and the eraser fc
@@ -1503,16 +2048,24 @@ class GeomTools(object):
             else:
                 return None
 
-    def buildSpatialIndex(self, geom, grid_scale=100.0, density='ALL'):
+    def buildSpatialIndex(self, geom, grid_scale=100.0, density='ALL', packed=False):
         # Assume a single-part geometry. Assume that coordinates are always
         # spaced closer together than the grid_scale value.
         # Default grid size is 100.0, which means the coords will be
         # rounded to two digits *before* the decimal, or the nearest
         # 100 m for a metric projection.
+        # packed=True returns a GridIndex of the vertex numbers instead of a dict of
+        # sets: keys are integers (spatialKeyFromPoint with packed=True) and it also
+        # answers box and radius queries.
         if density not in ['ALL', 'ENDS']:
             return False
-        idx = {}
         arr = geom.getPart(0)
+        if packed:
+            points = [arr.getObject(i) for i in range(0, len(arr))]
+            x = np.array([point.X for point in points], dtype=np.float64)
+            y = np.array([point.Y for point in points], dtype=np.float64)
+            return GridIndex(grid_scale).build(x, y)
+        idx = {}
         for i in range(0, len(arr)):
             point = arr.getObject(i)
             key = self.spatialKeyFromPoint(point, grid_scale)
@@ -1523,15 +2076,18 @@ class GeomTools(object):
                 idx[key].add(i)
         return idx
 
-    def spatialKeyFromPoint(self, point, grid_size=0.01):
+    def spatialKeyFromPoint(self, point, grid_size=0.01, packed=False):
         """
         Builds a spatial key with grid scale from Point
         :param point: arcpy Point object
         :param grid_size: parameter to control the rounding
+        :param packed: return the integer GridIndex key of the same cell instead of a string
         :return:
         """
         x = point.X
         y = point.Y
+        if packed:
+            return grid_key(x, y, grid_size)
         return self.spatialKey(x, y, grid_size=grid_size)
 
     def spatialKey(self, x, y, grid_size=0.01, invert=False):
@@ -1542,7 +2098,10 @@ class GeomTools(object):
         :param grid_scale: parameter to control the rounding
         :return: a string key suitable for spatial indexing
         """
-        round_factor = (-1) * int(math.log10(abs(grid_size)))
+        round_factor = self.roundFactors.get(grid_size)
+        if round_factor is None:
+            round_factor = (-1) * int(math.log10(abs(grid_size)))
+            self.roundFactors[grid_size] = round_factor
         if invert:
             x_key = int(round(x, round_factor) / grid_size)
             y_key = int(round(y, round_factor) / grid_size)
@@ -1553,7 +2112,7 @@ class GeomTools(object):
         return key
 
     def makeNearbyKeys(self, lat, lon, max_lat_delta=0.02, max_lon_delta=0.03,
-                       grid_size=0.01, min_delta=0.013):
+                       grid_size=0.01, min_delta=0.013, packed=False):
         """
         Generates spatial keys near to a coordinate to select nearby objects
         :param lat: test point lat
@@ -1562,39 +2121,20 @@ class GeomTools(object):
         :param max_lon_delta: max lon offset
         :param grid_size: grid size of the spatial index
         :param min_delta: smallest delta
+        :param packed: make integer GridIndex keys instead of strings
         :return: a set of surrounding spatial index keys
         """
-        import itertools
-        lat_increments = set()
-        lon_increments = set()
-        # origpt = arcpy.PointGeometry(arcpy.Point(lon, lat), self.sr)
-        # origpt = origpt.projectAs(self.srAlbers)
-        for i in [-1, 1]:
-            current_lat = lat
-            lat_increments.add(current_lat)
-            current_lon = lon
-            lon_increments.add(current_lon)
-            delta = 0.0
-            while delta < max_lat_delta:
-                current_lat += i * grid_size
-                delta = math.fabs(current_lat - lat)
-                lat_increments.add(current_lat)
-            delta = 0.0
-            while delta < max_lon_delta:
-                current_lon += i * grid_size
-                delta = math.fabs(current_lon - lon)
-                lon_increments.add(current_lon)
-        pairs = list(itertools.product(lat_increments, lon_increments))
-        newkeys = set()
-        for (latnew, lonnew) in pairs:
-            # Estimate the distance between these points
-            delta_lat = math.fabs(latnew - lat)
-            delta_lon = math.fabs(lonnew - lon)
-            delta_total = math.sqrt(delta_lat * delta_lat + delta_lon * delta_lon)
-            if delta_total < min_delta:
-                key = self.spatialKey(lonnew, latnew, grid_size)
-                newkeys.add(key)
-        return newkeys
+        # Offsets of the cells with centres closer than min_delta, within the max deltas,
+        # made once per set of parameters. Neighbour keys are then integer additions.
+        stencil = grid_stencil(grid_size, min_delta,
+                               int(math.ceil(max_lon_delta / grid_size - 1e-9)),
+                               int(math.ceil(max_lat_delta / grid_size - 1e-9)), centres=True)
+        keys = grid_key(lon, lat, grid_size) + stencil
+        if packed:
+            return set(keys.tolist())
+        (cols, rows) = GridIndex.unpack(keys)
+        return set(self.spatialKey(i * grid_size, j * grid_size, grid_size)
+                   for (i, j) in zip(cols.tolist(), rows.tolist()))
 
     def fuzzyCoordinate(self, coord):
         fuzzy = set()
@@ -1606,9 +2146,49 @@ class GeomTools(object):
             fuzzy.add(x_fuzz)
         return fuzzy
 
+    def buildRTreeFC(self, fc, path=None, nodeSize=16, rebuild=None):
+        # Builds an STRTree over the extents of every part of every feature in fc,
+        # in any projection. Ids are OIDs, parts are part numbers (polygon parts are
+        # outer rings with their holes).
+        # path: file to save the tree to. If the file is there and newer than the data
+        # of fc, it is opened (memory-mapped) instead of rebuilding. For data without
+        # local files (enterprise geodatabases) that cannot be checked, so the tree is
+        # rebuilt unless rebuild is False. rebuild=True always rebuilds.
+        if path and os.path.exists(path) and rebuild is not True:
+            stamp = data_file_time(metadata_cache.describe(fc)['catalogPath'] or fc)
+            if rebuild is False or (stamp is not None and stamp <= os.path.getmtime(path)):
+                logger.info('Opening spatial index %s' % path)
+                return STRTree(nodeSize).load(path)
+        boxes = []
+        ids = []
+        parts = []
+        with arcpy.da.SearchCursor(fc, ['OID@', 'SHAPE@WKB']) as c:
+            for (oid, wkb) in c:
+                if wkb is None:
+                    continue
+                (geom_type, geom_parts, offset) = read_wkb(wkb)
+                for (i, part) in enumerate(geom_parts):
+                    if geom_type in (3, 6):
+                        # Outer ring of a polygon part
+                        part = part[0]
+                    if not len(part):
+                        continue
+                    (xmin, ymin) = part.min(axis=0)
+                    (xmax, ymax) = part.max(axis=0)
+                    boxes.append((xmin, ymin, xmax, ymax))
+                    ids.append(oid)
+                    parts.append(i)
+        sr = metadata_cache.describe(fc)['spatialReference']
+        tree = STRTree(nodeSize).build(boxes, ids, parts, getattr(sr, 'factoryCode', 0) or 0)
+        logger.info('Indexed %s parts of %s features in %s' % (len(parts), len(set(ids)), fc))
+        if path:
+            tree.save(path)
+        return tree
+
     def buildSpatialIndexFC(self, fc):
         # Builds an index for an entire feature class using the two-level key of location (4 x 3)
         # and objectId, followed by array point number. Again, all geoms are assumed to be single-part
+        # buildRTreeFC works for any projection and multi-part features, and can be saved.
         import itertools
         idx = {}
         fields = ['OID@', 'SHAPE@']
@@ -1666,6 +2246,7 @@ class GeomTools(object):
         extendedLineFCname = os.path.basename(extendedLineFC)
         arcpy.AddMessage("Making copy of %s for extending..." % os.path.basename(lineFC))
         arcpy.CopyFeatures_management(lineFC, extendedLineFC)
+        metadata_cache.invalidate(extendedLineFC)
         with arcpy.da.UpdateCursor(extendedLineFC, ['SHAPE@']) as c:
             for row in c:
                 geom = row[0]
@@ -1681,6 +2262,7 @@ class GeomTools(object):
             extendedLineFCname, os.path.basename(intersectFC)))
         arcpy.Intersect_analysis(
             [extendedLineFC, intersectFC], extendedLineIntersectFC, "ALL", "", "POINT")
+        metadata_cache.invalidate(extendedLineIntersectFC)
         intersections = {}
         extendedLineFIDcol = 'FID_' + extendedLineFCname
 
@@ -1763,6 +2345,7 @@ class GeomTools(object):
         # Create output feature class name
         outfc = fc + "_line"
         arcpy.CopyFeatures_management(plineList, outfc)
+        metadata_cache.invalidate(outfc)
 
     def polygonToPolylineWithData(self, fc, outFCname=None):
         """
@@ -1784,33 +2367,36 @@ class GeomTools(object):
         # Use the SAME FIELD LIST for insert cursor, with field for original OID
         fieldsInsert = ['OrigOID'] + fields
         arcpy.AddField_management(outFC, 'OrigOID', "LONG")
+        metadata_cache.invalidate(outFC)
         # Add OID field for the input feature class fields
         fields = self.arctools.addOIDcolumnToken(fields)
+        schema = RecordSchema(fields)
+        # Insert rows take the original OID as OrigOID, everything else by name
+        toInsertRow = schema.mapper(fieldsInsert, {'OrigOID': 'OID@'})
+        getShape = schema.getter('SHAPE@')
+        shapeIndex = fieldsInsert.index('SHAPE@')
         cout = arcpy.da.InsertCursor(outFC, fieldsInsert)
         rowCount = 0
         outPlineCount = 0
         with arcpy.da.SearchCursor(fc, fields) as c:
             for row in c:
                 rowCount += 1
-                srow = self.arctools.getSmartRow(fields, row)
-                # Swap the key 'OID@' with 'OrigOID'
-                srow['OrigOID'] = srow['OID@']
-                del srow['OID@']
+                rowInsert = toInsertRow(row)
                 # Extract the polygon geometry and covert to lines
-                pgon = srow['SHAPE@']
+                pgon = getShape(row)
                 for i in range(0, pgon.partCount):
                     pline = arcpy.Polyline(pgon.getPart(i), sr)
-                    # Set the SHAPE token to the new Polyline geometry
-                    srow['SHAPE@'] = pline
                     """
-                    Set a smart row for the insert cursor. We may have multiple parts per input
-                     feature, which will be translated into one row *per feature part* in the
-                     output. Attributes from the input FC will be duplicated across
-                     these rows.
+                    Set the SHAPE token to the new Polyline geometry. We may have multiple
+                     parts per input feature, which will be translated into one row *per
+                     feature part* in the output. Attributes from the input FC will be
+                     duplicated across these rows.
                     """
-                    rowInsert = self.arctools.setSmartRow(fieldsInsert, srow)
+                    rowInsert[shapeIndex] = pline
                     cout.insertRow(rowInsert)
                     outPlineCount += 1
+        del cout
+        metadata_cache.invalidate(outFC)
 
     def polylineExplodeSegments(self, fc):
         """
@@ -1846,6 +2432,7 @@ class GeomTools(object):
         # Set output feature class name
         outfc = fc + "_exploded"
         arcpy.CopyFeatures_management(explodedLines, outfc)
+        metadata_cache.invalidate(outfc)
 
     def getGeomFromList(self, geomList, sr):
         # Don't assume anything about geomList except that it is a list of (x,y) coordinate tuples.
@@ -2043,6 +2630,7 @@ class GeomTools(object):
         boundRect = os.path.join(workGDB,"boundRect")
         g = arcpy.Geometry()
         arcpy.MinimumBoundingGeometry_management(fc,boundRect,"RECTANGLE_BY_WIDTH","NONE","","MBG_FIELDS")
+        metadata_cache.invalidate(boundRect)
         # 2. Read the rectangle's width and length
         logger.p5("Bounding rectangle for this feature: %s " % boundRect)
         length = 1
@@ -2081,181 +2669,3623 @@ class GeomTools(object):
             arcpy.DeleteFeatures_management("fcCutInHalf")
             fcCut = os.path.join(workGDB,'fcCut')
             arcpy.CopyFeatures_management("fcCutInHalf",fcCut)
+            metadata_cache.invalidate(fcCut)
             # 11. Call this function again recursively.
             return self.polygonReduction(workGDB,fcCut,reductionRatio,basePts,sr)
 
 
-class QualityControl(object):
+def data_file_time(path):
+    """
+    Latest modification time of the files holding a dataset.
+    A file geodatabase does not tell which of its files belong to which
+    table, so every file in the .gdb folder counts (lock files excepted):
+    an edit anywhere in the geodatabase invalidates all of its datasets.
+    Shapefiles use their own sidecar files. Returns None for data without
+    local files, e.g. enterprise geodatabases.
+    """
+    folder = path
+    while folder and not folder.lower().endswith('.gdb') and folder != os.path.dirname(folder):
+        folder = os.path.dirname(folder)
+    if folder.lower().endswith('.gdb') and os.path.isdir(folder):
+        names = [os.path.join(folder, name) for name in os.listdir(folder)
+                 if not name.endswith('.lock')]
+    else:
+        base = os.path.splitext(path)[0]
+        names = [base + ext for ext in ['.shp', '.shx', '.dbf', '.prj', '.cpg']]
+    times = [os.path.getmtime(name) for name in names if os.path.isfile(name)]
+    if not times:
+        return None
+    return max(times)
+
+
+class MetadataCache(object):
 
     """
-    Performs quality control to flag potential data quality issues.
+    Schema and Describe metadata of datasets, keyed by path, so that helpers
+    called in loops do not go back to the catalog every time. Holds the field
+    list, the Describe properties in describe_properties and the row count.
+
+    Schema entries are kept until invalidate() is called; the ArcTools
+    methods that change a schema or create, replace or delete a dataset do
+    this themselves. Call invalidate() (ArcTools.refreshMetadata) after
+    changing a schema by other means. Row counts are only reused while the
+    files of the dataset are unchanged (see data_file_time), which is checked
+    on every call, so they are never cached for enterprise geodatabases.
+    Files modified less than stamp_seconds ago are not trusted: another write
+    within the same file time tick would leave the time as it is, so such
+    counts are not cached. in_memory data and layers are not cached at all.
     """
 
-    def __init__(self, silent=False):
-        self.arctools = ArcTools(silent=True)
-        self.TS = logger.getTS()
-        """A test string to make sure that the latest version of arcsupport is loaded
-        into memory. Reload in the interactive python console (in command line
-        or ArcMap), to be sure that the latest version is re-loaded. """
-        if not silent:
-            logger.info("QualityControl class (updated %s). " % self.TS)
+    describe_properties = ['dataType', 'catalogPath', 'OIDFieldName', 'shapeFieldName',
+                           'shapeType', 'spatialReference', 'hasZ', 'hasM', 'isVersioned']
+    # File time resolution is 2 seconds on FAT, finer elsewhere
+    stamp_seconds = 2.0
 
-    def qc_report(self, fc):
+    def __init__(self):
+        self.entries = {}
+
+    def key(self, fc):
         """
-        Quality control report
-        :param fc: may be a workspace or an individual feature class
-        :return:
-        import imp;imp.reload(arcsupport);qctool = arcsupport.QualityControl()
+        :return: cache key of fc, or None if fc should not be cached
         """
-        data_type = arcpy.Describe(fc).dataType
-        features = ['FeatureClass', 'ShapeFile']
-        table_type = ['Table']
-        workspace_type = ['Workspace']
-        supported_types = features + table_type + workspace_type
+        if not isinstance(fc, basestring):
+            return None
+        lower = fc.lower()
+        if lower.startswith('in_memory') or lower.startswith('memory') or \
+                lower.endswith('.lyr') or lower.endswith('.lyrx') or not os.path.dirname(fc):
+            # In-memory data changes without trace, layers are selections of their data
+            return None
+        return os.path.normcase(os.path.abspath(fc))
 
-        logger.info('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~`')
-        logger.info('Processing %s (%s)' % (fc, data_type))
+    def entry(self, fc):
+        """
+        :return: cache entry (dict) of fc, or None if fc is not cached
+        """
+        key = self.key(fc)
+        if key is None:
+            return None
+        return self.entries.setdefault(key, {})
 
-        if data_type not in supported_types:
-            logger.warning('Skipping layer with unsupported type: %s' % data_type)
+    def fields(self, fc):
+        """
+        :return: list of arcpy Field objects of fc
+        """
+        entry = self.entry(fc)
+        if entry is None:
+            return arcpy.ListFields(fc)
+        if 'fields' not in entry:
+            entry['fields'] = arcpy.ListFields(fc)
+        return entry['fields']
+
+    def describe(self, fc):
+        """
+        :return: dict of the describe_properties of fc (None where not applicable)
+        """
+        entry = self.entry(fc)
+        if entry is None or 'describe' not in entry:
+            desc = arcpy.Describe(fc)
+            properties = dict((name, getattr(desc, name, None)) for name in self.describe_properties)
+            if entry is None:
+                return properties
+            entry['describe'] = properties
+        return entry['describe']
+
+    def count(self, fc):
+        """
+        :return: number of rows in fc
+        """
+        entry = self.entry(fc)
+        stamp = None
+        if entry is not None:
+            stamp = data_file_time(self.describe(fc)['catalogPath'] or fc)
+            if stamp is not None and entry.get('count_stamp') == stamp:
+                return entry['count']
+        count = int(arcpy.GetCount_management(fc).getOutput(0))
+        if stamp is not None and time.time() - stamp >= self.stamp_seconds:
+            entry['count'] = count
+            entry['count_stamp'] = stamp
+        elif entry is not None:
+            entry.pop('count_stamp', None)
+        return count
+
+    def invalidate(self, fc=None):
+        """
+        Forgets the metadata of fc, or of every dataset if fc is None.
+        """
+        if fc is None:
+            self.entries.clear()
             return
-        if data_type in workspace_type:
-            # Process each element
-            for item in self.arctools.getAllItems(fc):
-                self.qc_report(item)
+        key = self.key(fc)
+        if key is not None:
+            self.entries.pop(key, None)
 
-        else:
-            # Type is table or feature class. Do the table processing first.
-            self.field_name_check(fc)
-            self.field_type_check(fc)
-            self.table_completeness(fc)
-            self.duplicates(fc)
-            if data_type in features:
-                # Spatial layer, additional checks
-                self.duplicate_geoms(fc)
-                self.repair_geom_zm(fc)
-                self.feature_complexity(fc)
 
-    def field_name_check(self, fc, field_names=list()):
+# Shared by all ArcTools and QualityControl objects in this process
+metadata_cache = MetadataCache()
+
+
+class RecordSchema(object):
+
+    """
+    Field list of a cursor, compiled once so that rows can be read by field
+    name and turned into rows of another cursor without a dict per row.
+    record(row) wraps a row in a tuple subclass with one read-only attribute
+    per field (tokens lose their '@', e.g. rec.SHAPE, rec.OID); get() works
+    for any field name. mapper() and getter() return plain functions for the
+    hottest loops.
+    """
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.positions = dict((name, i) for (i, name) in reversed(list(enumerate(self.fields))))
+        self.record_class = self.make_record_class()
+
+    def make_record_class(self):
+        attributes = {'__slots__': (), 'schema': self}
+        taken = set(dir(tuple)) | set(['get', 'schema'])
+        for (i, name) in enumerate(self.fields):
+            attr = re.sub(r'\W', '_', name.rstrip('@'))
+            if not re.match(r'[A-Za-z_]\w*$', attr) or attr in taken or keyword.iskeyword(attr):
+                continue
+            taken.add(attr)
+            attributes[attr] = property(operator.itemgetter(i))
+        positions = self.positions
+
+        def get(rec, name, default=None):
+            i = positions.get(name)
+            return default if i is None else tuple.__getitem__(rec, i)
+        attributes['get'] = get
+        return type('Record', (tuple,), attributes)
+
+    def index(self, name):
         """
-        Check field names in data source
-        :param fc: a data source. If not already in a ESRI-supported format,
-        add list of field names to check in second param
-        :param field_names: optional list of field names to validate
-        :return: list of invalid field names
+        :return: position of field name in the rows
         """
-        logger.info('Checking field names in: %s' % fc)
-        import re
-        invalid = []
-        if not field_names:
-            # Use field names defined in the source.
-            field_names = self.arctools.getFieldNames(fc)
-        allowed_patt = '^[a-z][_a-z0-9]*$'
-        for field in field_names:
-            m = re.match(allowed_patt, field, re.IGNORECASE)
-            if m:
-                logger.info('Field name %s ok.' % field)
-            else:
-                logger.warning('Field name %s not valid for ArcGIS' % field)
-                invalid.append(field)
-        if invalid:
-            logger.info('For a list of field name rules, see: '
-                        '\nhttp://support.esri.com/technical-article/000005588 ')
-        return invalid
+        try:
+            return self.positions[name]
+        except KeyError:
+            raise ValueError('Field %s is not in %s' % (name, self.fields))
 
-    def field_type_check(self, fc):
+    def record(self, row):
+        return self.record_class(row)
+
+    def records(self, rows):
         """
-        Validate field types against the data actually contained in each field
-        Look for:
-        - numeric data in text field
-        - integer data in a double field (all rounded to integer)
-        Log warnings that we found.
-        :return:
+        Generator of records from an iterable of rows, e.g. a cursor
         """
-        logger.info('Checking field types in: %s' % fc)
-        for field in arcpy.ListFields(fc):
-            if field.type in ['Single', 'Double']:
-                vals = self.arctools.listUniqueValues(fc, field.name, silent=True)
-                has_decimal = False
-                for val in vals:
-                    if val % 1 != 0.0:
-                        has_decimal = True
-                if not has_decimal:
-                    logger.warning('Field %s (type %s) contains all integers' % (field.name, field.type))
+        record_class = self.record_class
+        for row in rows:
+            yield record_class(row)
 
-            if field.type == 'String':
-                vals = self.arctools.listUniqueValues(fc, field.name, silent=True)
-                has_non_numeric = False
-                for val in vals:
-                    try:
-                        numeric = float(val.strip())
-                    except ValueError:
-                        has_non_numeric = True
-                if not has_non_numeric:
-                    logger.warning('Field %s (type %s) contains all numbers' % (field.name, field.type))
+    def getter(self, *names):
+        """
+        :return: function returning the value (one name) or tuple of values of names from a row
+        """
+        return operator.itemgetter(*[self.index(name) for name in names])
 
-        logger.info('Done checking field types.')
+    def mapper(self, target_fields, sources=None):
+        """
+        Builds rows for a cursor opened with target_fields from rows of this schema.
+        :param sources: dict of target field name: field name in this schema,
+        for fields that are named differently
+        :return: function row -> list of values in the order of target_fields.
+        Target fields not in this schema are None.
+        """
+        sources = sources or {}
+        positions = [self.positions.get(sources.get(name, name)) for name in target_fields]
+        if None in positions:
+            return lambda row: [None if i is None else row[i] for i in positions]
+        if len(positions) == 1:
+            i = positions[0]
+            return lambda row: [row[i]]
+        get_values = operator.itemgetter(*positions)
+        return lambda row: list(get_values(row))
+
+    def values(self, values):
+        """
+        :param values: dict of field name: value, must hold every field
+        :return: tuple of the values in the order of the fields
+        """
+        return tuple([values[name] for name in self.fields])
+
+
+def is_lock_error(error):
+    """
+    True for errors that go away when another process releases its lock
+    """
+    message = str(error).lower()
+    return 'lock' in message or 'table is being edited' in message or 'busy' in message
 
-    def table_completeness(self, fc):
+
+class BulkWriter(object):
+
+    """
+    Context manager for loading many rows into fc. Rows are inserted through
+    an InsertCursor and committed every commit_rows rows or commit_seconds
+    seconds, whichever comes first, so that a long load neither holds one
+    huge edit operation nor commits after every row.
+
+    An arcpy.da.Editor session is used when the data needs one: versioned
+    data (multiuser mode) and enterprise geodatabases. Give edit_session
+    True or False to decide yourself, e.g. for file geodatabase classes
+    taking part in a topology. Opening cursors, inserting and saving are
+    retried up to retries times on lock errors, waiting retry_wait seconds,
+    doubled on each attempt.
+
+    If the block raises inside an edit session, rows since the last commit
+    are discarded.
+
+        with BulkWriter(fc, ['SHAPE@', 'NAME']) as writer:
+            writer.write_rows(rows)
+        print(writer.stats())
+    """
+
+    def __init__(self, fc, fields, commit_rows=50000, commit_seconds=60.0,
+                 edit_session=None, retries=5, retry_wait=1.0, progress=None):
         """
-        Check percent of null / blank in each field
-        :return:
+        :param progress: optional function called as progress(stats) after every commit
         """
-        from collections import defaultdict
-        fields = self.arctools.getFieldNames(fc)
-        null_counts = defaultdict(int)
-        row_count = self.arctools.getCount(fc)
-        logger.info('Checking table completeness in: %s' % fc)
-        with arcpy.da.SearchCursor(fc, fields) as c:
-            for row in c:
-                srow = self.arctools.getSmartRow(fields, row)
-                for field in fields:
-                    val = srow.get(field)
-                    # count nulls, empty or blank strings
-                    if self.null_blank_check(val):
-                        null_counts[field] += 1
-        # Print a summary
-        if not null_counts:
-            logger.info('No null or blank records found.')
-            return
-        for (field, nulls) in null_counts.items():
-            pct_null = (nulls / row_count) * 100.0
-            msg = 'Field %s contains %.6f%% null or blank records.' % (
-                field, pct_null)
-            if pct_null > 0:
-                logger.warning(msg)
-            else:
-                logger.info(msg)
-        logger.info('Done checking table completeness.')
+        self.fc = fc
+        self.fields = list(fields)
+        self.commit_rows = commit_rows
+        self.commit_seconds = commit_seconds
+        self.retries = retries
+        self.retry_wait = retry_wait
+        self.progress = progress
+        desc = metadata_cache.describe(fc)
+        self.versioned = bool(desc['isVersioned'])
+        self.workspace = self.find_workspace(desc['catalogPath'] or fc)
+        if edit_session is None:
+            edit_session = self.versioned or \
+                getattr(arcpy.Describe(self.workspace), 'workspaceType', None) == 'RemoteDatabase'
+        self.edit_session = edit_session
+        self.editor = None
+        self.operation = False
+        self.cursor = None
+        self.rows = 0
+        self.pending = 0
+        self.commits = 0
+        self.retried = 0
+        self.started = None
+        self.last_commit = None
+
+    @staticmethod
+    def find_workspace(path):
+        workspace = os.path.dirname(path)
+        while workspace and arcpy.Describe(workspace).dataType == 'FeatureDataset':
+            workspace = os.path.dirname(workspace)
+        return workspace
+
+    def retry(self, func, *args):
+        attempt = 0
+        while True:
+            try:
+                return func(*args)
+            except RuntimeError as e:
+                if attempt >= self.retries or not is_lock_error(e):
+                    raise
+                wait = self.retry_wait * 2 ** attempt
+                logger.warning('%s is locked (%s), retrying in %s seconds' % (self.fc, e, wait))
+                attempt += 1
+                self.retried += 1
+                time.sleep(wait)
+
+    def __enter__(self):
+        self.started = timer()
+        self.last_commit = self.started
+        self.retry(self.begin)
+        return self
+
+    def begin(self):
+        if self.edit_session:
+            if self.editor is None:
+                self.editor = arcpy.da.Editor(self.workspace)
+            if not self.editor.isEditing:
+                self.editor.startEditing(False, self.versioned)
+            if not self.operation:
+                self.editor.startOperation()
+                self.operation = True
+        self.cursor = arcpy.da.InsertCursor(self.fc, self.fields)
+
+    def save(self):
+        if self.cursor is not None:
+            del self.cursor
+            self.cursor = None
+        if self.operation:
+            self.editor.stopOperation()
+            self.operation = False
+        if self.editor is not None and self.editor.isEditing:
+            self.editor.stopEditing(True)
+
+    def write(self, row):
+        """
+        Inserts one row (sequence of values in the order of fields)
+        """
+        try:
+            self.cursor.insertRow(row)
+        except RuntimeError as e:
+            if not is_lock_error(e):
+                raise
+            self.retry(self.cursor.insertRow, row)
+        self.rows += 1
+        self.pending += 1
+        if self.pending >= self.commit_rows or \
+                ((self.pending & 255) == 0 and timer() - self.last_commit >= self.commit_seconds):
+            self.commit()
+
+    def write_rows(self, rows):
+        """
+        Inserts every row of an iterable or generator
+        :return: number of rows written
+        """
+        count = 0
+        for row in rows:
+            self.write(row)
+            count += 1
+        return count
 
-    def null_blank_check(self, val):
+    def commit(self):
         """
-        Returns true if val is None or a blank / empty string
-        :param val:
-        :return:
+        Saves the rows written so far and carries on
         """
-        if val is None:
-            return True
-        elif isinstance(val, basestring):
-            if len(val.strip()) == 0:
-                return True
+        self.retry(self.save)
+        self.pending = 0
+        self.commits += 1
+        self.last_commit = timer()
+        stats = self.stats()
+        logger.info('%s: %s rows committed, %s rows/s' % (
+            self.fc, stats['rows'], int(stats['rows_per_second'])))
+        if self.progress:
+            self.progress(stats)
+        self.retry(self.begin)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.retry(self.save)
+            if self.pending:
+                self.commits += 1
+            self.pending = 0
+            metadata_cache.invalidate(self.fc)
+            return False
+        if self.cursor is not None:
+            del self.cursor
+            self.cursor = None
+        metadata_cache.invalidate(self.fc)
+        if self.editor is None:
+            # Without an edit session every inserted row is already stored
+            logger.warning('%s: load failed after %s rows' % (self.fc, self.rows))
+            return False
+        # Keep what was committed, discard the rest
+        if self.editor.isEditing:
+            try:
+                if self.operation:
+                    self.editor.abortOperation()
+                    self.operation = False
+                self.editor.stopEditing(False)
+            except RuntimeError as e:
+                logger.warning('Could not abort edit session on %s: %s' % (self.workspace, e))
+        logger.warning('%s: load failed, %s uncommitted rows discarded' % (self.fc, self.pending))
+        self.rows -= self.pending
+        self.pending = 0
         return False
 
-    def spatial_ref_check(self, filepath):
+    def stats(self):
         """
-        Checks for inconsistent spatial reference or data sources
-        with no SR in a workspace
-        :return:
+        :return: dict of rows, commits, retries, seconds and rows_per_second
         """
-        logger.info('Checking consistency of spatial references in: %s' % filepath)
-        if not os.path.exists(filepath):
-            logger.warning('%s is not a valid workspace' % filepath)
-            logger.warning('Use a folder or geodatabase path.')
-            return False
-        try:
-            desc = arcpy.Describe(filepath)
-            if desc.dataType in ['Workspace', 'Folder']:
-                # List all items
+        seconds = timer() - self.started if self.started is not None else 0.0
+        return {'rows': self.rows, 'commits': self.commits, 'retries': self.retried,
+                'seconds': seconds, 'rows_per_second': self.rows / seconds if seconds else 0.0}
+
+
+# arcpy SpatialReference objects by WKID or name, shared by the whole process
+spatial_references = {}
+
+
+def spatial_reference(code):
+    """
+    Cached arcpy SpatialReference. Do not change the returned object
+    (e.g. setDomain), it is shared; copy it with exportToString first.
+    :param code: WKID (int) or name (underscores are read as spaces)
+    """
+    if isinstance(code, basestring):
+        code = code.replace('_', ' ')
+    sr = spatial_references.get(code)
+    if sr is None:
+        sr = arcpy.SpatialReference(code)
+        spatial_references[code] = sr
+    return sr
+
+
+class Projection(object):
+
+    """
+    Forward (longitude, latitude in degrees -> x, y) and inverse transform
+    of one coordinate system, on whole numpy arrays at once. NAD83 and
+    WGS84 are treated as the same datum, as arcpy does when no geographic
+    transformation is given. Subclasses define forward(lon, lat) and
+    inverse(x, y), both returning a pair of float64 arrays.
+    """
+
+    wkid = None
+
+
+class Geographic(Projection):
+
+    def __init__(self, wkid=4326):
+        self.wkid = wkid
+
+    def forward(self, lon, lat):
+        return (np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+
+    def inverse(self, x, y):
+        return self.forward(x, y)
+
+
+class WebMercator(Projection):
+
+    """
+    Spherical (web) Mercator on the WGS84 semi-major axis
+    """
+
+    wkid = 3857
+    radius = 6378137.0
+    max_lat = 85.0511287798066
+
+    def forward(self, lon, lat):
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.clip(np.asarray(lat, dtype=np.float64), -self.max_lat, self.max_lat)
+        x = self.radius * np.radians(lon)
+        y = self.radius * np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+        return (x, y)
+
+    def inverse(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        lon = np.degrees(x / self.radius)
+        lat = np.degrees(np.pi / 2 - 2 * np.arctan(np.exp(-y / self.radius)))
+        return (lon, lat)
+
+
+class AlbersConic(Projection):
+
+    """
+    Albers equal-area conic on an ellipsoid, formulas from Snyder (1987),
+    Map Projections - A Working Manual, pp. 101-102.
+    """
+
+    def __init__(self, wkid, lat0, lon0, lat1, lat2, false_easting=0.0, false_northing=0.0,
+                 semi_major=6378137.0, inverse_flattening=298.257222101):
+        self.wkid = wkid
+        self.lon0 = math.radians(lon0)
+        self.false_easting = false_easting
+        self.false_northing = false_northing
+        self.a = semi_major
+        f = 1 / inverse_flattening
+        self.es = 2 * f - f * f
+        self.e = math.sqrt(self.es)
+        (m1, m2) = [self.m(math.radians(lat)) for lat in (lat1, lat2)]
+        (q0, q1, q2) = [self.q(math.radians(lat)) for lat in (lat0, lat1, lat2)]
+        if lat1 == lat2:
+            self.n = math.sin(math.radians(lat1))
+        else:
+            self.n = (m1 * m1 - m2 * m2) / (q2 - q1)
+        self.c = m1 * m1 + self.n * q1
+        self.rho0 = self.a * math.sqrt(self.c - self.n * q0) / self.n
+
+    def m(self, phi):
+        sin_phi = np.sin(phi)
+        return np.cos(phi) / np.sqrt(1 - self.es * sin_phi * sin_phi)
+
+    def q(self, phi):
+        e = self.e
+        sin_phi = np.sin(phi)
+        return (1 - self.es) * (sin_phi / (1 - self.es * sin_phi * sin_phi) -
+                                np.log((1 - e * sin_phi) / (1 + e * sin_phi)) / (2 * e))
+
+    def forward(self, lon, lat):
+        lon = np.radians(np.asarray(lon, dtype=np.float64))
+        lat = np.radians(np.asarray(lat, dtype=np.float64))
+        rho = self.a * np.sqrt(self.c - self.n * self.q(lat)) / self.n
+        theta = self.n * (lon - self.lon0)
+        x = rho * np.sin(theta) + self.false_easting
+        y = self.rho0 - rho * np.cos(theta) + self.false_northing
+        return (x, y)
+
+    def inverse(self, x, y, iterations=8):
+        x = np.asarray(x, dtype=np.float64) - self.false_easting
+        y = self.rho0 - (np.asarray(y, dtype=np.float64) - self.false_northing)
+        if self.n < 0:
+            (x, y) = (-x, -y)
+        rho = np.hypot(x, y)
+        theta = np.arctan2(x, y)
+        q = (self.c - (rho * self.n / self.a) ** 2) / self.n
+        # Fixed point iteration (Snyder eq. 3-16), converges to well below
+        # a millimetre within a few steps
+        es = self.es
+        e = self.e
+        phi = np.arcsin(np.clip(q / 2, -1.0, 1.0))
+        for i in range(iterations):
+            sin_phi = np.sin(phi)
+            one_minus = 1 - es * sin_phi * sin_phi
+            phi = phi + one_minus * one_minus / (2 * np.cos(phi)) * (
+                q / (1 - es) - sin_phi / one_minus +
+                np.log((1 - e * sin_phi) / (1 + e * sin_phi)) / (2 * e))
+        lon = np.degrees(theta / self.n + self.lon0)
+        return (lon, np.degrees(phi))
+
+
+projections = {
+    4326: Geographic(4326),
+    4269: Geographic(4269),
+    3857: WebMercator(),
+    # NAD83 / BC Environment Albers
+    3005: AlbersConic(3005, 45.0, -126.0, 50.0, 58.5, 1000000.0, 0.0),
+    # Canada Albers Equal Area Conic
+    102001: AlbersConic(102001, 40.0, -96.0, 50.0, 70.0),
+}
+
+
+def get_projection(wkid):
+    """
+    :return: Projection for wkid, see projections
+    """
+    try:
+        return projections[wkid]
+    except KeyError:
+        raise ValueError('No vectorized projection for WKID %s, use one of %s' % (
+            wkid, sorted(projections.keys())))
+
+
+def project(x, y, from_wkid, to_wkid):
+    """
+    Transforms coordinate arrays from one of the projections to another
+    :return: (x, y) numpy arrays
+    """
+    if from_wkid == to_wkid:
+        return (np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+    (lon, lat) = get_projection(from_wkid).inverse(x, y)
+    return get_projection(to_wkid).forward(lon, lat)
+
+
+def projected_distance(lon1, lat1, lon2, lat2, wkid=102001):
+    """
+    Straight-line distance between pairs of longitude / latitude points,
+    measured in projection wkid (metres)
+    """
+    (x1, y1) = get_projection(wkid).forward(lon1, lat1)
+    (x2, y2) = get_projection(wkid).forward(lon2, lat2)
+    return np.hypot(x2 - x1, y2 - y1)
+
+
+def haversine(lat1, lon1, lat2, lon2, radius=6371000.0):
+    """
+    Great circle distance in metres on a sphere, for numpy arrays (or
+    scalars) of latitudes and longitudes in degrees. The arguments are
+    broadcast, so one point against many works too.
+    """
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    sin_dlat = np.sin((lat2 - lat1) / 2)
+    sin_dlon = np.sin(np.radians(np.subtract(lon2, lon1)) / 2)
+    a = sin_dlat * sin_dlat + np.cos(lat1) * np.cos(lat2) * sin_dlon * sin_dlon
+    return 2 * radius * np.arctan2(np.sqrt(a), np.sqrt(np.maximum(0.0, 1 - a)))
+
+
+def vincenty(lat1, lon1, lat2, lon2, semi_major=6378137.0, inverse_flattening=298.257223563,
+             tolerance=1e-12, iterations=200):
+    """
+    Geodesic distance in metres on an ellipsoid (WGS84 by default) with
+    Vincenty's inverse formula, for numpy arrays of latitudes and longitudes
+    in degrees. Good to well below a millimetre. The iteration does not
+    converge for nearly antipodal points; those get the haversine distance
+    on a sphere of the mean radius instead (error up to about 0.5%).
+    """
+    (lat1, lon1, lat2, lon2) = np.broadcast_arrays(*[np.asarray(v, dtype=np.float64)
+                                                     for v in (lat1, lon1, lat2, lon2)])
+    f = 1 / inverse_flattening
+    b = semi_major * (1 - f)
+    big_l = np.radians(lon2 - lon1)
+    u1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    (sin_u1, cos_u1) = (np.sin(u1), np.cos(u1))
+    (sin_u2, cos_u2) = (np.sin(u2), np.cos(u2))
+    lam = big_l
+    converged = np.zeros(lam.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i in range(iterations):
+            (sin_lam, cos_lam) = (np.sin(lam), np.cos(lam))
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            # Coincident points have sin_sigma == 0
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha * sin_alpha
+            # Both points on the equator have cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0,
+                                    cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            previous = lam
+            lam = big_l + (1 - c) * f * sin_alpha * (sigma + c * sin_sigma * (
+                cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m * cos_2sigma_m)))
+            converged = np.abs(lam - previous) < tolerance
+            if converged.all():
+                break
+        u_sq = cos2_alpha * (semi_major * semi_major - b * b) / (b * b)
+        big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m * cos_2sigma_m) -
+            big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma * sin_sigma) *
+            (-3 + 4 * cos_2sigma_m * cos_2sigma_m)))
+        dist = b * big_a * (sigma - delta_sigma)
+    if not converged.all():
+        failed = ~converged | ~np.isfinite(dist)
+        radius = (2 * semi_major + b) / 3
+        dist = np.where(failed, haversine(lat1, lon1, lat2, lon2, radius), dist)
+    return dist
+
+
+distance_methods = ['haversine', 'vincenty', 'albers']
+
+
+def geo_distance(lat1, lon1, lat2, lon2, method='haversine'):
+    """
+    Distances in metres between latitude / longitude points (degrees,
+    numpy arrays or scalars, broadcast against each other).
+    :param method: 'haversine' (sphere), 'vincenty' (WGS84 ellipsoid) or
+    'albers': straight line in Canada Albers, the same lengths as
+    GeomTools.calcDistanceBetweenPointsLL
+    """
+    if method == 'haversine':
+        return haversine(lat1, lon1, lat2, lon2)
+    if method == 'vincenty':
+        return vincenty(lat1, lon1, lat2, lon2)
+    if method == 'albers':
+        return projected_distance(lon1, lat1, lon2, lat2, 102001)
+    raise ValueError('Distance method must be one of %s' % distance_methods)
+
+
+def distance_matrix_chunks(lat1, lon1, lat2, lon2, method='haversine', max_bytes=64 * 1024 ** 2):
+    """
+    Generator of blocks of the distance matrix between every point of set 1
+    (rows) and every point of set 2 (columns).
+    :param max_bytes: size limit of one block; working memory is a few
+    times (haversine) up to about twenty times (vincenty) this
+    :return: yields (first row, block) with block a 2D array of some rows
+    """
+    lat1 = np.ravel(lat1).astype(np.float64)
+    lon1 = np.ravel(lon1).astype(np.float64)
+    lat2 = np.ravel(lat2).astype(np.float64)[np.newaxis, :]
+    lon2 = np.ravel(lon2).astype(np.float64)[np.newaxis, :]
+    rows = max(1, int(max_bytes // (8 * max(1, lat2.shape[1]))))
+    for start in range(0, len(lat1), rows):
+        stop = start + rows
+        yield (start, geo_distance(lat1[start:stop, np.newaxis], lon1[start:stop, np.newaxis],
+                                   lat2, lon2, method))
+
+
+def distance_matrix(lat1, lon1, lat2=None, lon2=None, method='haversine',
+                    max_bytes=64 * 1024 ** 2, out=None):
+    """
+    Full distance matrix (metres) between point sets 1 and 2, or between
+    all points of set 1 if set 2 is not given. Computed in blocks of at most
+    max_bytes (see distance_matrix_chunks).
+    :param out: array to fill, e.g. a numpy.memmap for matrices larger than memory
+    :return: 2D float64 array, len(set 1) x len(set 2)
+    """
+    if lat2 is None:
+        (lat2, lon2) = (lat1, lon1)
+    shape = (np.size(lat1), np.size(lat2))
+    if out is None:
+        out = np.empty(shape, dtype=np.float64)
+    elif out.shape != shape:
+        raise ValueError('out must have shape %s, not %s' % (shape, out.shape))
+    for (start, block) in distance_matrix_chunks(lat1, lon1, lat2, lon2, method, max_bytes):
+        out[start:start + len(block)] = block
+    return out
+
+
+class GridIndex(object):
+
+    """
+    Uniform grid over points, stored as arrays: the sorted int64 keys of
+    the occupied cells, CSR offsets into the item array (items of cell
+    keys[k] are items[offsets[k]:offsets[k + 1]]) and the coordinates of
+    the items in the same order.
+
+    Cells are centred on multiples of cell_size, i.e. a point belongs to the
+    cell its coordinates round to, like GeomTools.spatialKey. Cell (i, j)
+    has the key (i << 32) + j + 2 ** 31, so cell columns must fit in 32 bits
+    and the cells of one column i are consecutive keys.
+
+    Also works as a read-only dict of key: array of items.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.keys_array = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.items = np.zeros(0, dtype=np.int64)
+        self.x = np.zeros(0, dtype=np.float64)
+        self.y = np.zeros(0, dtype=np.float64)
+
+    @staticmethod
+    def pack(i, j):
+        """
+        :return: int64 key(s) of cell column(s) i and row(s) j
+        """
+        if isinstance(i, np.ndarray) or isinstance(j, np.ndarray):
+            return (np.asarray(i, dtype=np.int64) << 32) + (np.asarray(j, dtype=np.int64) + 2 ** 31)
+        return (int(i) << 32) + int(j) + 2 ** 31
+
+    @staticmethod
+    def unpack(key):
+        """
+        :return: (i, j) cell column and row of key(s)
+        """
+        return (key >> 32, (key & 0xFFFFFFFF) - 2 ** 31)
+
+    def cell(self, x, y):
+        """
+        :return: (i, j) cell of coordinates (scalars or arrays)
+        """
+        if isinstance(x, np.ndarray) or isinstance(y, np.ndarray):
+            return (np.floor(np.asarray(x) / self.cell_size + 0.5).astype(np.int64),
+                    np.floor(np.asarray(y) / self.cell_size + 0.5).astype(np.int64))
+        return (int(math.floor(x / self.cell_size + 0.5)), int(math.floor(y / self.cell_size + 0.5)))
+
+    def key(self, x, y):
+        """
+        :return: key of the cell of a point, or int64 array of keys for arrays
+        """
+        (i, j) = self.cell(x, y)
+        return self.pack(i, j)
+
+    def build(self, x, y, items=None):
+        """
+        Indexes points, replacing anything indexed before
+        :param x: array of x coordinates
+        :param y: array of y coordinates
+        :param items: ids of the points (default: their positions 0..n-1)
+        """
+        x = np.ravel(np.asarray(x, dtype=np.float64))
+        y = np.ravel(np.asarray(y, dtype=np.float64))
+        if items is None:
+            items = np.arange(len(x), dtype=np.int64)
+        else:
+            items = np.ravel(np.asarray(items))
+        keys = self.key(x, y)
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        self.items = items[order]
+        self.x = x[order]
+        self.y = y[order]
+        if len(keys):
+            starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        else:
+            starts = np.zeros(0, dtype=np.int64)
+        self.keys_array = keys[starts]
+        self.offsets = np.concatenate((starts, [len(keys)])).astype(np.int64)
+        return self
+
+    def key_range(self, key_low, key_high):
+        """
+        :return: (first, stop) positions in items of the cells with keys in [key_low, key_high]
+        """
+        k0 = np.searchsorted(self.keys_array, key_low, 'left')
+        k1 = np.searchsorted(self.keys_array, key_high, 'right')
+        return (self.offsets[k0], self.offsets[k1])
+
+    def candidates(self, xmin, ymin, xmax, ymax):
+        """
+        :return: positions (in items) of the points in the cells touching the box
+        """
+        (i0, j0) = self.cell(xmin, ymin)
+        (i1, j1) = self.cell(xmax, ymax)
+        i0 = max(i0, int(self.keys_array[0] >> 32)) if len(self.keys_array) else i0
+        i1 = min(i1, int(self.keys_array[-1] >> 32)) if len(self.keys_array) else i0 - 1
+        # Each cell column is one run of consecutive keys, so one slice
+        ranges = [self.key_range(self.pack(i, j0), self.pack(i, j1)) for i in range(i0, i1 + 1)]
+        ranges = [(first, stop) for (first, stop) in ranges if stop > first]
+        if not ranges:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.arange(first, stop) for (first, stop) in ranges])
+
+    def query_box(self, xmin, ymin, xmax, ymax):
+        """
+        :return: array of the items inside the box (edges included)
+        """
+        pos = self.candidates(xmin, ymin, xmax, ymax)
+        x = self.x[pos]
+        y = self.y[pos]
+        inside = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+        return self.items[pos[inside]]
+
+    def lookup(self, keys):
+        """
+        :return: positions (in items) of the points in the cells with the given keys
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        k = np.searchsorted(self.keys_array, keys)
+        found = k < len(self.keys_array)
+        found[found] = self.keys_array[k[found]] == keys[found]
+        k = k[found]
+        starts = self.offsets[k]
+        lengths = self.offsets[k + 1] - starts
+        if not lengths.sum():
+            return np.zeros(0, dtype=np.int64)
+        # Concatenated ranges starts[n]:starts[n] + lengths[n] without a loop
+        shift = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return shift + np.arange(lengths.sum())
+
+    def neighbor_keys(self, x, y, radius):
+        """
+        :return: int64 array of the keys of the cells that may hold points within radius of (x, y)
+        """
+        return self.key(x, y) + grid_stencil(self.cell_size, radius)
+
+    def stencil_exceeds(self, radius):
+        """
+        :return: True if the stencil for radius would have more cells than the
+        index has keys, so that checking every point is cheaper
+        """
+        return (2 * math.ceil(radius / self.cell_size) + 3) ** 2 > 4 * len(self.keys_array)
+
+    def query_radius(self, x, y, radius, distances=False):
+        """
+        :return: array of the items within radius of (x, y), nearest first, and
+        an array of their distances if distances is True
+        """
+        if self.stencil_exceeds(radius):
+            pos = np.arange(len(self.x))
+        else:
+            pos = self.lookup(self.neighbor_keys(x, y, radius))
+        d = np.hypot(self.x[pos] - x, self.y[pos] - y)
+        inside = d <= radius
+        (pos, d) = (pos[inside], d[inside])
+        order = np.argsort(d, kind='mergesort')
+        if distances:
+            return (self.items[pos[order]], d[order])
+        return self.items[pos[order]]
+
+    def nearest(self, x, y, k=1, max_distance=None):
+        """
+        The k items closest to (x, y), searching ever larger radii
+        :return: (items, distances) arrays, nearest first
+        """
+        radius = self.cell_size
+        while True:
+            if max_distance is not None and radius >= max_distance:
+                radius = max_distance
+            if self.stencil_exceeds(radius):
+                # Check every point, without growing the radius any further
+                d = np.hypot(self.x - x, self.y - y)
+                if max_distance is None:
+                    inside = np.arange(len(d))
+                else:
+                    inside = np.flatnonzero(d <= max_distance)
+                order = inside[np.argsort(d[inside], kind='mergesort')[:k]]
+                return (self.items[order], d[order])
+            (items, d) = self.query_radius(x, y, radius, True)
+            if len(items) >= k or radius == max_distance:
+                return (items[:k], d[:k])
+            radius *= 2
+
+    def __len__(self):
+        return len(self.keys_array)
+
+    def __contains__(self, key):
+        k = np.searchsorted(self.keys_array, key)
+        return k < len(self.keys_array) and self.keys_array[k] == key
+
+    def __getitem__(self, key):
+        k = np.searchsorted(self.keys_array, key)
+        if k >= len(self.keys_array) or self.keys_array[k] != key:
+            raise KeyError(key)
+        return self.items[self.offsets[k]:self.offsets[k + 1]]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [int(key) for key in self.keys_array]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+def grid_key(x, y, cell_size):
+    """
+    :return: GridIndex key of the cell of size cell_size holding point (x, y)
+    """
+    return GridIndex.pack(math.floor(x / cell_size + 0.5), math.floor(y / cell_size + 0.5))
+
+
+# Key offsets by stencil parameters, most recently used last, see grid_stencil.
+# Bounded both in entries and in total size of the arrays.
+grid_stencils = OrderedDict()
+grid_stencil_limit = 64
+grid_stencil_bytes = 32 * 1024 * 1024
+
+
+def grid_stencil(cell_size, radius, max_i=None, max_j=None, centres=False):
+    """
+    Offsets to add to a GridIndex key to get the keys of the cells around it,
+    computed once per set of arguments. pack(i + di, j + dj) is
+    pack(i, j) + (di << 32) + dj, so neighbours are found by integer addition.
+    :param radius: by default, the cells that may hold points within radius
+    of any point of the centre cell. The radius is rounded up to whole cells
+    so that stencils are shared between radii. With centres=True, the cells
+    with centres closer than radius to the centre of the centre cell
+    :param max_i: largest column offset (default: as far as radius reaches)
+    :param max_j: largest row offset
+    :return: sorted int64 array of key offsets
+    """
+    if centres:
+        stencil_key = (cell_size, radius, max_i, max_j, True)
+    else:
+        # In cells: a stencil for a larger radius is still complete
+        steps = int(math.ceil(radius / cell_size))
+        (cell_size, radius) = (1.0, float(steps))
+        stencil_key = (steps, max_i, max_j, False)
+    stencil = grid_stencils.pop(stencil_key, None)
+    if stencil is None:
+        reach = int(math.ceil(radius / cell_size)) + 1
+        di = np.arange(-(reach if max_i is None else max_i), (reach if max_i is None else max_i) + 1)
+        dj = np.arange(-(reach if max_j is None else max_j), (reach if max_j is None else max_j) + 1)
+        (di, dj) = [a.ravel() for a in np.meshgrid(di, dj, indexing='ij')]
+        if centres:
+            inside = cell_size * np.hypot(di, dj) < radius
+        else:
+            # Gap between the cells: the nearest points may sit on the facing edges
+            inside = cell_size * np.hypot(np.maximum(0, np.abs(di) - 1),
+                                          np.maximum(0, np.abs(dj) - 1)) <= radius
+        stencil = np.sort((di[inside].astype(np.int64) << 32) + dj[inside])
+        if stencil.nbytes > grid_stencil_bytes:
+            # Too big to keep
+            return stencil
+        size = sum(cached.nbytes for cached in grid_stencils.values())
+        while grid_stencils and (len(grid_stencils) >= grid_stencil_limit or
+                                 size + stencil.nbytes > grid_stencil_bytes):
+            # Forget the least recently used
+            size -= grid_stencils.popitem(last=False)[1].nbytes
+    grid_stencils[stencil_key] = stencil
+    return stencil
+
+
+class STRTree(object):
+
+    """
+    Static R-tree over bounding boxes, bulk loaded with Sort-Tile-Recursive
+    packing. Entries are (id, part) pairs with a box each, e.g. feature OID
+    and part number. Node i of a level holds nodes (or entries) i * node_size
+    to (i + 1) * node_size - 1 of the level below, so the tree is just the
+    boxes of all levels in one array and queries work a level at a time on
+    numpy arrays.
+
+    Queries test the boxes only: intersects and within_distance return the
+    candidates, nearest the distance to the boxes. Check exact geometry
+    afterwards where that matters.
+
+    save() writes a flat binary file that load() maps into memory (mmap)
+    without reading or rebuilding anything.
+    """
+
+    magic = b'STRTREE1'
+    header_format = '<8sIIiQ'
+
+    def __init__(self, node_size=16):
+        self.node_size = node_size
+        self.wkid = 0
+        self.level_sizes = [0]
+        self.level_starts = [0]
+        self.boxes = np.zeros((0, 4), dtype=np.float64)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.parts = np.zeros(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def build(self, boxes, ids, parts=None, wkid=0):
+        """
+        :param boxes: array of shape (n, 4): xmin, ymin, xmax, ymax
+        :param ids: array of n ids (int)
+        :param parts: array of n part numbers (default 0)
+        :param wkid: spatial reference of the boxes, kept with the tree
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        ids = np.asarray(ids, dtype=np.int64)
+        parts = np.zeros(len(ids), dtype=np.int32) if parts is None else np.asarray(parts, dtype=np.int32)
+        n = len(boxes)
+        m = self.node_size
+        self.wkid = wkid
+        if n:
+            # Sort-Tile-Recursive: vertical slices of about sqrt(leaf count) leaves, by x,
+            # then by y within each slice
+            cx = boxes[:, 0] + boxes[:, 2]
+            cy = boxes[:, 1] + boxes[:, 3]
+            slices = int(math.ceil(math.sqrt(math.ceil(n / m))))
+            slice_size = slices * m
+            by_x = np.argsort(cx, kind='mergesort')
+            slice_ids = np.arange(n) // slice_size
+            order = by_x[np.lexsort((cy[by_x], slice_ids))]
+            boxes = boxes[order]
+            ids = ids[order]
+            parts = parts[order]
+        levels = [boxes]
+        while len(levels[-1]) > 1:
+            below = levels[-1]
+            starts = np.arange(0, len(below), m)
+            levels.append(np.column_stack([
+                np.minimum.reduceat(below[:, 0], starts), np.minimum.reduceat(below[:, 1], starts),
+                np.maximum.reduceat(below[:, 2], starts), np.maximum.reduceat(below[:, 3], starts)]))
+        self.level_sizes = [len(level) for level in levels]
+        self.level_starts = [int(start) for start in np.cumsum([0] + self.level_sizes[:-1])]
+        self.boxes = np.concatenate(levels) if n else boxes
+        self.ids = ids
+        self.parts = parts
+        return self
+
+    def search(self, test):
+        """
+        :param test: function of an (n, 4) array of boxes returning a boolean mask,
+        must be True for a node box whenever it is True for a box inside it
+        :return: positions of the matching entries
+        """
+        top = len(self.level_sizes) - 1
+        if not len(self.ids):
+            return np.zeros(0, dtype=np.int64)
+        nodes = np.arange(self.level_sizes[top])
+        nodes = nodes[test(self.boxes[self.level_starts[top] + nodes])]
+        children = np.arange(self.node_size)
+        for level in range(top, 0, -1):
+            below = (nodes[:, np.newaxis] * self.node_size + children).ravel()
+            below = below[below < self.level_sizes[level - 1]]
+            nodes = below[test(self.boxes[self.level_starts[level - 1] + below])]
+        return nodes
+
+    def results(self, pos, parts):
+        if parts:
+            return (self.ids[pos], self.parts[pos])
+        return np.unique(self.ids[pos])
+
+    def intersects(self, box, parts=False):
+        """
+        :param box: (xmin, ymin, xmax, ymax); use (x, y, x, y) for a point
+        :return: sorted array of the ids with an intersecting box, or
+        (ids, parts) arrays of every intersecting entry if parts is True
+        """
+        (xmin, ymin, xmax, ymax) = box
+
+        def test(b):
+            return (b[:, 0] <= xmax) & (b[:, 2] >= xmin) & (b[:, 1] <= ymax) & (b[:, 3] >= ymin)
+        return self.results(self.search(test), parts)
+
+    @staticmethod
+    def box_distance(b, box):
+        """
+        :return: array of the distances between the boxes b and one box (0 if they overlap)
+        """
+        (xmin, ymin, xmax, ymax) = box
+        dx = np.maximum(0.0, np.maximum(b[:, 0] - xmax, xmin - b[:, 2]))
+        dy = np.maximum(0.0, np.maximum(b[:, 1] - ymax, ymin - b[:, 3]))
+        return np.hypot(dx, dy)
+
+    def within_distance(self, box, distance, parts=False):
+        """
+        :return: ids (see intersects) of the entries with a box within distance of box
+        """
+        def test(b):
+            return self.box_distance(b, box) <= distance
+        return self.results(self.search(test), parts)
+
+    def nearest(self, x, y, k=1, max_distance=None):
+        """
+        Best-first search for the k entries with boxes closest to (x, y)
+        :return: list of (id, part, distance) by increasing distance
+        """
+        found = []
+        if not len(self.ids):
+            return found
+        box = (x, y, x, y)
+        if max_distance is None:
+            max_distance = float('inf')
+        top = len(self.level_sizes) - 1
+        nodes = np.arange(self.level_sizes[top])
+        heap = [(d, top, i) for (i, d) in zip(nodes, self.box_distance(self.boxes[self.level_starts[top] + nodes], box))
+                if d <= max_distance]
+        heapq.heapify(heap)
+        while heap and len(found) < k:
+            (d, level, i) = heapq.heappop(heap)
+            if level == 0:
+                found.append((int(self.ids[i]), int(self.parts[i]), float(d)))
+                continue
+            first = i * self.node_size
+            below = np.arange(first, min(first + self.node_size, self.level_sizes[level - 1]))
+            distances = self.box_distance(self.boxes[self.level_starts[level - 1] + below], box)
+            for (j, dj) in zip(below, distances):
+                if dj <= max_distance:
+                    heapq.heappush(heap, (dj, level - 1, j))
+        return found
+
+    def save(self, path):
+        """
+        Writes the tree to one binary file: header, level sizes, then the
+        boxes (float64), ids (int64) and parts (int32), little-endian
+        """
+        levels = len(self.level_sizes)
+        header = struct.pack(self.header_format, self.magic, self.node_size, levels,
+                             int(self.wkid or 0), len(self.ids))
+        header += struct.pack('<%sQ' % levels, *self.level_sizes)
+        header += b'\0' * (-len(header) % 8)
+        with open(path, 'wb') as f:
+            f.write(header)
+            f.write(np.ascontiguousarray(self.boxes, dtype='<f8').tostring())
+            f.write(np.ascontiguousarray(self.ids, dtype='<i8').tostring())
+            f.write(np.ascontiguousarray(self.parts, dtype='<i4').tostring())
+        return path
+
+    def load(self, path, mmap=True):
+        """
+        Opens a tree written by save(), memory-mapped (read only) unless mmap is False
+        """
+        with open(path, 'rb') as f:
+            head = f.read(struct.calcsize(self.header_format))
+            (magic, self.node_size, levels, self.wkid, count) = struct.unpack(self.header_format, head)
+            if magic != self.magic:
+                raise ValueError('%s is not an STRTree file' % path)
+            self.level_sizes = list(struct.unpack('<%sQ' % levels, f.read(8 * levels)))
+        offset = len(head) + 8 * levels
+        offset += -offset % 8
+        self.level_starts = [int(start) for start in np.cumsum([0] + self.level_sizes[:-1])]
+        nodes = int(sum(self.level_sizes)) if count else 0
+
+        def read(dtype, shape, offset):
+            if not int(np.prod(shape)):
+                return np.zeros(shape, dtype=dtype)
+            if mmap:
+                return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                return np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+        self.boxes = read('<f8', (nodes, 4), offset)
+        offset += 32 * nodes
+        self.ids = read('<i8', (count,), offset)
+        offset += 8 * count
+        self.parts = read('<i4', (count,), offset)
+        return self
+
+
+class NpyAppender(object):
+
+    """
+    Writes a NumPy .npy file whose length is not known in advance. A header
+    with room for any length is written first, chunks of values are appended
+    to the file as they come, and close() rewrites the header with the final
+    shape. The file can then be opened with np.load(path, mmap_mode='r').
+    """
+
+    header_size = 128
+
+    def __init__(self, path, dtype, width=None):
+        """
+        :param dtype: numpy dtype of the values
+        :param width: number of columns for a 2-d array, e.g. 2 for XY coordinates
+        """
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.width = width
+        self.count = 0
+        self.f = open(path, 'wb')
+        self.f.write(self.header(0))
+
+    def header(self, count):
+        if self.width is None:
+            shape = '(%d,)' % count
+        else:
+            shape = '(%d, %d)' % (count, self.width)
+        text = "{'descr': %r, 'fortran_order': False, 'shape': %s, }" % (
+            np.lib.format.dtype_to_descr(self.dtype), shape)
+        # Version 1.0 header, padded with spaces to a fixed size
+        text = text.ljust(self.header_size - 11) + '\n'
+        return '\x93NUMPY\x01\x00' + struct.pack('<H', len(text)) + text
+
+    def append(self, values):
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        values.tofile(self.f)
+        self.count += len(values)
+
+    def close(self):
+        self.f.seek(0)
+        self.f.write(self.header(self.count))
+        self.f.close()
+
+
+class GeometryColumnWriter(object):
+
+    """
+    Writes the geometry of ArcTools.exportTableToColumns: shapes are read from
+    WKB and appended to the coordinate, ring, part and feature offset arrays
+    described in ColumnarTable.
+    """
+
+    def __init__(self, folder):
+        self.files = {}
+        self.writers = {}
+        for (key, dtype, width) in [('coords', 'f8', 2), ('ring_offsets', 'i8', None),
+                                    ('part_offsets', 'i8', None), ('feature_offsets', 'i8', None)]:
+            self.files[key] = '_geometry.%s.npy' % key
+            self.writers[key] = NpyAppender(os.path.join(folder, self.files[key]), dtype, width)
+            if key != 'coords':
+                self.writers[key].append([0])
+        # Number of coordinates, rings and parts written so far
+        self.totals = (0, 0, 0)
+
+    def append(self, shapes):
+        """
+        :param shapes: sequence of WKB shapes (None for null geometry)
+        """
+        (n_coords, n_rings, n_parts) = self.totals
+        coords = []
+        ring_ends = []
+        part_ends = []
+        feature_ends = []
+        for wkb in shapes:
+            if wkb:
+                (geom_type, parts) = read_wkb(bytearray(wkb))[:2]
+                if geom_type not in (3, 6):
+                    # Points and paths: one ring per part
+                    parts = [[part] for part in parts]
+                for rings in parts:
+                    for ring in rings:
+                        coords.append(ring)
+                        n_coords += len(ring)
+                        ring_ends.append(n_coords)
+                    n_rings += len(rings)
+                    part_ends.append(n_rings)
+                n_parts += len(parts)
+            feature_ends.append(n_parts)
+        if coords:
+            self.writers['coords'].append(np.vstack(coords))
+        self.writers['ring_offsets'].append(ring_ends)
+        self.writers['part_offsets'].append(part_ends)
+        self.writers['feature_offsets'].append(feature_ends)
+        self.totals = (n_coords, n_rings, n_parts)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+class TextColumn(object):
+
+    """
+    Read access to a text column of a ColumnarTable: UTF-8 bytes of all values
+    in one array and the offset of each value in another (rows + 1 entries).
+    """
+
+    def __init__(self, data, offsets, nulls=None):
+        self.data = data
+        self.offsets = offsets
+        self.nulls = nulls
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tostring().decode('utf-8')
+
+
+class ColumnarTable(object):
+
+    """
+    Reads a folder written by ArcTools.exportTableToColumns. Arrays are
+    memory-mapped from the .npy files, so opening a table copies nothing and
+    only the pages that are used are read from disk.
+
+    Geometry is held in four arrays: XY coordinates, ring_offsets (start of
+    each ring in coords), part_offsets (start of each part in the rings) and
+    feature_offsets (start of each feature in the parts), each with one extra
+    entry at the end. Points and paths are parts with a single ring.
+    """
+
+    def __init__(self, folder, mmap=True):
+        self.folder = folder
+        self.mmap_mode = 'r' if mmap else None
+        with open(os.path.join(folder, 'schema.json'), 'rb') as f:
+            self.schema = json.load(f)
+        self.rows = self.schema['rows']
+        self.names = [column['name'] for column in self.schema['columns']]
+        self.geometry_schema = self.schema.get('geometry')
+        if self.geometry_schema:
+            self.coords = self.load(self.geometry_schema['coords'])
+            self.ring_offsets = self.load(self.geometry_schema['ring_offsets'])
+            self.part_offsets = self.load(self.geometry_schema['part_offsets'])
+            self.feature_offsets = self.load(self.geometry_schema['feature_offsets'])
+
+    def load(self, name):
+        path = os.path.join(self.folder, name)
+        if self.mmap_mode and os.path.getsize(path) <= NpyAppender.header_size:
+            # An empty file cannot be memory-mapped
+            return np.load(path)
+        return np.load(path, mmap_mode=self.mmap_mode)
+
+    def column_schema(self, name):
+        return self.schema['columns'][self.names.index(name)]
+
+    def nulls(self, name):
+        """
+        :return: boolean array, True where the value is null, or None if the column has no nulls
+        """
+        column = self.column_schema(name)
+        if not column.get('nulls'):
+            return None
+        return self.load(column['nulls'])
+
+    def column(self, name):
+        """
+        :return: array of the values of a column (nulls are 0, NaN or NaT), or
+        a TextColumn for text
+        """
+        column = self.column_schema(name)
+        if column.get('offsets'):
+            return TextColumn(self.load(column['file']), self.load(column['offsets']), self.nulls(name))
+        return self.load(column['file'])
+
+    def geometry(self, i):
+        """
+        :return: parts of feature i, each a list of (n, 2) coordinate arrays
+        (views into coords); an empty list for null geometry
+        """
+        parts = []
+        for part in range(self.feature_offsets[i], self.feature_offsets[i + 1]):
+            rings = []
+            for ring in range(self.part_offsets[part], self.part_offsets[part + 1]):
+                rings.append(self.coords[self.ring_offsets[ring]:self.ring_offsets[ring + 1]])
+            parts.append(rings)
+        return parts
+
+
+class HyperLogLog(object):
+
+    """
+    Approximate distinct count in fixed memory: 2 ** precision one-byte
+    registers (16 KB at the default precision), with a standard error of
+    about 1.04 / sqrt(2 ** precision), i.e. 0.8%. Values are hashed to 64
+    bits with md5. Sketches with the same precision can be merged.
+    """
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+        self.value_bits = 64 - precision
+        self.value_mask = (1 << self.value_bits) - 1
+
+    def add(self, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        (h,) = struct.unpack('<Q', hashlib.md5(repr(value)).digest()[:8])
+        index = h >> self.value_bits
+        # Position of the first 1 bit in the remaining bits
+        rank = self.value_bits - (h & self.value_mask).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        for i in range(self.m):
+            if other.registers[i] > self.registers[i]:
+                self.registers[i] = other.registers[i]
+
+    def count(self):
+        registers = np.frombuffer(bytes(self.registers), np.uint8)
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / np.sum(np.ldexp(1.0, -registers.astype(int)))
+        zeros = int((registers == 0).sum())
+        if estimate <= 2.5 * self.m and zeros:
+            # Small cardinalities: linear counting is more accurate
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+
+class ColumnProfile(object):
+
+    """
+    Profile of the values in one column, collected in a single pass: row,
+    null and blank counts, min and max, and the count of every distinct value,
+    so memory grows with the number of distinct values, not rows.
+
+    In approximate mode, for very high-cardinality columns, distinct values
+    are counted with a HyperLogLog sketch and the most common values with a
+    Misra-Gries summary of 10 * top counters, reduced in batches (counts are
+    lower bounds, off by at most rows / (10 * top + 1)). Memory is then fixed.
+    """
+
+    def __init__(self, name, field_type=None, top=10, approximate=False):
+        self.name = name
+        self.field_type = field_type
+        self.top = top
+        self.approximate = approximate
+        self.count = 0
+        self.nulls = 0
+        self.blanks = 0
+        self.min = None
+        self.max = None
+        self.counts = {}
+        self.hll = HyperLogLog() if approximate else None
+        self.capacity = 10 * top
+
+    def add(self, val):
+        self.count += 1
+        if val is None:
+            self.nulls += 1
+            return
+        if isinstance(val, basestring) and not val.strip():
+            self.blanks += 1
+        if self.min is None or val < self.min:
+            self.min = val
+        if self.max is None or val > self.max:
+            self.max = val
+        counts = self.counts
+        if val in counts:
+            counts[val] += 1
+        elif not self.approximate:
+            counts[val] = 1
+        else:
+            self.hll.add(val)
+            counts[val] = 1
+            if len(counts) >= 2 * self.capacity:
+                self.reduce()
+
+    def reduce(self):
+        # Batched Misra-Gries step: subtract the (capacity + 1)-th largest count
+        # from every counter, which leaves at most capacity of them
+        cut = sorted(self.counts.values(), reverse=True)[self.capacity]
+        self.counts = dict((key, n - cut) for (key, n) in self.counts.items() if n > cut)
+
+    def distinct(self):
+        """
+        :return: number of distinct non-null values (estimated in approximate mode)
+        """
+        if self.approximate:
+            return max(self.hll.count(), len(self.counts))
+        return len(self.counts)
+
+    def most_common(self, k=None):
+        """
+        :return: list of (value, count) of the k (default: top) most common values
+        """
+        k = k or self.top
+        return sorted(self.counts.items(), key=lambda x: x[1], reverse=True)[:k]
+
+    def values(self):
+        """
+        :return: dict of every distinct value -> count (exact mode only)
+        """
+        if self.approximate:
+            raise ValueError('Value counts are not kept in approximate mode')
+        return self.counts
+
+    def summary(self):
+        return {
+            'name': self.name,
+            'type': self.field_type,
+            'count': self.count,
+            'nulls': self.nulls,
+            'blanks': self.blanks,
+            'distinct': self.distinct(),
+            'approximate': self.approximate,
+            'min': self.min,
+            'max': self.max,
+            'top': self.most_common(),
+        }
+
+
+class ValidationRule(object):
+
+    """
+    Base class for the attribute rules checked by ArcTools.validateRules.
+    A rule reads one or more columns and test() returns True if the values
+    of a row are valid. Null values pass every rule except NotNull, unless
+    allow_null is False.
+    """
+
+    description = 'rule'
+
+    def __init__(self, columns, name=None, allow_null=True):
+        if not type(columns) is list:
+            columns = [columns]
+        self.columns = columns
+        self.name = name or '%s %s' % (', '.join(columns), self.description)
+        self.allow_null = allow_null
+
+    def test(self, *values):
+        return True
+
+
+class AllowedValues(ValidationRule):
+
+    description = 'allowed values'
+
+    def __init__(self, column, values, name=None, allow_null=True):
+        ValidationRule.__init__(self, column, name, allow_null)
+        self.values = frozenset(values)
+
+    def test(self, val):
+        if val is None:
+            return self.allow_null
+        return val in self.values
+
+
+class MatchesPattern(ValidationRule):
+
+    """
+    The whole value (as text) must match the regular expression.
+    """
+
+    description = 'pattern'
+
+    def __init__(self, column, pattern, name=None, allow_null=True, flags=0):
+        ValidationRule.__init__(self, column, name, allow_null)
+        self.pattern = re.compile(r'(?:%s)\Z' % pattern, flags)
+
+    def test(self, val):
+        if val is None:
+            return self.allow_null
+        if not isinstance(val, basestring):
+            val = unicode(val)
+        return self.pattern.match(val) is not None
+
+
+class InRange(ValidationRule):
+
+    """
+    low <= value <= high; either bound may be None.
+    """
+
+    description = 'range'
+
+    def __init__(self, column, low=None, high=None, name=None, allow_null=True):
+        ValidationRule.__init__(self, column, name, allow_null)
+        self.low = low
+        self.high = high
+
+    def test(self, val):
+        if val is None:
+            return self.allow_null
+        return (self.low is None or val >= self.low) and (self.high is None or val <= self.high)
+
+
+class NotNull(ValidationRule):
+
+    """
+    No nulls, and for text no empty or white space only values.
+    """
+
+    description = 'not null'
+
+    def __init__(self, column, name=None):
+        ValidationRule.__init__(self, column, name, False)
+
+    def test(self, val):
+        if val is None:
+            return False
+        return not isinstance(val, basestring) or bool(val.strip())
+
+
+class CrossField(ValidationRule):
+
+    """
+    A test over several columns: check(*values) returns True if the row is
+    valid, e.g. CrossField(['START', 'END'], lambda start, end: start <= end).
+    Rows with a null in any of the columns pass if allow_null is True.
+    """
+
+    description = 'cross-field rule'
+
+    def __init__(self, columns, check, name=None, allow_null=True):
+        ValidationRule.__init__(self, columns, name, allow_null)
+        self.check = check
+
+    def test(self, *values):
+        if self.allow_null and None in values:
+            return True
+        return bool(self.check(*values))
+
+
+# Rule types of the dict form of rules, see make_rule
+rule_types = {
+    'allowed': AllowedValues,
+    'pattern': MatchesPattern,
+    'range': InRange,
+    'not_null': NotNull,
+    'cross_field': CrossField,
+}
+
+
+def make_rule(spec):
+    """
+    Builds a rule from its declarative form, a dict with 'rule' (a key of
+    rule_types) and the keyword arguments of the rule class, e.g.
+    {'rule': 'allowed', 'column': 'STATUS', 'values': ['A', 'B']} or
+    {'rule': 'range', 'column': 'WIDTH', 'low': 0}.
+    Rule objects are returned unchanged.
+    """
+    if isinstance(spec, ValidationRule):
+        return spec
+    spec = dict(spec)
+    rule_type = spec.pop('rule')
+    if rule_type not in rule_types:
+        raise ValueError('Unknown rule type %s, must be one of %s' % (rule_type, sorted(rule_types)))
+    return rule_types[rule_type](**spec)
+
+
+def trim(val):
+    # Leading and trailing white space removed from text
+    if isinstance(val, basestring):
+        return val.strip()
+    return val
+
+
+def whitespace_to_null(val):
+    # Empty, white space only and 'None' text becomes null
+    if isinstance(val, basestring) and val.strip() in ('', 'None'):
+        return None
+    return val
+
+
+def values_to_null(values):
+    """
+    :return: transform turning any of values into null
+    """
+    values = frozenset(values)
+
+    def transform(val):
+        if val in values:
+            return None
+        return val
+    return transform
+
+
+def change_case(case):
+    """
+    :param case: 'upper', 'lower' or 'title'
+    :return: transform changing the case of text
+    """
+    if case not in ('upper', 'lower', 'title'):
+        raise ValueError('Case must be upper, lower or title')
+
+    def transform(val):
+        if isinstance(val, basestring):
+            return getattr(val, case)()
+        return val
+    return transform
+
+
+def to_number(number_type=float, invalid='keep'):
+    """
+    :param number_type: int or float (or their names)
+    :param invalid: what to do with values that are not numbers: 'keep' them
+    or turn them to 'null'
+    :return: transform casting numbers and numeric text to number_type.
+    Floats are rounded when cast to int.
+    """
+    number_type = {'int': int, 'float': float}.get(number_type, number_type)
+
+    def transform(val):
+        if val is None:
+            return None
+        try:
+            number = float(val)
+            if number_type is int:
+                return int(round(number))
+            return number_type(number)
+        except (TypeError, ValueError, OverflowError):
+            return None if invalid == 'null' else val
+    return transform
+
+
+# Transforms of the declarative form of cleanFields, given by name
+clean_transforms = {
+    'trim': trim,
+    'whitespace_to_null': whitespace_to_null,
+    'upper': change_case('upper'),
+    'lower': change_case('lower'),
+    'title': change_case('title'),
+    'to_number': to_number(),
+}
+# Transforms that take an argument, given as (name, argument)
+clean_transform_factories = {
+    'values_to_null': values_to_null,
+    'case': change_case,
+    'to_number': to_number,
+}
+
+
+def make_transform(spec):
+    """
+    :param spec: a function of one value, the name of a transform in
+    clean_transforms, or (name, argument) for clean_transform_factories,
+    e.g. ('values_to_null', [0, -9999]) or ('to_number', 'int')
+    :return: function of one value
+    """
+    if callable(spec):
+        return spec
+    if isinstance(spec, basestring):
+        if spec not in clean_transforms:
+            raise ValueError('Unknown transform %s, must be one of %s' % (spec, sorted(clean_transforms)))
+        return clean_transforms[spec]
+    (name, argument) = spec
+    if name not in clean_transform_factories:
+        raise ValueError('Unknown transform %s, must be one of %s' % (
+            name, sorted(clean_transform_factories)))
+    return clean_transform_factories[name](argument)
+
+
+class QuantileSketch(object):
+
+    """
+    Mergeable quantile sketch for non-negative values (negative values count
+    as zero). Values are counted in logarithmic buckets, so any quantile is
+    returned within relative_accuracy of the true value, and memory depends
+    on the range of the values, not their number: it is capped at
+    max_buckets by folding the lowest buckets together. Also keeps an exact
+    power-of-two histogram. Sketches built in different processes can be
+    combined with merge().
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zero_count += 1
+            return
+        i = int(math.ceil(math.log(value) / self.log_gamma))
+        self.buckets[i] = self.buckets.get(i, 0) + 1
+        # frexp gives the exact power of two, unlike log(value, 2)
+        b = math.frexp(value)[1] - 1
+        self.bins[b] = self.bins.get(b, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            self.collapse()
+
+    def collapse(self):
+        # Fold the lowest buckets together: only the low quantiles lose accuracy
+        keys = sorted(self.buckets)
+        while len(keys) > self.max_buckets:
+            self.buckets[keys[1]] += self.buckets.pop(keys[0])
+            keys.pop(0)
+
+    def merge(self, other):
+        """
+        Adds the counts of another sketch with the same relative accuracy
+        """
+        for (i, n) in other.buckets.items():
+            self.buckets[i] = self.buckets.get(i, 0) + n
+        for (b, n) in other.bins.items():
+            self.bins[b] = self.bins.get(b, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        if len(self.buckets) > self.max_buckets:
+            self.collapse()
+
+    def quantile(self, q):
+        """
+        :param q: quantile between 0 and 1, e.g. 0.99
+        :return: approximate value at quantile q, None if no values were added
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return max(self.min, 0)
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if seen > rank:
+                value = 2 * self.gamma ** i / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.sum / self.count
+
+    def histogram(self):
+        """
+        :return: list of (low, high, count) bins with power-of-two bounds,
+        starting with a (0, 0, count) bin for zero values
+        """
+        hist = []
+        if self.zero_count:
+            hist.append((0, 0, self.zero_count))
+        for b in sorted(self.bins):
+            hist.append((2.0 ** b, 2.0 ** (b + 1), self.bins[b]))
+        return hist
+
+
+class GeometryStats(object):
+
+    """
+    Streaming statistics of feature geometry: vertex, part, ring, area and
+    length distributions, and complexity (vertices less parts, the measure
+    of ArcTools.calcFeatureComplexity), each kept in a QuantileSketch, so memory stays
+    constant however many features are added. Feed it from any cursor that
+    reads SHAPE@ (and optionally SHAPE@WKB, to count rings without
+    converting each shape), and merge() the stats of parallel workers.
+    """
+
+    metrics = ['vertices', 'parts', 'rings', 'area', 'length', 'complexity']
+
+    def __init__(self, relative_accuracy=0.01):
+        self.sketches = dict((metric, QuantileSketch(relative_accuracy)) for metric in self.metrics)
+        self.count = 0
+        self.null_count = 0
+        self.multipart_count = 0
+        # Smallest complexity above 0 (empty shapes excluded)
+        self.min_complexity = None
+
+    def add(self, geom, wkb=None):
+        """
+        :param geom: arcpy geometry object, or None for a null shape
+        :param wkb: optional WKB of the same geometry, used to count rings
+        """
+        self.count += 1
+        if geom is None:
+            self.null_count += 1
+            return
+        sketches = self.sketches
+        parts = geom.partCount
+        points = geom.pointCount
+        sketches['vertices'].add(points)
+        sketches['parts'].add(parts)
+        complexity = points - parts
+        sketches['complexity'].add(complexity)
+        if complexity > 0 and (self.min_complexity is None or complexity < self.min_complexity):
+            self.min_complexity = complexity
+        if parts > 1:
+            self.multipart_count += 1
+        geom_type = geom.type
+        if geom_type == 'polygon':
+            sketches['area'].add(abs(geom.area))
+            sketches['length'].add(geom.length)
+            if wkb is None:
+                wkb = geom.WKB
+            sketches['rings'].add(self.ring_count(bytearray(wkb), 0)[0])
+        elif geom_type == 'polyline':
+            sketches['length'].add(geom.length)
+
+    def ring_count(self, buf, offset):
+        """
+        Counts polygon rings in a WKB buffer by reading headers only
+        :return: (number of rings, offset after the geometry)
+        """
+        order = '<' if buf[offset] == 1 else '>'
+        (geom_type,) = struct.unpack_from(order + 'I', buf, offset + 1)
+        offset += 5
+        dims = 2 + bool(geom_type & 0x80000000) + bool(geom_type & 0x40000000)
+        geom_type &= 0x0fffffff
+        dims += (geom_type // 1000 in (1, 3)) + (geom_type // 1000 in (2, 3))
+        geom_type %= 1000
+        if geom_type == 1:
+            return (0, offset + 8 * dims)
+        (count,) = struct.unpack_from(order + 'I', buf, offset)
+        offset += 4
+        if geom_type == 2:
+            return (0, offset + 8 * dims * count)
+        if geom_type == 3:
+            for i in range(count):
+                (n,) = struct.unpack_from(order + 'I', buf, offset)
+                offset += 4 + 8 * dims * n
+            return (count, offset)
+        rings = 0
+        for i in range(count):
+            (member_rings, offset) = self.ring_count(buf, offset)
+            rings += member_rings
+        return (rings, offset)
+
+    def merge(self, other):
+        for metric in self.metrics:
+            self.sketches[metric].merge(other.sketches[metric])
+        self.count += other.count
+        self.null_count += other.null_count
+        self.multipart_count += other.multipart_count
+        if other.min_complexity is not None and (
+                self.min_complexity is None or other.min_complexity < self.min_complexity):
+            self.min_complexity = other.min_complexity
+
+    def summary(self):
+        """
+        :return: dict of metric -> dict with count, min, max, mean, p50, p90,
+        p99 and histogram, for the metrics that received values
+        """
+        result = {}
+        for metric in self.metrics:
+            sketch = self.sketches[metric]
+            if not sketch.count:
+                continue
+            result[metric] = {
+                'count': sketch.count,
+                'min': sketch.min,
+                'max': sketch.max,
+                'mean': sketch.mean(),
+                'p50': sketch.quantile(0.5),
+                'p90': sketch.quantile(0.9),
+                'p99': sketch.quantile(0.99),
+                'histogram': sketch.histogram(),
+            }
+        return result
+
+    def log_summary(self):
+        logger.info('Geometry statistics for %s features (%s null, %s multipart):' % (
+            self.count, self.null_count, self.multipart_count))
+        for (metric, stats) in sorted(self.summary().items(), key=lambda x: self.metrics.index(x[0])):
+            logger.info('  %s: min %s, p50 %s, p90 %s, p99 %s, max %s, mean %s' % (
+                metric, self.fmt(stats['min']), self.fmt(stats['p50']), self.fmt(stats['p90']),
+                self.fmt(stats['p99']), self.fmt(stats['max']), self.fmt(stats['mean'])))
+            logger.p5('  %s histogram: %s' % (metric, ', '.join(
+                '[%s, %s): %s' % (self.fmt(low), self.fmt(high), n)
+                for (low, high, n) in stats['histogram'])))
+
+    def fmt(self, value):
+        if isinstance(value, float) and value != int(value):
+            return '%.4g' % value
+        return '%d' % value
+
+
+class QCCheck(object):
+    """
+    Base class for a check run by QualityControl.run_checks.
+    All checks passed to run_checks share a single cursor pass over the data
+    source: each check lists the fields it needs, receives every row in add()
+    and logs its findings in report() once the cursor is exhausted.
+    """
+
+    name = 'check'
+    # Set by a check once further rows cannot change its result
+    done = False
+    # Maximum number of offending OIDs kept in the result
+    oid_report_limit = 100
+
+    def __init__(self):
+        self.pos = {}
+
+    def fields(self, desc):
+        """
+        :param desc: arcpy Describe object of the data source
+        :return: list of field names or tokens (e.g. 'SHAPE@') this check reads
+        """
+        return []
+
+    def bind(self, positions):
+        """
+        :param positions: dict of field name / token -> index in the cursor row
+        """
+        self.pos = positions
+
+    def add(self, row):
+        pass
+
+    def report(self, fc, row_count):
+        pass
+
+    def result(self):
+        """
+        Findings of the check for the machine-readable QC report, available
+        after report() has run.
+        :return: dict with 'problems' (number of findings), 'oids' (sorted
+        offending OIDs, at most oid_report_limit) and 'details' (dict of
+        check specific counts)
+        """
+        return {'problems': 0, 'oids': [], 'details': {}}
+
+    def close(self):
+        """
+        Releases what the check holds outside memory (e.g. temporary files).
+        Called by run_checks when the checks are finished, also after an error.
+        """
+        pass
+
+
+def value_size(val):
+    """
+    :return: approximate size in bytes of a value read by a cursor, used to
+    estimate the data read by each QC check
+    """
+    if val is None:
+        return 0
+    if isinstance(val, (basestring, bytearray)):
+        return len(val)
+    if isinstance(val, (int, long, float, datetime.datetime)):
+        return 8
+    # Geometry objects: two doubles per vertex
+    return 16 * getattr(val, 'pointCount', 0)
+
+
+# Largest finite float32
+single_max = float(np.finfo(np.float32).max)
+
+
+class FieldTypeInference(object):
+
+    """
+    Streaming type inference for the values of one field. Works out the
+    narrowest type able to hold every value seen so far, keeping only a few
+    flags and the min / max, never the values themselves. The answer can only
+    widen as values come in, so once it reaches the declared field type
+    done is set and the caller can stop feeding values.
+    """
+
+    SMALLINT_RANGE = (-32768, 32767)
+    INT_RANGE = (-2147483648, 2147483647)
+    DATE_FORMATS = ['%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%d/%m/%Y', '%d-%b-%Y']
+
+    def __init__(self, name, field_type):
+        self.name = name
+        self.field_type = field_type
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.is_integer = True
+        self.is_single = True
+        # Non-numeric values, only possible in text fields
+        self.date_count = 0
+        self.text_count = 0
+        self.done = False
+
+    def add(self, val):
+        if val is None:
+            return
+        if self.field_type == 'String':
+            val = val.strip()
+            if not val:
+                # Blank strings would become nulls in any other type
+                return
+            try:
+                number = float(val)
+            except ValueError:
+                number = None
+            if number is None or math.isnan(number) or math.isinf(number):
+                # float() also accepts 'nan', 'inf' and the like, which are
+                # words here, not numbers
+                self.add_text(val)
+                return
+            val = number
+        self.count += 1
+        changed = False
+        if self.min is None or val < self.min:
+            self.min = val
+            changed = True
+        if self.max is None or val > self.max:
+            self.max = val
+            changed = True
+        if self.is_integer and val % 1 != 0:
+            self.is_integer = False
+            changed = True
+        # Tested for whole numbers too: if a fraction turns up later, the
+        # field needs Double for any whole number float32 cannot hold
+        if self.is_single and not self.fits_single(val):
+            self.is_single = False
+            changed = True
+        if changed:
+            self.done = self.narrowest_type() == self.field_type
+
+    @staticmethod
+    def fits_single(val):
+        """
+        True if a Single (float32) field can hold val: values read from a Single
+        field are exactly representable, values from text or Double fields need
+        no more than about 7 significant digits
+        """
+        if math.isnan(val) or math.isinf(val):
+            return True
+        if abs(val) > single_max:
+            return False
+        return float(np.float32(val)) == val or float('%.7g' % val) == val
+
+    def add_text(self, val):
+        if not self.text_count and self.is_date_text(val):
+            self.date_count += 1
+        else:
+            self.text_count += 1
+        self.done = self.narrowest_type() == self.field_type
+
+    def is_date_text(self, val):
+        day = val.split('T')[0].split(' ')[0]
+        for date_format in self.DATE_FORMATS:
+            try:
+                datetime.datetime.strptime(day, date_format)
+                return True
+            except ValueError:
+                continue
+        return False
+
+    def narrowest_type(self):
+        """
+        :return: the narrowest field type for the values seen, one of
+        'SmallInteger', 'Integer', 'Single', 'Double', 'Date' or 'String'.
+        None if the field held no values.
+        """
+        if self.text_count or (self.date_count and self.count):
+            return 'String'
+        if self.date_count:
+            return 'Date'
+        if not self.count:
+            return None
+        if self.is_integer:
+            if self.SMALLINT_RANGE[0] <= self.min and self.max <= self.SMALLINT_RANGE[1]:
+                return 'SmallInteger'
+            if self.INT_RANGE[0] <= self.min and self.max <= self.INT_RANGE[1]:
+                return 'Integer'
+            return 'Double'
+        if self.is_single:
+            return 'Single'
+        return 'Double'
+
+
+class FieldTypeCheck(QCCheck):
+
+    """
+    Compares each numeric and text field type with the narrowest type able to
+    hold its data, e.g. integers in a Double field or numbers or dates in a
+    text field. A field stops being read as soon as its answer is known, and
+    the check is done once every field has its answer.
+    """
+
+    name = 'field_type'
+    checked_types = ['SmallInteger', 'Integer', 'Single', 'Double', 'String']
+
+    def fields(self, desc):
+        self.inferences = [FieldTypeInference(f.name, f.type) for f in desc.fields
+                           if f.type in self.checked_types and f.type != 'SmallInteger']
+        return [inference.name for inference in self.inferences]
+
+    def bind(self, positions):
+        QCCheck.bind(self, positions)
+        self.active = [(positions[inference.name], inference) for inference in self.inferences]
+        self.done = not self.active
+
+    def add(self, row):
+        settled = False
+        for (i, inference) in self.active:
+            inference.add(row[i])
+            if inference.done:
+                settled = True
+        if settled:
+            # Stop reading fields we already have an answer for
+            self.active = [(i, inference) for (i, inference) in self.active if not inference.done]
+            self.done = not self.active
+
+    def report(self, fc, row_count):
+        logger.info('Checking field types in: %s' % fc)
+        for inference in self.inferences:
+            field_type = inference.field_type
+            narrowest = inference.narrowest_type()
+            if narrowest is None:
+                logger.info('Field %s (type %s) contains no values' % (inference.name, field_type))
+            elif narrowest == field_type:
+                continue
+            elif field_type == 'String' and narrowest == 'Date':
+                logger.warning('Field %s (type %s) contains all dates' % (inference.name, field_type))
+            elif field_type == 'String':
+                logger.warning('Field %s (type %s) contains all numbers (narrowest type: %s)' % (
+                    inference.name, field_type, narrowest))
+            elif inference.is_integer and field_type in ['Single', 'Double']:
+                logger.warning('Field %s (type %s) contains all integers (narrowest type: %s)' % (
+                    inference.name, field_type, narrowest))
+            else:
+                logger.warning('Field %s (type %s) could be stored as %s' % (
+                    inference.name, field_type, narrowest))
+        logger.info('Done checking field types.')
+
+    def result(self):
+        # Field name -> narrowest type, for fields that could be narrower
+        narrower = {}
+        empty = []
+        for inference in self.inferences:
+            narrowest = inference.narrowest_type()
+            if narrowest is None:
+                empty.append(inference.name)
+            elif narrowest != inference.field_type:
+                narrower[inference.name] = narrowest
+        return {'problems': len(narrower), 'oids': [],
+                'details': {'narrower_types': narrower, 'empty_fields': empty}}
+
+
+class TableCompletenessCheck(QCCheck):
+
+    """
+    Counts null or blank values in every field. If the rows fed to the check
+    are a random sample of a table of population rows, percentages are
+    reported with confidence intervals at the given confidence level.
+    """
+
+    name = 'table_completeness'
+
+    def __init__(self, population=None, confidence=0.95):
+        QCCheck.__init__(self)
+        self.population = population
+        self.confidence = confidence
+
+    def fields(self, desc):
+        self.field_names = [f.name for f in desc.fields]
+        return self.field_names
+
+    def bind(self, positions):
+        QCCheck.bind(self, positions)
+        self.indexes = [positions[name] for name in self.field_names]
+        self.null_counts = [0] * len(self.indexes)
+
+    def add(self, row):
+        null_counts = self.null_counts
+        j = 0
+        for i in self.indexes:
+            val = row[i]
+            # count nulls, empty or blank strings
+            if val is None or (isinstance(val, basestring) and not val.strip()):
+                null_counts[j] += 1
+            j += 1
+
+    def report(self, fc, row_count):
+        logger.info('Checking table completeness in: %s' % fc)
+        if self.population is not None and row_count:
+            self.report_sample(row_count)
+            return
+        if not any(self.null_counts):
+            logger.info('No null or blank records found.')
+            return
+        for (field, nulls) in zip(self.field_names, self.null_counts):
+            if not nulls:
+                continue
+            pct_null = (nulls / row_count) * 100.0
+            logger.warning('Field %s contains %.6f%% null or blank records.' % (
+                field, pct_null))
+        logger.info('Done checking table completeness.')
+
+    def report_sample(self, sample_size):
+        logger.info('Estimated from a random sample of %s of %s rows, %s%% confidence intervals:' % (
+            sample_size, self.population, round(self.confidence * 100, 2)))
+        for (field, nulls) in zip(self.field_names, self.null_counts):
+            (low, high) = proportion_interval(nulls, sample_size, self.population, self.confidence)
+            msg = 'Field %s contains %.2f%% null or blank records (%.2f%% - %.2f%%).' % (
+                field, nulls / sample_size * 100.0, low * 100.0, high * 100.0)
+            if nulls:
+                logger.warning(msg)
+            else:
+                logger.info(msg)
+        logger.info('Done checking table completeness.')
+
+    def result(self):
+        null_counts = dict((field, nulls) for (field, nulls)
+                           in zip(self.field_names, self.null_counts) if nulls)
+        return {'problems': len(null_counts), 'oids': [],
+                'details': {'null_counts': null_counts, 'population': self.population}}
+
+
+def z_score(confidence):
+    """
+    :param confidence: two-sided confidence level, e.g. 0.95
+    :return: standard normal quantile z such that P(-z < Z < z) = confidence
+    """
+    low = 0.0
+    high = 10.0
+    for i in range(60):
+        mid = (low + high) / 2
+        if math.erf(mid / math.sqrt(2)) < confidence:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+
+def proportion_interval(hits, sample_size, population, confidence=0.95):
+    """
+    Wilson score interval for a proportion estimated from a simple random
+    sample drawn without replacement, with the finite population correction.
+    :return: (low, high) bounds of the proportion, between 0 and 1
+    """
+    if not sample_size:
+        return (0.0, 1.0)
+    z = z_score(confidence)
+    if population > 1:
+        z *= math.sqrt(max(0.0, (population - sample_size) / (population - 1)))
+    p = hits / sample_size
+    n = sample_size
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return (max(0.0, center - half), min(1.0, center + half))
+
+
+def sample_size_for_error(error_bound, population, confidence=0.95):
+    """
+    Sample size giving a margin of error of at most error_bound (a
+    proportion, e.g. 0.01 for +/- 1%) at the given confidence level, for
+    any true proportion, in a population of the given size.
+    """
+    if not 0 < error_bound < 1:
+        raise ValueError('error_bound must be a proportion between 0 and 1 (e.g. 0.01 for +/- 1%%), '
+                         'not %s' % error_bound)
+    z = z_score(confidence)
+    n0 = z * z * 0.25 / (error_bound * error_bound)
+    return int(math.ceil(n0 / (1 + (n0 - 1) / max(1, population))))
+
+
+class DuplicateIndex(object):
+
+    """
+    Groups object ids by a fixed-size digest (e.g. the md5 of a row) to find
+    duplicates in tables of any size. Groups are kept in memory until
+    memory_limit is reached; after that every (digest, oid) pair goes to one of
+    a set of temporary files on local disk, partitioned by the first byte of
+    the digest. Each partition is then grouped on its own, and split again on
+    the next digest byte if it is still too big, so memory use stays flat
+    whatever the number of rows.
+    """
+
+    RECORD = struct.Struct('<16sq')
+    # Rough cost of one in-memory entry: digest string, oid and dict slot
+    ENTRY_BYTES = 160
+    PARTITIONS = 64
+
+    def __init__(self, memory_limit=256 * 1024 * 1024, temp_dir=None):
+        self.max_entries = max(1, memory_limit // self.ENTRY_BYTES)
+        self.temp_dir = temp_dir
+        self.groups = {}
+        self.entries = 0
+        self.spill_dir = None
+        self.partitions = None
+
+    def add(self, digest, oid):
+        if self.partitions is not None:
+            self.partitions[ord(digest[0]) % self.PARTITIONS].write(self.RECORD.pack(digest, oid))
+            return
+        group = self.groups.get(digest)
+        if group is None:
+            self.groups[digest] = oid
+        elif type(group) is list:
+            group.append(oid)
+        else:
+            self.groups[digest] = [group, oid]
+        self.entries += 1
+        if self.entries > self.max_entries:
+            self.spill()
+
+    def spill(self):
+        # Move everything gathered so far to partition files on disk
+        self.spill_dir = tempfile.mkdtemp(prefix='qc_dup_', dir=self.temp_dir)
+        logger.info('Over %s rows, spilling duplicate index to %s' % (self.entries, self.spill_dir))
+        self.partitions = self.open_partitions(self.spill_dir, 0)
+        pack = self.RECORD.pack
+        for (digest, group) in self.groups.items():
+            f = self.partitions[ord(digest[0]) % self.PARTITIONS]
+            if type(group) is list:
+                for oid in group:
+                    f.write(pack(digest, oid))
+            else:
+                f.write(pack(digest, group))
+        self.groups = {}
+
+    def open_partitions(self, folder, depth):
+        return [open(os.path.join(folder, 'p%s_%s.bin' % (depth, i)), 'wb', 1 << 16)
+                for i in range(self.PARTITIONS)]
+
+    def duplicate_groups(self):
+        """
+        Yields (digest, list of oids) for every digest seen more than once.
+        Temporary files are removed once all groups have been read.
+        """
+        if self.partitions is None:
+            for (digest, group) in self.groups.items():
+                if type(group) is list:
+                    yield (digest, group)
+            return
+        try:
+            for f in self.partitions:
+                f.close()
+            for f in self.partitions:
+                for item in self.partition_groups(f.name, 1):
+                    yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Removes the temporary files, if the index was spilled to disk.
+        Safe to call more than once.
+        """
+        if self.partitions is not None:
+            for f in self.partitions:
+                f.close()
+            self.partitions = None
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+
+    def partition_groups(self, path, depth):
+        size = self.RECORD.size
+        records = os.path.getsize(path) // size
+        if records > self.max_entries and depth < 16:
+            # Still too big for memory: split on the next byte of the digest
+            folder = tempfile.mkdtemp(dir=self.spill_dir)
+            parts = self.open_partitions(folder, depth)
+            with open(path, 'rb') as f:
+                chunk = f.read(size * 4096)
+                while chunk:
+                    for j in range(0, len(chunk), size):
+                        record = chunk[j:j + size]
+                        parts[ord(record[depth]) % self.PARTITIONS].write(record)
+                    chunk = f.read(size * 4096)
+            os.remove(path)
+            for part in parts:
+                part.close()
+            # If one digest fills the partition it cannot be split any further
+            largest = max(os.path.getsize(part.name) for part in parts) // size
+            next_depth = depth + 1 if largest < records else 16
+            for part in parts:
+                for item in self.partition_groups(part.name, next_depth):
+                    yield item
+            return
+        groups = defaultdict(list)
+        unpack = self.RECORD.unpack_from
+        with open(path, 'rb') as f:
+            chunk = f.read(size * 4096)
+            while chunk:
+                for j in range(0, len(chunk), size):
+                    (digest, oid) = unpack(chunk, j)
+                    groups[digest].append(oid)
+                chunk = f.read(size * 4096)
+        os.remove(path)
+        for (digest, oids) in groups.items():
+            if len(oids) > 1:
+                yield (digest, oids)
+
+
+class DuplicatesCheck(QCCheck):
+
+    """
+    Finds rows with identical attributes (all fields except OID and shape).
+    Rows are reduced to an md5 digest and grouped in a DuplicateIndex, so
+    duplicate groups are reported by OID and memory use is bounded by
+    memory_limit (bytes). temp_dir is where the index spills to disk.
+    """
+
+    name = 'duplicates'
+    # Maximum number of OIDs listed per duplicate group
+    oid_display_limit = 20
+
+    def __init__(self, memory_limit=256 * 1024 * 1024, temp_dir=None):
+        QCCheck.__init__(self)
+        self.memory_limit = memory_limit
+        self.temp_dir = temp_dir
+
+    def fields(self, desc):
+        exclude = [getattr(desc, 'OIDFieldName', None),
+                   getattr(desc, 'shapeFieldName', None)]
+        self.field_names = [f.name for f in desc.fields if f.name not in exclude]
+        return ['OID@'] + self.field_names
+
+    def bind(self, positions):
+        QCCheck.bind(self, positions)
+        self.oid_index = positions['OID@']
+        self.indexes = [positions[name] for name in self.field_names]
+        self.index = DuplicateIndex(self.memory_limit, self.temp_dir)
+
+    def add(self, row):
+        digest = hashlib.md5(repr([row[i] for i in self.indexes])).digest()
+        self.index.add(digest, row[self.oid_index])
+
+    def report(self, fc, row_count):
+        logger.info('Checking for duplicate attributes in %s' % fc)
+        groups = 0
+        rows = 0
+        self.oids = []
+        for (digest, oids) in self.index.duplicate_groups():
+            groups += 1
+            rows += len(oids)
+            oids.sort()
+            self.oids.extend(oids[:self.oid_report_limit - len(self.oids)])
+            more = ''
+            if len(oids) > self.oid_display_limit:
+                more = ' and %s more' % (len(oids) - self.oid_display_limit)
+            logger.warning('%s rows with duplicate attributes, OIDs: %s%s' % (
+                len(oids), oids[:self.oid_display_limit], more))
+        if groups:
+            logger.warning('%s duplicate rows in %s groups.' % (rows, groups))
+        else:
+            logger.info('No duplicate attributes found.')
+        self.groups = groups
+        self.duplicate_rows = rows
+
+    def result(self):
+        return {'problems': self.duplicate_rows, 'oids': sorted(self.oids),
+                'details': {'groups': self.groups}}
+
+    def close(self):
+        index = getattr(self, 'index', None)
+        if index is not None:
+            index.close()
+
+
+def read_wkb(buf, offset=0):
+    """
+    Reads one geometry from a WKB buffer.
+    :param buf: bytearray holding OGC / ISO / extended well-known binary
+    :param offset: position of the geometry in buf
+    :return: (geometry type, parts, offset after the geometry). Type is
+    1-6 (Point ... MultiPolygon); parts is a list of coordinate arrays for
+    points and paths, or a list of lists of rings for polygons.
+    Multi-geometries are flattened into the parts of a single type.
+    """
+    order = '<' if buf[offset] == 1 else '>'
+    (geom_type,) = struct.unpack_from(order + 'I', buf, offset + 1)
+    offset += 5
+    # Z / M flags: EWKB high bits or ISO 1000 / 2000 / 3000 offsets
+    dims = 2 + bool(geom_type & 0x80000000) + bool(geom_type & 0x40000000)
+    geom_type &= 0x0fffffff
+    dims += (geom_type // 1000 in (1, 3)) + (geom_type // 1000 in (2, 3))
+    geom_type %= 1000
+    dtype = np.dtype(order + 'f8')
+    if geom_type == 1:
+        coords = np.frombuffer(buf, dtype, dims, offset).reshape(1, dims)[:, :2]
+        offset += 8 * dims
+        if np.isnan(coords).any():
+            # Empty point
+            return (1, [], offset)
+        return (1, [coords], offset)
+    (count,) = struct.unpack_from(order + 'I', buf, offset)
+    offset += 4
+    if geom_type in (2, 3):
+        rings = []
+        for i in range(1 if geom_type == 2 else count):
+            if geom_type == 3:
+                (n,) = struct.unpack_from(order + 'I', buf, offset)
+                offset += 4
+            else:
+                n = count
+            rings.append(np.frombuffer(buf, dtype, n * dims, offset).reshape(n, dims)[:, :2])
+            offset += 8 * dims * n
+        if geom_type == 2:
+            return (2, rings, offset)
+        return (3, [rings] if rings else [], offset)
+    # Multipoint, multilinestring, multipolygon
+    parts = []
+    for i in range(count):
+        (member_type, member_parts, offset) = read_wkb(buf, offset)
+        parts.extend(member_parts)
+    return (geom_type, parts, offset)
+
+
+class DuplicateGeomsCheck(QCCheck):
+
+    """
+    Finds features with identical geometry. Each shape is read as WKB and
+    reduced to a canonical fingerprint: coordinates are snapped to the XY
+    resolution of the dataset, repeated vertices are dropped, rings are
+    rotated to start at their lowest vertex and traversed in a fixed
+    direction, and parts and holes are sorted. Two shapes covering the same
+    rings therefore match even if their rings start at a different vertex or
+    run the other way. Fingerprints are grouped in a DuplicateIndex.
+    """
+
+    name = 'duplicate_geoms'
+    oid_display_limit = 20
+
+    def __init__(self, memory_limit=256 * 1024 * 1024, temp_dir=None):
+        QCCheck.__init__(self)
+        self.memory_limit = memory_limit
+        self.temp_dir = temp_dir
+
+    def fields(self, desc):
+        self.resolution = 0.0
+        try:
+            self.resolution = desc.spatialReference.XYResolution
+        except AttributeError:
+            pass
+        if not self.resolution or self.resolution <= 0:
+            self.resolution = 1e-9
+        return ['OID@', 'SHAPE@WKB']
+
+    def bind(self, positions):
+        QCCheck.bind(self, positions)
+        self.oid_index = positions['OID@']
+        self.shape_index = positions['SHAPE@WKB']
+        self.index = DuplicateIndex(self.memory_limit, self.temp_dir)
+
+    def add(self, row):
+        wkb = row[self.shape_index]
+        if not wkb:
+            # Null geometry
+            return
+        digest = self.fingerprint(wkb)
+        if digest is not None:
+            self.index.add(digest, row[self.oid_index])
+
+    def fingerprint(self, wkb):
+        """
+        :param wkb: geometry as OGC / ISO well-known binary
+        :return: 16 byte md5 digest of the canonical form of the geometry
+        """
+        (geom_type, parts) = read_wkb(bytearray(wkb))[:2]
+        if not parts:
+            # Empty geometry
+            return None
+        chunks = [struct.pack('<I', geom_type)]
+        if geom_type in (1, 4):
+            # Point or multipoint: the sorted set of vertices
+            points = self.snap(np.vstack(parts))
+            points = points[np.lexsort((points[:, 1], points[:, 0]))]
+            chunks.append(points.tostring())
+        elif geom_type in (2, 5):
+            # Paths keep their direction, only their order is ignored
+            paths = sorted(self.drop_repeats(self.snap(path)).tostring() for path in parts)
+            for path in paths:
+                chunks.append(struct.pack('<I', len(path)) + path)
+        else:
+            # Polygons: outer ring first, then sorted holes. Polygons sorted.
+            polygons = []
+            for rings in parts:
+                canonical = [self.canonical_ring(self.snap(ring)) for ring in rings]
+                polygon = canonical[:1] + sorted(canonical[1:])
+                polygons.append(''.join(struct.pack('<I', len(ring)) + ring for ring in polygon))
+            for polygon in sorted(polygons):
+                chunks.append(struct.pack('<I', len(polygon)) + polygon)
+        return hashlib.md5(''.join(chunks)).digest()
+
+    def snap(self, coords):
+        # Integer coordinates on the XY resolution grid, little-endian
+        return np.floor(coords / self.resolution + 0.5).astype('<i8')
+
+    def drop_repeats(self, coords):
+        if len(coords) < 2:
+            return coords
+        keep = np.ones(len(coords), dtype=bool)
+        keep[1:] = (coords[1:] != coords[:-1]).any(axis=1)
+        return coords[keep]
+
+    def canonical_ring(self, ring):
+        """
+        :param ring: snapped (n, 2) vertex array, closed or not
+        :return: bytes of the ring without its closing vertex, starting at the
+        lowest vertex, in whichever direction gives the lower byte string
+        """
+        ring = self.drop_repeats(ring)
+        while len(ring) > 1 and (ring[0] == ring[-1]).all():
+            ring = ring[:-1]
+        n = len(ring)
+        if n < 2:
+            return ring.tostring()
+        lowest = ring[np.lexsort((ring[:, 1], ring[:, 0]))[0]]
+        reverse = ring[::-1]
+        best = None
+        # A self-touching ring may visit its lowest vertex more than once
+        for start in np.flatnonzero((ring == lowest).all(axis=1)):
+            for candidate in (np.roll(ring, -start, axis=0).tostring(),
+                              np.roll(reverse, start + 1 - n, axis=0).tostring()):
+                if best is None or candidate < best:
+                    best = candidate
+        return best
+
+    def report(self, fc, row_count):
+        logger.info('Checking for duplicate geometry in %s' % fc)
+        groups = 0
+        rows = 0
+        self.oids = []
+        for (digest, oids) in self.index.duplicate_groups():
+            groups += 1
+            rows += len(oids)
+            oids.sort()
+            self.oids.extend(oids[:self.oid_report_limit - len(self.oids)])
+            more = ''
+            if len(oids) > self.oid_display_limit:
+                more = ' and %s more' % (len(oids) - self.oid_display_limit)
+            logger.warning('%s duplicate geometries in OIDs: %s%s' % (
+                len(oids), oids[:self.oid_display_limit], more))
+        if not groups:
+            logger.info('No duplicate geometries found.')
+        self.groups = groups
+        self.duplicate_rows = rows
+
+    def result(self):
+        return {'problems': self.duplicate_rows, 'oids': sorted(self.oids),
+                'details': {'groups': self.groups}}
+
+
+def orientation(a, b, c):
+    """
+    Exact orientation test for integer points.
+    :param a, b, c: (n, 2) int64 arrays of snapped coordinates
+    :return: int array, 1 where c lies left of the line a->b, -1 where it
+    lies right of it and 0 where the three points are collinear
+    """
+    abx = (b[:, 0] - a[:, 0]).astype('f8')
+    aby = (b[:, 1] - a[:, 1]).astype('f8')
+    acx = (c[:, 0] - a[:, 0]).astype('f8')
+    acy = (c[:, 1] - a[:, 1]).astype('f8')
+    left = abx * acy
+    right = aby * acx
+    det = left - right
+    sign = np.sign(det).astype(int)
+    # Floating point is exact enough unless det is tiny compared to its terms;
+    # recompute those cases with Python integers
+    unsure = np.flatnonzero(np.abs(det) <= 1e-14 * (np.abs(left) + np.abs(right)))
+    for i in unsure:
+        det = ((int(b[i, 0]) - int(a[i, 0])) * (int(c[i, 1]) - int(a[i, 1])) -
+               (int(b[i, 1]) - int(a[i, 1])) * (int(c[i, 0]) - int(a[i, 0])))
+        sign[i] = (det > 0) - (det < 0)
+    return sign
+
+
+class GeometryValidityCheck(QCCheck):
+
+    """
+    Read-only geometry validation. Shapes are read as WKB, snapped to the XY
+    resolution of the dataset and checked for null geometry, empty shapes,
+    degenerate parts (paths with less than two distinct vertices, rings with
+    less than three or with zero area), unclosed rings, duplicate consecutive
+    vertices, rings with the wrong orientation and self-intersecting
+    polygons. Nothing is written, so the check can run on locked or
+    read-only data; use QualityControl.repair_geom_zm to fix problems.
+
+    Esri shapes store exterior rings clockwise and holes counter-clockwise;
+    pass exterior_clockwise=False for data following the OGC convention.
+    Self-intersections are segments of a polygon (any of its rings) that
+    cross each other or overlap along a line. Rings touching at a vertex are
+    allowed.
+    """
+
+    name = 'geometry_validity'
+    oid_display_limit = 20
+    problems = [
+        ('null', 'null geometry'),
+        ('empty', 'empty geometry'),
+        ('degenerate', 'degenerate (empty or zero-area) parts'),
+        ('unclosed', 'unclosed rings'),
+        ('duplicate_vertices', 'duplicate consecutive vertices'),
+        ('orientation', 'rings with the wrong orientation'),
+        ('self_intersection', 'self-intersections'),
+    ]
+
+    def __init__(self, exterior_clockwise=True):
+        QCCheck.__init__(self)
+        self.exterior_clockwise = exterior_clockwise
+
+    def fields(self, desc):
+        self.resolution = 0.0
+        try:
+            self.resolution = desc.spatialReference.XYResolution
+        except AttributeError:
+            pass
+        if not self.resolution or self.resolution <= 0:
+            self.resolution = 1e-9
+        return ['OID@', 'SHAPE@WKB']
+
+    def bind(self, positions):
+        QCCheck.bind(self, positions)
+        self.oid_index = positions['OID@']
+        self.shape_index = positions['SHAPE@WKB']
+        # problem -> OIDs of the features that have it
+        self.found = dict((problem, []) for (problem, label) in self.problems)
+
+    def add(self, row):
+        wkb = row[self.shape_index]
+        if not wkb:
+            self.found['null'].append(row[self.oid_index])
+            return
+        for problem in self.validate(wkb):
+            self.found[problem].append(row[self.oid_index])
+
+    def validate(self, wkb):
+        """
+        :param wkb: geometry as OGC / ISO well-known binary
+        :return: set of problem names (see problems) found in the geometry
+        """
+        (geom_type, parts) = read_wkb(bytearray(wkb))[:2]
+        if not parts:
+            return set(['empty'])
+        found = set()
+        if geom_type in (1, 4):
+            return found
+        if geom_type in (2, 5):
+            for path in parts:
+                path = self.snap(path)
+                if self.has_repeats(path):
+                    found.add('duplicate_vertices')
+                if len(self.drop_repeats(path)) < 2:
+                    found.add('degenerate')
+            return found
+        for rings in parts:
+            closed = []
+            for (i, ring) in enumerate(rings):
+                ring = self.snap(ring)
+                if len(ring) and (ring[0] != ring[-1]).any():
+                    found.add('unclosed')
+                    ring = np.vstack((ring, ring[:1]))
+                if self.has_repeats(ring):
+                    found.add('duplicate_vertices')
+                ring = self.drop_repeats(ring)
+                if len(ring) < 4:
+                    found.add('degenerate')
+                    continue
+                area = self.signed_area(ring)
+                if not area:
+                    # Collapsed ring, or a figure eight whose loops cancel out
+                    found.add('degenerate')
+                elif ((area < 0) == self.exterior_clockwise) != (i == 0):
+                    # Holes wind the opposite way to exterior rings
+                    found.add('orientation')
+                closed.append(ring)
+            if closed and self.crossing_segments(closed):
+                found.add('self_intersection')
+        return found
+
+    def snap(self, coords):
+        # Integer coordinates on the XY resolution grid
+        return np.floor(coords / self.resolution + 0.5).astype('i8')
+
+    def has_repeats(self, coords):
+        return len(coords) > 1 and bool((coords[1:] == coords[:-1]).all(axis=1).any())
+
+    def drop_repeats(self, coords):
+        if len(coords) < 2:
+            return coords
+        keep = np.ones(len(coords), dtype=bool)
+        keep[1:] = (coords[1:] != coords[:-1]).any(axis=1)
+        return coords[keep]
+
+    def signed_area(self, ring):
+        """
+        :param ring: closed (n, 2) integer vertex array
+        :return: twice the signed area in grid units; negative if clockwise
+        """
+        x = ring[:, 0] - ring[0, 0]
+        y = ring[:, 1] - ring[0, 1]
+        return float(np.dot(x[:-1].astype('f8'), y[1:]) - np.dot(x[1:].astype('f8'), y[:-1]))
+
+    def crossing_segments(self, rings, chunk_size=1000000):
+        """
+        Looks for crossing or overlapping segments in a set of closed rings.
+        Segments are sorted by their lowest x, and each one is only tested
+        against the segments that start before it ends (a sweep along x);
+        pairs are then filtered on y before the exact orientation tests.
+        :param rings: list of closed, snapped (n, 2) vertex arrays
+        :param chunk_size: maximum number of candidate pairs tested at once
+        :return: True if any two non-adjacent segments cross or overlap
+        """
+        starts = np.vstack([ring[:-1] for ring in rings])
+        ends = np.vstack([ring[1:] for ring in rings])
+        ring_ids = np.concatenate([np.repeat(i, len(ring) - 1) for (i, ring) in enumerate(rings)])
+        seq = np.concatenate([np.arange(len(ring) - 1) for ring in rings])
+        sizes = np.array([len(ring) - 1 for ring in rings])[ring_ids]
+        xmin = np.minimum(starts[:, 0], ends[:, 0])
+        xmax = np.maximum(starts[:, 0], ends[:, 0])
+        ymin = np.minimum(starts[:, 1], ends[:, 1])
+        ymax = np.maximum(starts[:, 1], ends[:, 1])
+        order = np.argsort(xmin, kind='mergesort')
+        # Segments order[i + 1:last[i]] start before segment order[i] ends
+        last = np.searchsorted(xmin[order], xmax[order], side='right')
+        counts = last - np.arange(1, len(order) + 1)
+        first = 0
+        while first < len(order):
+            # Take as many sweep positions as fit in one chunk of pairs
+            stop = first + max(1, np.searchsorted(np.cumsum(counts[first:]), chunk_size))
+            n = counts[first:stop]
+            i = np.repeat(np.arange(first, stop), n)
+            j = i + 1 + np.arange(len(i)) - np.repeat(np.cumsum(n) - n, n)
+            first = stop
+            if not len(i):
+                continue
+            (i, j) = (order[i], order[j])
+            keep = (ymin[i] <= ymax[j]) & (ymin[j] <= ymax[i])
+            # Neighbouring segments of a ring share a vertex by construction
+            gap = np.abs(seq[i] - seq[j])
+            keep &= ~((ring_ids[i] == ring_ids[j]) & ((gap == 1) | (gap == sizes[i] - 1)))
+            (i, j) = (i[keep], j[keep])
+            if not len(i):
+                continue
+            (p1, p2, q1, q2) = (starts[i], ends[i], starts[j], ends[j])
+            o1 = orientation(p1, p2, q1)
+            o2 = orientation(p1, p2, q2)
+            o3 = orientation(q1, q2, p1)
+            o4 = orientation(q1, q2, p2)
+            if ((o1 * o2 < 0) & (o3 * o4 < 0)).any():
+                return True
+            # Collinear segments overlapping along a line, not just at a vertex
+            collinear = (o1 == 0) & (o2 == 0)
+            if collinear.any():
+                axis = (xmax[i] == xmin[i]).astype(int)
+                rows = np.arange(len(i))
+                lo = np.maximum(np.minimum(p1[rows, axis], p2[rows, axis]),
+                                np.minimum(q1[rows, axis], q2[rows, axis]))
+                hi = np.minimum(np.maximum(p1[rows, axis], p2[rows, axis]),
+                                np.maximum(q1[rows, axis], q2[rows, axis]))
+                if (collinear & (lo < hi)).any():
+                    return True
+        return False
+
+    def report(self, fc, row_count):
+        logger.info('Checking geometry of %s features in %s' % (row_count, fc))
+        problems = 0
+        for (problem, label) in self.problems:
+            oids = self.found[problem]
+            if not oids:
+                continue
+            problems += len(oids)
+            more = ''
+            if len(oids) > self.oid_display_limit:
+                more = ' and %s more' % (len(oids) - self.oid_display_limit)
+            logger.warning('%s features with %s, OIDs: %s%s' % (
+                len(oids), label, oids[:self.oid_display_limit], more))
+        if problems:
+            logger.info('Geometry was not modified. Run repair_geom_zm to repair it in place.')
+        else:
+            logger.info('No geometry problems found.')
+
+    def result(self):
+        oids = set()
+        for found in self.found.values():
+            oids.update(found)
+        counts = dict((problem, len(found)) for (problem, found) in self.found.items() if found)
+        return {'problems': len(oids), 'oids': sorted(oids)[:self.oid_report_limit],
+                'details': counts}
+
+
+class FeatureComplexityCheck(QCCheck):
+
+    """
+    Counts features with more vertices or parts than the given limits, and
+    reports vertex, part, ring, area and length distributions collected
+    with a GeometryStats object.
+    """
+
+    name = 'feature_complexity'
+
+    def __init__(self, vertex_limit=30000, part_limit=1000):
+        QCCheck.__init__(self)
+        self.vertex_limit = vertex_limit
+        self.part_limit = part_limit
+
+    def fields(self, desc):
+        return ['OID@', 'SHAPE@', 'SHAPE@WKB']
+
+    def bind(self, positions):
+        QCCheck.bind(self, positions)
+        self.oid_index = positions['OID@']
+        self.shape_index = positions['SHAPE@']
+        self.wkb_index = positions['SHAPE@WKB']
+        self.stats = GeometryStats()
+        self.vertex_overlimit = 0
+        self.part_overlimit = 0
+        self.complex_count = 0
+        self.oids = []
+
+    def add(self, row):
+        geom = row[self.shape_index]
+        self.stats.add(geom, row[self.wkb_index])
+        if geom is None:
+            return
+        complex_feature = False
+        if geom.partCount > self.part_limit:
+            self.part_overlimit += 1
+            complex_feature = True
+        if geom.pointCount > self.vertex_limit:
+            self.vertex_overlimit += 1
+            complex_feature = True
+        if complex_feature:
+            self.complex_count += 1
+            if len(self.oids) < self.oid_report_limit:
+                self.oids.append(row[self.oid_index])
+
+    def report(self, fc, row_count):
+        logger.info('Checking complexity of %s features in %s' % (row_count, fc))
+        if self.vertex_overlimit:
+            logger.warning('%s complex features with more than %s vertices.' % (
+                self.vertex_overlimit, self.vertex_limit))
+        if self.part_overlimit:
+            logger.warning('%s features with more than %s parts.' % (
+                self.part_overlimit, self.part_limit))
+        if self.vertex_overlimit or self.part_overlimit:
+            logger.info('Tips to reduce complex features: http://arcg.is/2pRuAk9')
+        else:
+            logger.info('No excessively complex features.')
+        logger.info('Maximum vertex count: %s, part count %s' % (
+            self.stats.sketches['vertices'].max or 0, self.stats.sketches['parts'].max or 0))
+        self.stats.log_summary()
+
+    def result(self):
+        # Distribution summaries without the histograms
+        statistics = {}
+        for (metric, stats) in self.stats.summary().items():
+            statistics[metric] = dict((k, v) for (k, v) in stats.items() if k != 'histogram')
+        return {'problems': self.complex_count, 'oids': sorted(self.oids),
+                'details': {'vertex_overlimit': self.vertex_overlimit,
+                            'part_overlimit': self.part_overlimit,
+                            'statistics': statistics}}
+
+
+class QCCache(object):
+
+    """
+    Persistent store of quality report output, one entry per dataset, kept in
+    a JSON file. Each entry is tied to a fingerprint of the dataset: schema,
+    row count, extent, spatial reference and the modification times of the
+    files holding the data. A dataset whose fingerprint has not changed can
+    be served from the cache instead of being checked again.
+    """
+
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    data = json.load(f)
+                if data.get('version') == self.version:
+                    self.entries = data.get('datasets', {})
+            except (IOError, ValueError):
+                logger.warning('Cannot read QC cache %s, starting a new one.' % path)
+
+    def fingerprint(self, fc, options=None):
+        """
+        :param fc: feature class or table
+        :param options: dict of the report options; results obtained with
+        other options do not match
+        :return: hex digest identifying the current version of the dataset
+        """
+        desc = arcpy.Describe(fc)
+        parts = [desc.dataType, int(arcpy.GetCount_management(fc).getOutput(0))]
+        for f in desc.fields:
+            parts.append((f.name, f.type, f.length, f.isNullable, f.required))
+        sr = getattr(desc, 'spatialReference', None)
+        if sr is not None:
+            parts.append((sr.name, sr.factoryCode, sr.XYResolution))
+        extent = getattr(desc, 'extent', None)
+        if extent is not None:
+            parts.append((extent.XMin, extent.YMin, extent.XMax, extent.YMax))
+        parts.append(self.file_times(desc.catalogPath))
+        if options:
+            parts.append(sorted(options.items()))
+        return hashlib.md5(repr(parts)).hexdigest()
+
+    def file_times(self, path):
+        # See data_file_time
+        return data_file_time(path)
+
+    def get(self, fc, fingerprint):
+        """
+        :return: cached entry (dict with 'log', 'result' and 'checked') if fc has not
+        changed since it was cached, otherwise None
+        """
+        entry = self.entries.get(fc)
+        if entry and entry.get('fingerprint') == fingerprint:
+            return entry
+        return None
+
+    def put(self, fc, fingerprint, records, result=None):
+        self.entries[fc] = {
+            'fingerprint': fingerprint,
+            'checked': datetime.datetime.now().strftime('%Y-%m-%d %H:%M'),
+            'log': records,
+            'result': result,
+        }
+
+    def save(self):
+        # Write to a temporary file first so an interrupted run cannot corrupt the cache
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            json.dump({'version': self.version, 'datasets': self.entries}, f)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmp_path, self.path)
+
+
+class QualityControl(object):
+
+    """
+    Performs quality control to flag potential data quality issues.
+    """
+
+    # Columns of the machine-readable report, see write_report
+    report_columns = ['run', 'dataset', 'type', 'cached', 'check', 'rows', 'seconds',
+                      'bytes', 'problems', 'oids', 'details']
+
+    def __init__(self, silent=False):
+        self.arctools = ArcTools(silent=True)
+        self.TS = logger.getTS()
+        """A test string to make sure that the latest version of arcsupport is loaded
+        into memory. Reload in the interactive python console (in command line
+        or ArcMap), to be sure that the latest version is re-loaded. """
+        if not silent:
+            logger.info("QualityControl class (updated %s). " % self.TS)
+
+    def qc_report(self, fc, workers=1, cache_path=None, refresh=False, skip_unchanged=False,
+                  repair=False, report_path=None):
+        """
+        Quality control report
+        :param fc: may be a workspace or an individual feature class
+        :param workers: number of worker processes used to check the items
+        of a workspace in parallel. 1 checks them one at a time in this process,
+        0 uses one worker per CPU core.
+        :param cache_path: optional cache file (JSON). Datasets that have not
+        changed since they were last checked are served from the cache.
+        :param refresh: check every dataset again, ignoring the cache
+        :param skip_unchanged: do not repeat cached results, just list the
+        datasets that were skipped
+        :param repair: repair feature geometry in place (RepairGeometry) before
+        checking it. By default geometry is only checked, nothing is written.
+        :param report_path: optional machine-readable report of the run, see
+        write_report. CSV if the name ends with .csv, otherwise JSON lines.
+        :return: list of dataset results (see qc_dataset)
+        import imp;imp.reload(arcsupport);qctool = arcsupport.QualityControl()
+        """
+        cache = None
+        if cache_path:
+            cache = QCCache(cache_path)
+        data_type = arcpy.Describe(fc).dataType
+        options = {'repair': repair}
+        if data_type not in ['Workspace']:
+            results = [self.qc_cached(fc, cache, refresh, skip_unchanged, options)]
+        else:
+            logger.info('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~`')
+            logger.info('Processing %s (%s)' % (fc, data_type))
+            items = [os.path.join(fc, item) for item in self.arctools.getAllItems(fc)]
+            if workers != 1 and len(items) > 1:
+                results = self.qc_items_parallel(items, workers, cache, refresh, skip_unchanged,
+                                                 options=options)
+            else:
+                # Process each element
+                results = []
+                for item in items:
+                    results.append(self.qc_cached(item, cache, refresh, skip_unchanged, options))
+        if cache:
+            cache.save()
+        results = [result for result in results if result]
+        if report_path:
+            self.write_report(results, report_path)
+        return results
+
+    def write_report(self, results, report_path):
+        """
+        Writes dataset results (see qc_dataset) to a file, one record per
+        check of each dataset, with the columns in report_columns. Lists
+        of OIDs are space separated and details are JSON encoded in CSV.
+        :param results: list of dataset results
+        :param report_path: .csv file for CSV, any other file name for JSON
+        lines. If report_path is a folder, a new qc_report_<timestamp>.jsonl
+        file is created in it.
+        :return: path of the report
+        """
+        if os.path.isdir(report_path):
+            report_path = os.path.join(report_path, 'qc_report_%s.jsonl' % logger.getTS())
+        run = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        records = []
+        for result in results:
+            for check in result['checks']:
+                record = {'run': run, 'dataset': result['dataset'], 'type': result['type'],
+                          'cached': result.get('cached', False)}
+                record.update(check)
+                records.append(record)
+        with open(report_path, 'wb') as f:
+            if report_path.lower().endswith('.csv'):
+                writer = csv.writer(f)
+                writer.writerow(self.report_columns)
+                for record in records:
+                    record['oids'] = ' '.join(str(oid) for oid in record['oids'])
+                    record['details'] = json.dumps(record['details'], sort_keys=True)
+                    writer.writerow([unicode(record.get(column, '')).encode('utf-8')
+                                     for column in self.report_columns])
+            else:
+                for record in records:
+                    f.write(json.dumps(record, sort_keys=True) + '\n')
+        logger.info('Wrote %s check results for %s datasets to %s' % (
+            len(records), len(results), report_path))
+        return report_path
+
+    def qc_dataset(self, fc, repair=False):
+        """
+        Runs all quality checks on a single feature class or table
+        :param fc: feature class or table
+        :param repair: repair feature geometry in place before checking it
+        :return: dataset result: dict with 'dataset', 'type', 'rows' (rows
+        scanned), 'seconds' and 'checks' (list of check results, see
+        run_checks), or None if the data type is not supported
+        """
+        start = timer()
+        data_type = arcpy.Describe(fc).dataType
+        features = ['FeatureClass', 'ShapeFile']
+        table_type = ['Table']
+        supported_types = features + table_type
+
+        logger.info('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~`')
+        logger.info('Processing %s (%s)' % (fc, data_type))
+
+        if data_type not in supported_types:
+            logger.warning('Skipping layer with unsupported type: %s' % data_type)
+            return None
+        # Type is table or feature class. Do the table processing first.
+        invalid = self.field_name_check(fc)
+        results = [{'check': 'field_names', 'rows': 0, 'seconds': round(timer() - start, 6),
+                    'bytes': 0, 'problems': len(invalid), 'oids': [],
+                    'details': {'invalid': invalid}}]
+        checks = [FieldTypeCheck(), TableCompletenessCheck(), DuplicatesCheck()]
+        if data_type in features:
+            # Spatial layer, additional checks. Repair (if requested) runs
+            # before the scan so that the geometry checks see the repaired shapes.
+            if repair:
+                repair_start = timer()
+                self.repair_geom_zm(fc)
+                results.append({'check': 'repair_geometry', 'rows': 0,
+                                'seconds': round(timer() - repair_start, 6), 'bytes': 0,
+                                'problems': 0, 'oids': [], 'details': {}})
+            checks += [GeometryValidityCheck(), DuplicateGeomsCheck(), FeatureComplexityCheck()]
+        # All remaining checks share one cursor pass over the data
+        results += self.run_checks(fc, checks)
+        return {'dataset': fc, 'type': data_type,
+                'rows': max(result['rows'] for result in results),
+                'seconds': round(timer() - start, 6), 'checks': results}
+
+    def qc_cached(self, fc, cache=None, refresh=False, skip_unchanged=False, options=None):
+        """
+        Runs qc_dataset on fc, unless the cache holds results for the same
+        version of the dataset, in which case those are logged instead.
+        :param cache: QCCache object, or None to always run the checks
+        :param options: dict of keyword arguments for qc_dataset
+        :return: dataset result (see qc_dataset)
+        """
+        options = options or {}
+        if cache is None:
+            return self.qc_dataset(fc, **options)
+        fingerprint = cache.fingerprint(fc, options)
+        entry = None
+        if not refresh:
+            entry = cache.get(fc, fingerprint)
+        if entry is not None:
+            return self.replay_cached(fc, entry, skip_unchanged)
+        buf = logger.startCapture()
+        result = None
+        try:
+            result = self.qc_dataset(fc, **options)
+        finally:
+            records = logger.stopCapture(buf)
+        if options.get('repair'):
+            # Repairs rewrite the data, so the version checked is the one after them
+            fingerprint = cache.fingerprint(fc, options)
+        cache.put(fc, fingerprint, records, result)
+        return result
+
+    def replay_cached(self, fc, entry, skip_unchanged=False):
+        """
+        Logs the cached messages of fc
+        :return: the cached dataset result, marked as cached
+        """
+        if skip_unchanged:
+            logger.info('Skipping %s: unchanged since %s' % (fc, entry['checked']))
+        else:
+            logger.replay(entry['log'])
+            logger.info('(Cached results from %s: %s is unchanged.)' % (entry['checked'], fc))
+        result = entry.get('result')
+        if result:
+            result = dict(result, cached=True)
+        return result
+
+    def qc_items_parallel(self, items, workers=0, cache=None, refresh=False, skip_unchanged=False,
+                          task='qc_dataset', options=None):
+        """
+        Runs qc_dataset (or another task) on a list of feature classes and tables using a pool
+        of worker processes. The largest datasets are handed out first so
+        that a big layer does not start last and hold up the whole run. Worker
+        messages are captured and written to this log in the order of items,
+        so the report reads the same as a serial run.
+        :param items: list of feature class / table paths
+        :param workers: number of processes, 0 for one per CPU core
+        :param cache: QCCache object; unchanged datasets are not sent to workers
+        :param task: name of the QualityControl method run on each item
+        :param options: dict of keyword arguments for the task
+        :return: list of the task results, in the order of items
+        """
+        options = options or {}
+        finished = {}
+        results = {}
+        fingerprints = {}
+        if cache is not None:
+            for item in items:
+                fingerprints[item] = cache.fingerprint(item, options)
+                if not refresh:
+                    entry = cache.get(item, fingerprints[item])
+                    if entry is not None:
+                        finished[item] = entry
+        todo = [item for item in items if item not in finished]
+        sizes = {}
+        for item in todo:
+            try:
+                sizes[item] = self.arctools.getCount(item)
+            except Exception:
+                sizes[item] = 0
+        schedule = sorted(todo, key=lambda item: sizes[item], reverse=True)
+        if not workers or workers < 1:
+            workers = multiprocessing.cpu_count()
+        workers = max(1, min(workers, len(todo)))
+        logger.info('Checking %s items with %s worker processes (%s unchanged)' % (
+            len(todo), workers, len(finished)))
+
+        def write_out(next_item):
+            # Write out every item whose predecessors are all finished
+            while next_item < len(items) and items[next_item] in finished:
+                item = items[next_item]
+                entry = finished.pop(item)
+                if item in todo:
+                    logger.replay(entry)
+                else:
+                    results[item] = self.replay_cached(item, entry, skip_unchanged)
+                next_item += 1
+            return next_item
+
+        next_item = write_out(0)
+        if todo:
+            pool = _process_pool(workers)
+            try:
+                args = [(item, task, options) for item in schedule]
+                for (item, records, result) in pool.imap_unordered(_qc_report_worker, args):
+                    if cache is not None:
+                        if options.get('repair'):
+                            # Repairs rewrite the data, fingerprint the repaired version
+                            fingerprints[item] = cache.fingerprint(item, options)
+                        cache.put(item, fingerprints[item], records, result)
+                    finished[item] = records
+                    results[item] = result
+                    next_item = write_out(next_item)
+            finally:
+                pool.close()
+                pool.join()
+        return [results.get(item) for item in items]
+
+    def run_checks(self, fc, checks, where_clauses=None, sample_every=100):
+        """
+        Runs several checks in a single cursor pass over a feature class or table.
+        The cursor reads the union of the fields needed by all checks, and
+        every row is handed to each check in turn.
+        Time and bytes read per check are estimated from every sample_every-th
+        row, which is timed check by check, so the other rows pay nothing
+        for the measurement.
+        :param fc: feature class or table
+        :param checks: list of QCCheck instances. Each is closed when done,
+        whether or not the run succeeds.
+        :param where_clauses: optional list of where clauses. Only the rows
+        they select are read, one cursor per clause.
+        :return: list of result dicts, one per check: the check result (see
+        QCCheck.result) plus 'check' (name), 'rows' (rows the check read before
+        it was done), 'seconds' and 'bytes' (estimated for the rows read)
+        """
+        desc = arcpy.Describe(fc)
+        cursor_fields = []
+        check_fields = []
+        for check in checks:
+            names = check.fields(desc)
+            check_fields.append(names)
+            for field in names:
+                if field not in cursor_fields:
+                    cursor_fields.append(field)
+        positions = dict((field, i) for (i, field) in enumerate(cursor_fields))
+        try:
+            for check in checks:
+                check.bind(positions)
+            # Per check: [rows read, sampled rows, sampled seconds, sampled bytes, field indexes]
+            usage = [[0, 0, 0.0, 0, [positions[field] for field in names]] for names in check_fields]
+            active = range(len(checks))
+            adders = [check.add for check in checks]
+            row_count = 0
+            if cursor_fields:
+                logger.info('Scanning %s fields in %s for %s checks' % (
+                    len(cursor_fields), fc, len(checks)))
+                for where_clause in where_clauses or [None]:
+                    with arcpy.da.SearchCursor(fc, cursor_fields, where_clause) as c:
+                        for row in c:
+                            row_count += 1
+                            if row_count % sample_every != 1 and sample_every > 1:
+                                for add in adders:
+                                    add(row)
+                            else:
+                                for k in active:
+                                    start = timer()
+                                    checks[k].add(row)
+                                    usage[k][2] += timer() - start
+                                    usage[k][1] += 1
+                                    usage[k][3] += sum(value_size(row[i]) for i in usage[k][4])
+                            if row_count % 1000 == 0:
+                                # Drop checks that have their answer, stop if none are left
+                                for k in active:
+                                    if checks[k].done:
+                                        usage[k][0] = row_count
+                                active = [k for k in active if not checks[k].done]
+                                adders = [checks[k].add for k in active]
+                                if not adders:
+                                    break
+                    if not adders:
+                        break
+            else:
+                row_count = self.arctools.getCount(fc)
+            for k in active:
+                usage[k][0] = row_count
+            results = []
+            for (check, (rows, sampled, seconds, size, indexes)) in zip(checks, usage):
+                start = timer()
+                check.report(fc, row_count)
+                result = {'check': check.name, 'rows': rows}
+                result.update(check.result())
+                if sampled:
+                    seconds *= rows / sampled
+                    size = int(size * rows / sampled)
+                result['seconds'] = round(seconds + timer() - start, 6)
+                result['bytes'] = size
+                results.append(result)
+            return results
+        finally:
+            for check in checks:
+                check.close()
+
+    def field_name_check(self, fc, field_names=list()):
+        """
+        Check field names in data source
+        :param fc: a data source. If not already in a ESRI-supported format,
+        add list of field names to check in second param
+        :param field_names: optional list of field names to validate
+        :return: list of invalid field names
+        """
+        logger.info('Checking field names in: %s' % fc)
+        import re
+        invalid = []
+        if not field_names:
+            # Use field names defined in the source.
+            field_names = self.arctools.getFieldNames(fc)
+        allowed_patt = '^[a-z][_a-z0-9]*$'
+        for field in field_names:
+            m = re.match(allowed_patt, field, re.IGNORECASE)
+            if m:
+                logger.info('Field name %s ok.' % field)
+            else:
+                logger.warning('Field name %s not valid for ArcGIS' % field)
+                invalid.append(field)
+        if invalid:
+            logger.info('For a list of field name rules, see: '
+                        '\nhttp://support.esri.com/technical-article/000005588 ')
+        return invalid
+
+    def field_type_check(self, fc):
+        """
+        Validate field types against the data actually contained in each field
+        Look for:
+        - numeric data in text field
+        - integer data in a double field (all rounded to integer)
+        Log warnings that we found.
+        :return: result dict (see run_checks)
+        """
+        return self.run_checks(fc, [FieldTypeCheck()])[0]
+
+    def table_completeness(self, fc, sample_size=None, error_bound=None,
+                           method='oid', confidence=0.95):
+        """
+        Check percent of null / blank in each field
+        By default every row is read. Give sample_size or error_bound to
+        estimate the percentages from a random sample instead, with
+        confidence intervals.
+        :param sample_size: number of rows to sample
+        :param error_bound: wanted margin of error as a proportion (0.01 = +/- 1%),
+        used to work out the sample size if sample_size is not given
+        :param method: 'oid' picks one random OID in each of sample_size equal
+        OID ranges and only reads those rows. 'reservoir' reads every OID
+        (but no other field) and keeps a uniform random sample of them.
+        :param confidence: confidence level of the intervals
+        :return: result dict (see run_checks)
+        """
+        if sample_size is None and error_bound is None:
+            return self.run_checks(fc, [TableCompletenessCheck()])[0]
+        population = self.arctools.getCount(fc)
+        if sample_size is None:
+            sample_size = sample_size_for_error(error_bound, population, confidence)
+        if sample_size >= population:
+            logger.info('Sample of %s rows covers the whole table, reading all rows.' % sample_size)
+            return self.run_checks(fc, [TableCompletenessCheck()])[0]
+        oids = self.sample_oids(fc, sample_size, method)
+        oid_field = arcpy.AddFieldDelimiters(fc, arcpy.Describe(fc).OIDFieldName)
+        where_clauses = []
+        for i in range(0, len(oids), 1000):
+            where_clauses.append('%s IN (%s)' % (
+                oid_field, ','.join(str(oid) for oid in oids[i:i + 1000])))
+        return self.run_checks(fc, [TableCompletenessCheck(population, confidence)], where_clauses)[0]
+
+    def sample_oids(self, fc, sample_size, method='oid'):
+        """
+        Draws a random sample of object ids
+        :param method: 'oid' or 'reservoir', see table_completeness
+        :return: sorted list of at most sample_size OIDs
+        """
+        if method == 'reservoir':
+            # Algorithm R over the OID column only
+            sample = []
+            with arcpy.da.SearchCursor(fc, ['OID@']) as c:
+                for (i, row) in enumerate(c):
+                    if i < sample_size:
+                        sample.append(row[0])
+                    else:
+                        j = randint(0, i)
+                        if j < sample_size:
+                            sample[j] = row[0]
+            return sorted(sample)
+        if method != 'oid':
+            raise ValueError('Sampling method must be oid or reservoir')
+        (low, high) = self.arctools.getOIDRange(fc)
+        if low is None:
+            return []
+        # One random OID per stratum. OIDs may have gaps (deleted rows), so
+        # draw extra strata in proportion to the share of missing OIDs.
+        population = self.arctools.getCount(fc)
+        span = high - low + 1
+        strata = min(span, int(math.ceil(sample_size * span / max(1, population))))
+        width = span / strata
+        oids = set()
+        for k in range(strata):
+            start = low + int(k * width)
+            stop = low + int((k + 1) * width) - 1
+            oids.add(randint(start, max(start, stop)))
+        return sorted(oids)
+
+    def null_blank_check(self, val):
+        """
+        Returns true if val is None or a blank / empty string
+        :param val:
+        :return:
+        """
+        if val is None:
+            return True
+        elif isinstance(val, basestring):
+            if len(val.strip()) == 0:
+                return True
+        return False
+
+    def spatial_ref_check(self, filepath):
+        """
+        Checks for inconsistent spatial reference or data sources
+        with no SR in a workspace
+        :return:
+        """
+        logger.info('Checking consistency of spatial references in: %s' % filepath)
+        if not os.path.exists(filepath):
+            logger.warning('%s is not a valid workspace' % filepath)
+            logger.warning('Use a folder or geodatabase path.')
+            return False
+        try:
+            desc = arcpy.Describe(filepath)
+            if desc.dataType in ['Workspace', 'Folder']:
+                # List all items
                 sr_list = defaultdict(list)
                 arcpy.env.workspace = filepath
                 datasets = arcpy.ListFeatureClasses()
@@ -2284,6 +6314,34 @@ class QualityControl(object):
         except IOError:
             logger.warning('Cannot open workspace %s' % filepath)
 
+    def check_geometry(self, fc, workers=1, exterior_clockwise=True):
+        """
+        Checks feature geometry without modifying it (see GeometryValidityCheck).
+        A read-only alternative to repair_geom_zm, so it works on locked data.
+        :param fc: feature class, or a workspace to check all of its feature classes
+        :param workers: number of worker processes used for the feature
+        classes of a workspace, 0 for one per CPU core
+        :param exterior_clockwise: expected orientation of exterior rings
+        (True for Esri shapes)
+        :return: result dict (see run_checks) for a feature class; for a
+        workspace, a list with one entry per item in the order of getAllItems:
+        the item's result dict, or None for items without geometry
+        """
+        data_type = arcpy.Describe(fc).dataType
+        if data_type == 'Workspace':
+            items = [os.path.join(fc, item) for item in self.arctools.getAllItems(fc)]
+            options = {'exterior_clockwise': exterior_clockwise}
+            if workers != 1 and len(items) > 1:
+                return self.qc_items_parallel(items, workers, task='check_geometry', options=options)
+            results = []
+            for item in items:
+                results.append(self.check_geometry(item, **options))
+            return results
+        elif data_type in ['FeatureClass', 'ShapeFile']:
+            return self.run_checks(fc, [GeometryValidityCheck(exterior_clockwise)])[0]
+        else:
+            logger.info('Skipping %s: no geometry (%s)' % (fc, data_type))
+
     def repair_geom_zm(self, fc, remove_z=False, remove_m=False):
         """
         Repairs geometry and removes ZM coords if requested
@@ -2297,6 +6355,8 @@ class QualityControl(object):
         except arcpy.ExecuteError:
             logger.error('%s is locked.' % fc)
             return
+        finally:
+            metadata_cache.invalidate(fc)
         if result.maxSeverity == 0:
             logger.info('No geometry problems in %s' % fc)
         elif result.maxSeverity == 1:
@@ -2331,6 +6391,7 @@ class QualityControl(object):
                 output_fc += '_' + logger.getTS()
                 output_no_zm = os.path.join(output_gdb, output_fc)
             result = arcpy.FeatureClassToFeatureClass_conversion(fc, output_gdb, output_fc)
+            metadata_cache.invalidate(output_no_zm)
             if not result.status == 4:
                 logger.warning('Cannot make a copy in %s' % output_no_zm)
                 return
@@ -2341,99 +6402,83 @@ class QualityControl(object):
         Checks for excessively complex or large multi-part features
         Optional user-specified parameters. Default is reasonably conservative
         to warn users about potential problems in geoprocessing.
-        :return:
+        :return: result dict (see run_checks)
         """
-        vertex_overlimit = 0
-        part_overlimit = 0
-        vertex_max = 0
-        part_max = 0
-        logger.info('Checking complexity of %s features in %s' % (
-            self.arctools.getCount(fc), fc))
-        with arcpy.da.SearchCursor(fc, ['SHAPE@']) as c:
-            for row in c:
-                geom = row[0]
-                if geom is not None:
-                    parts = geom.partCount
-                    if parts > part_max:
-                        part_max = geom.partCount
-                    if parts > part_limit:
-                        part_overlimit += 1
-                    if geom.pointCount > vertex_max:
-                        vertex_max = geom.pointCount
-                    if geom.pointCount > vertex_limit:
-                        vertex_overlimit += 1
-        if vertex_overlimit:
-            logger.warning('%s complex features with more than %s vertices.' % (
-                vertex_overlimit, vertex_limit))
-        if part_overlimit:
-            logger.warning('%s features with more than %s parts.' % (
-                part_overlimit, part_limit))
-        if vertex_overlimit or part_overlimit:
-            logger.info('Tips to reduce complex features: http://arcg.is/2pRuAk9')
-        else:
-            logger.info('No excessively complex features.')
-        logger.info('Maximum vertex count: %s, part count %s' % (vertex_max, part_max))
+        return self.run_checks(fc, [FeatureComplexityCheck(vertex_limit, part_limit)])[0]
 
-    def duplicates(self, fc):
+    def duplicates(self, fc, memory_limit=256 * 1024 * 1024, temp_dir=None):
         """
-        Checks for table rows with duplicate attributes or duplicate
-        geometry. For table rows: hash the tuple in a dict.
-        For geom: hash the WKT geometry
-        :return:
+        Checks for table rows with duplicate attributes. Each row is hashed
+        to a digest, and digests are grouped in memory until memory_limit
+        is reached, then in partitioned temporary files.
+        :param memory_limit: memory budget in bytes for the duplicate index
+        :param temp_dir: folder for temporary files, default is the system temp folder
+        :return: result dict (see run_checks)
         """
         # Duplicate attributes: all fields except OID, SHAPE
-        # Duplicate geom: SHAPE
+        return self.run_checks(fc, [DuplicatesCheck(memory_limit, temp_dir)])[0]
 
-        fields = self.arctools.getFieldNames(fc)
-        try:
-            oid_field = arcpy.Describe(fc).OIDFieldName
-            if oid_field in fields:
-                fields.remove(oid_field)
-        except AttributeError:
-            # Non_ESRI source without an object id
-            pass
-        try:
-            geom_field = arcpy.Describe(fc).SHAPEFieldName
-            if geom_field in fields:
-                fields.remove(geom_field)
-        except AttributeError:
-            # Not a spatial layer
-            pass
+    def duplicate_geoms(self, fc, memory_limit=256 * 1024 * 1024, temp_dir=None):
+        """
+        Checks for features with duplicate geometry, comparing canonical
+        fingerprints of the shapes (see DuplicateGeomsCheck).
+        :param memory_limit: memory budget in bytes for the duplicate index
+        :param temp_dir: folder for temporary files, default is the system temp folder
+        :return: result dict (see run_checks)
+        """
+        return self.run_checks(fc, [DuplicateGeomsCheck(memory_limit, temp_dir)])[0]
 
-        # Check for duplicate attributes
-        logger.info('Checking for duplicate attributes in %s' % fc)
-        collisions = defaultdict(int)
-        with arcpy.da.SearchCursor(fc, fields) as c:
-            for row in c:
-                collisions[row] += 1
-        has_dup = False
-        for (row, count) in collisions.items():
-            if count > 1:
-                logger.warning('%s rows with duplicate attributes: %s' % (count, list(row)))
-                has_dup = True
-        if not has_dup:
-            logger.info('No duplicate attributes found.')
 
-    def duplicate_geoms(self, fc):
-        # Check geometry
-        oid_field = arcpy.Describe(fc).OIDFieldName
-        logger.info('Checking for duplicate gemeotry in %s' % fc)
-        fields = [oid_field, "SHAPE@WKT"]
-        collisions = defaultdict(list)
-        with arcpy.da.SearchCursor(fc, fields) as c:
-            for row in c:
-                oid = row[0]
-                try:
-                    geom_wkt = row[1]
-                except:  # If we cannot make a WKT representation
-                    continue
-                # Hash to avoid huge strings blowing up memory use
-                hash = hashlib.md5(geom_wkt).hexdigest()
-                collisions[hash].append(oid)
-        has_dup = False
-        for (hash, oid_list) in collisions.items():
-            if len(oid_list) > 1:
-                logger.warning('%s duplicate geometries in OIDs: %s' % (len(oid_list), oid_list))
-                has_dup = True
-        if not has_dup:
-            logger.info('No duplicate geometries found.')
+def _qc_report_worker(args):
+    """
+    Runs a quality report on a single item in a worker process.
+    Messages are captured rather than written, and returned to the parent process.
+    :param args: (fc, task, options): full path of a feature class or table,
+    name of the QualityControl method to run and its keyword arguments
+    :return: (fc, list of captured (level, message) pairs, task result)
+    """
+    (fc, task, options) = args
+    qctool = QualityControl(silent=True)
+    buf = logger.startCapture(silent=True)
+    result = None
+    try:
+        result = getattr(qctool, task)(fc, **options)
+    except Exception:
+        logger.error('Quality report failed on %s:\n%s' % (fc, traceback.format_exc()))
+    return (fc, logger.stopCapture(buf), result)
+
+
+def _process_pool(workers):
+    """
+    Returns a multiprocessing pool with the given number of processes
+    (0 or None for one per CPU core).
+    """
+    if not workers or workers < 1:
+        workers = multiprocessing.cpu_count()
+    # Inside ArcMap / ArcGIS Pro sys.executable is the application itself,
+    # so point multiprocessing at the python interpreter instead.
+    if not os.path.basename(sys.executable).lower().startswith('python'):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+    return multiprocessing.Pool(workers)
+
+
+def _csv_export_worker(args):
+    """
+    Exports one OID range of a table to a CSV part file, in a worker process.
+    :param args: (fc, part path, where clause, exportTableToCSV options)
+    :return: (part path, where clause, rows, bytes)
+    """
+    (fc, part_path, where_clause, options) = args
+    (rows, size) = ArcTools(silent=True).exportCSVPart(fc, part_path, where_clause, *options)
+    return (part_path, where_clause, rows, size)
+
+
+def _geometry_stats_worker(args):
+    """
+    Collects GeometryStats for the rows of a feature class selected by a
+    where clause, in a worker process.
+    :param args: (fc, where_clause)
+    :return: GeometryStats object
+    """
+    (fc, where_clause) = args
+    return ArcTools(silent=True).getGeometryStats(fc, where_clause)
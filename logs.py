@@ -29,6 +29,21 @@ screen_fmt = logging.Formatter(
 )
 
 
+class RecordBuffer(logging.Handler):
+    """
+    Keeps (level, message) pairs in memory so they can be replayed later,
+    e.g. to merge messages from worker processes into a single ordered log.
+    """
+
+    def __init__(self, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.records = []
+        self.detached = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+
 class ArcLogger(logging.Logger):
 
     __version__ = "1.8"
@@ -130,6 +145,38 @@ class ArcLogger(logging.Logger):
         arcpy.AddError(msg)
         # self.disk(msg, self.diskLogName, True)
 
+    def startCapture(self, silent=False):
+        # Starts keeping a copy of all messages in memory. If silent, the other
+        # handlers (screen and disk) are detached until stopCapture is called.
+        # Returns the buffer to pass to stopCapture.
+        buf = RecordBuffer()
+        if silent:
+            buf.detached = list(self.handlers)
+            for handler in buf.detached:
+                self.removeHandler(handler)
+        self.addHandler(buf)
+        return buf
+
+    def stopCapture(self, buf):
+        # Stops capturing, re-attaches any detached handlers and returns the
+        # list of captured (level, message) pairs.
+        self.removeHandler(buf)
+        for handler in buf.detached:
+            self.addHandler(handler)
+        return buf.records
+
+    def replay(self, records):
+        # Logs captured (level, message) pairs again, e.g. in the parent process
+        for (level, msg) in records:
+            if level >= logging.ERROR:
+                self.error(msg)
+            elif level >= logging.WARNING:
+                self.warning(msg)
+            elif level >= logging.INFO:
+                self.info(msg)
+            else:
+                self.debug(msg)
+
     def logLevels(self):
         # Print message at different log levels
         self.debug('DEBUG 5')